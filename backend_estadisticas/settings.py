@@ -41,11 +41,14 @@ MIGRATION_MODULES = {
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "stats.middleware.ThresholdGZipMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "stats.middleware.ReplicaPinMiddleware",
+    "stats.middleware.ProfilingMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -70,11 +73,175 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "backend_estadisticas.wsgi.application"
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# --- Base de datos configurable por entorno ---
+# DJANGO_DB_ENGINE=sqlite (por defecto) o postgres. Las conexiones se
+# reutilizan entre peticiones durante DJANGO_DB_CONN_MAX_AGE segundos.
+DB_ENGINE = os.getenv("DJANGO_DB_ENGINE", "sqlite").lower()
+DB_CONN_MAX_AGE = int(os.getenv("DJANGO_DB_CONN_MAX_AGE", "60"))
+
+if DB_ENGINE in {"postgres", "postgresql"}:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv("DJANGO_DB_NAME", "estadisticas"),
+            "USER": os.getenv("DJANGO_DB_USER", "postgres"),
+            "PASSWORD": os.getenv("DJANGO_DB_PASSWORD", ""),
+            "HOST": os.getenv("DJANGO_DB_HOST", "127.0.0.1"),
+            "PORT": os.getenv("DJANGO_DB_PORT", "5432"),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv("DJANGO_DB_PATH", str(BASE_DIR / "db.sqlite3")),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {
+                # Segundos que sqlite3 espera al lock antes de OperationalError
+                "timeout": int(os.getenv("DJANGO_SQLITE_BUSY_TIMEOUT_MS", "5000")) / 1000,
+            },
+        }
     }
+
+# --- Réplica de lectura opcional para los agregados ---
+# SQLite: DJANGO_DB_REPLICA_PATH (sincronizada con `manage.py sync_replica`).
+# PostgreSQL: DJANGO_DB_REPLICA_HOST (réplica en streaming del primario).
+_replica_path = os.getenv("DJANGO_DB_REPLICA_PATH")
+_replica_host = os.getenv("DJANGO_DB_REPLICA_HOST")
+if DB_ENGINE in {"postgres", "postgresql"} and _replica_host:
+    DATABASES["replica"] = {**DATABASES["default"], "HOST": _replica_host, "TEST": {"MIRROR": "default"}}
+elif DB_ENGINE not in {"postgres", "postgresql"} and _replica_path:
+    DATABASES["replica"] = {**DATABASES["default"], "NAME": _replica_path, "TEST": {"MIRROR": "default"}}
+
+STATS_READ_REPLICA_ALIAS = "replica" if "replica" in DATABASES else None
+# Tras una escritura, las lecturas de ese cliente van al primario N segundos
+STATS_REPLICA_STICKY_SECONDS = int(os.getenv("DJANGO_DB_REPLICA_STICKY_SECONDS", "5"))
+# Caché compartida por los workers donde se guarda esa fijación al primario
+STATS_REPLICA_PIN_CACHE = os.getenv("DJANGO_DB_REPLICA_PIN_CACHE", "stats")
+
+# --- Reparto opcional de Playback por hash de song_id (ver `stats.sharding`) ---
+# DJANGO_PLAYBACK_SHARDS=N crea los alias playback_0..N-1: ficheros SQLite en
+# DJANGO_PLAYBACK_SHARD_DIR o bases <DJANGO_DB_NAME>_playback_<i> en PostgreSQL.
+# Cada shard se migra aparte: `manage.py migrate --database playback_0`.
+_shard_count = int(os.getenv("DJANGO_PLAYBACK_SHARDS", "0"))
+_shard_dir = Path(os.getenv("DJANGO_PLAYBACK_SHARD_DIR", str(BASE_DIR / "shards")))
+
+
+def playback_shard_databases(count):
+    """Alias ``playback_<i>`` para ``count`` shards (también los usa ``test_settings``)."""
+    if DB_ENGINE in {"postgres", "postgresql"}:
+        return {f"playback_{i}": {**DATABASES["default"], "NAME": f"{DATABASES['default']['NAME']}_playback_{i}"} for i in range(count)}
+    return {f"playback_{i}": {**DATABASES["default"], "NAME": str(_shard_dir / f"playback_{i}.sqlite3")} for i in range(count)}
+
+
+DATABASES.update(playback_shard_databases(_shard_count))
+STATS_PLAYBACK_SHARDS = [f"playback_{_i}" for _i in range(_shard_count)]
+if _shard_count and DB_ENGINE not in {"postgres", "postgresql"}:
+    _shard_dir.mkdir(parents=True, exist_ok=True)
+# Consultar los shards en paralelo (un hilo por shard) en las lecturas globales
+STATS_SHARD_PARALLEL = os.getenv("STATS_SHARD_PARALLEL", "True") == "True"
+
+DATABASE_ROUTERS = ["stats.sharding.PlaybackShardRouter", "stats.routers.ReadReplicaRouter"]
+
+# PRAGMAs aplicados en cada conexión SQLite nueva (ver `stats.db`).
+# DJANGO_SQLITE_WAL=False vuelve al journal por defecto (rollback journal).
+STATS_SQLITE_PRAGMAS = {
+    # Solo tiene efecto en bases nuevas (o tras VACUUM); permite liberar páginas sin VACUUM completo
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL" if os.getenv("DJANGO_SQLITE_WAL", "True") == "True" else "DELETE",
+    "synchronous": os.getenv("DJANGO_SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("DJANGO_SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "mmap_size": int(os.getenv("DJANGO_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+# Caché compartida por los workers del host (ficheros, sin servicios externos)
+# para los sellos de versión y los resultados de los endpoints de `stats`.
+STATS_CACHE_DIR = os.getenv("STATS_CACHE_DIR", str(BASE_DIR / "cache"))
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "stats": {
+        "BACKEND": os.getenv("STATS_CACHE_BACKEND", "stats.caching.SharedFileCache"),
+        "LOCATION": os.getenv("STATS_CACHE_LOCATION", STATS_CACHE_DIR),
+        "TIMEOUT": int(os.getenv("STATS_CACHE_TIMEOUT", "600")),
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("STATS_CACHE_MAX_ENTRIES", "20000"))},
+    },
+}
+
+# Alias de caché para los sellos de versión (ETag/Last-Modified) de `stats`.
+# Con varios workers debe ser una caché compartida.
+STATS_STAMP_CACHE = "stats"
+# Alias de caché de resultados (ver `stats.caching`); vacío lo desactiva
+STATS_RESULT_CACHE = os.getenv("STATS_RESULT_CACHE", "stats") or None
+
+# Resolver los song_id de las valoraciones en un hilo del propio proceso.
+# Con False solo los resuelve `manage.py resolve_song_ids`.
+STATS_RESOLVE_IN_BACKGROUND = os.getenv("STATS_RESOLVE_IN_BACKGROUND", "True") == "True"
+
+# Circuit breaker del servicio de contenidos (ver `stats.breaker`)
+STATS_BREAKERS = {
+    "content": {
+        "failure_rate": float(os.getenv("STATS_CONTENT_BREAKER_FAILURE_RATE", "0.5")),
+        "window": int(os.getenv("STATS_CONTENT_BREAKER_WINDOW", "20")),
+        "min_calls": int(os.getenv("STATS_CONTENT_BREAKER_MIN_CALLS", "5")),
+        "open_seconds": float(os.getenv("STATS_CONTENT_BREAKER_OPEN_SECONDS", "30")),
+        "half_open_probes": int(os.getenv("STATS_CONTENT_BREAKER_PROBES", "1")),
+    },
+}
+# Segundos que se conserva la última respuesta buena de contenidos
+STATS_CONTENT_STALE_TTL = int(os.getenv("STATS_CONTENT_STALE_TTL", str(24 * 3600)))
+
+# Streams SSE de contadores en vivo (/api/v1/stats/live)
+STATS_LIVE_INTERVAL = float(os.getenv("STATS_LIVE_INTERVAL", "1"))
+STATS_LIVE_HEARTBEAT_SECONDS = int(os.getenv("STATS_LIVE_HEARTBEAT_SECONDS", "15"))
+STATS_LIVE_RESYNC_SECONDS = int(os.getenv("STATS_LIVE_RESYNC_SECONDS", "60"))
+STATS_LIVE_MAX_KEYS = int(os.getenv("STATS_LIVE_MAX_KEYS", "500"))
+
+# Perfilado bajo demanda (cabecera X-Stats-Profile firmada o muestreo)
+STATS_PROFILE_SAMPLE_RATE = float(os.getenv("STATS_PROFILE_SAMPLE_RATE", "0"))
+STATS_PROFILE_MODE = os.getenv("STATS_PROFILE_MODE", "sample")  # sample | cprofile
+STATS_PROFILE_INTERVAL_MS = float(os.getenv("STATS_PROFILE_INTERVAL_MS", "5"))
+STATS_PROFILE_DIR = os.getenv("STATS_PROFILE_DIR", str(BASE_DIR / "profiles"))
+# Perfiles que se conservan en STATS_PROFILE_DIR (los más antiguos se borran); 0 sin límite
+STATS_PROFILE_MAX_FILES = int(os.getenv("STATS_PROFILE_MAX_FILES", "500"))
+STATS_PROFILE_TOKEN_MAX_AGE = int(os.getenv("STATS_PROFILE_TOKEN_MAX_AGE", "3600"))
+
+# Retención de reproducciones crudas (manage.py compact_playbacks)
+STATS_PLAYBACK_RETENTION_DAYS = int(os.getenv("STATS_PLAYBACK_RETENTION_DAYS", "365"))
+STATS_RETENTION_CACHE_SECONDS = int(os.getenv("STATS_RETENTION_CACHE_SECONDS", "30"))
+# Archivo columnar de meses cerrados (manage.py archive_playbacks)
+STATS_ARCHIVE_DIR = os.getenv("STATS_ARCHIVE_DIR", str(BASE_DIR / "archive"))
+
+# Motor analítico en memoria (NumPy) para los agregados; opcional
+STATS_ANALYTICS_ENGINE = os.getenv("STATS_ANALYTICS_ENGINE", "False") == "True"
+STATS_ANALYTICS_FULL_RELOAD_SECONDS = int(os.getenv("STATS_ANALYTICS_FULL_RELOAD_SECONDS", "300"))
+
+# Coalescencia de peticiones idénticas concurrentes (ver `stats.singleflight`).
+# STATS_SINGLEFLIGHT_CACHE: alias de caché compartida para coalescer también entre workers.
+STATS_SINGLEFLIGHT_CACHE = os.getenv("STATS_SINGLEFLIGHT_CACHE") or None
+STATS_SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv("STATS_SINGLEFLIGHT_WAIT_SECONDS", "10"))
+STATS_SINGLEFLIGHT_RESULT_SECONDS = int(os.getenv("STATS_SINGLEFLIGHT_RESULT_SECONDS", "2"))
+
+# Cola de tareas en base de datos (ver `stats.tasks`, `manage.py stats_worker`).
+# Con True las peticiones encolan la normalización, la discográfica de las
+# reproducciones y el enriquecimiento en lugar de hacerlos en línea.
+STATS_TASKS_ENABLED = os.getenv("STATS_TASKS_ENABLED", "False") == "True"
+STATS_TASK_PROCESSES = int(os.getenv("STATS_TASK_PROCESSES", "2"))
+STATS_TASK_RETRY_BASE_SECONDS = float(os.getenv("STATS_TASK_RETRY_BASE_SECONDS", "5"))
+STATS_TASK_RETRY_MAX_SECONDS = float(os.getenv("STATS_TASK_RETRY_MAX_SECONDS", "600"))
+STATS_TASK_KEEP_DONE_SECONDS = int(os.getenv("STATS_TASK_KEEP_DONE_SECONDS", str(24 * 3600)))
+# Segundos que un proceso no vuelve a encolar la misma tarea desde la ingesta
+STATS_TASK_ENQUEUE_DEDUP_SECONDS = int(os.getenv("STATS_TASK_ENQUEUE_DEDUP_SECONDS", "60"))
+# Máximo de tareas simultáneas por tipo (sustituye al del registro), p. ej. {"playback_label": 8}
+STATS_TASK_CONCURRENCY = {}
+
+# Filtro en memoria de ids de evento de reproducciones ya vistos
+STATS_PLAY_DEDUP = {
+    "window_seconds": int(os.getenv("STATS_PLAY_DEDUP_WINDOW", "3600")),
+    "capacity": int(os.getenv("STATS_PLAY_DEDUP_CAPACITY", "1000000")),
+    "error_rate": float(os.getenv("STATS_PLAY_DEDUP_ERROR_RATE", "0.001")),
 }
 
 REST_FRAMEWORK = {
@@ -83,8 +250,16 @@ REST_FRAMEWORK = {
         "rest_framework.authentication.BasicAuthentication",
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    # Mismo JSON que JSONRenderer, codificado con orjson
+    "DEFAULT_RENDERER_CLASSES": (
+        "stats.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
+# Respuestas a partir de este tamaño se comprimen con gzip si el cliente lo acepta
+STATS_GZIP_MIN_BYTES = int(os.getenv("STATS_GZIP_MIN_BYTES", "1024"))
+
 AUTH_PASSWORD_VALIDATORS = []
 
 LANGUAGE_CODE = "es-es"
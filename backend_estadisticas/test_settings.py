@@ -0,0 +1,14 @@
+"""Settings for ``manage.py test`` (``manage.py`` picks them for that command).
+
+Same as ``settings`` plus the two ``playback_<i>`` aliases the sharding tests
+use (sharding itself stays off unless a test turns it on) and in-memory
+caches, since the on-disk ``stats`` cache would outlive the test database.
+"""
+from .settings import *  # noqa: F401,F403
+from .settings import CACHES, DATABASES, STATS_PLAYBACK_SHARDS, playback_shard_databases
+
+if not STATS_PLAYBACK_SHARDS:
+    DATABASES.update(playback_shard_databases(2))
+
+CACHES["stats"] = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "stats-test"}
+STATS_RESULT_CACHE = None
@@ -0,0 +1,149 @@
+"""Aggregate-query benchmark: SQL ``GROUP BY`` vs the in-process analytics engine.
+
+Fills a throw-away SQLite file with ``--rows`` plays and ``--ratings``
+ratings spread over a few thousand songs, artists and labels, then times the
+queries behind the aggregate endpoints twice: as the ORM ``GROUP BY`` they
+used to run and through ``stats.analytics`` (first load and warm queries
+reported separately).
+
+Usage::
+
+    python benchmarks/bench_analytics.py --rows 10000000 --ratings 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _timed(fn, repeat):
+	best = None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		fn()
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return round(best * 1000, 2)
+
+
+def fill(rows: int, ratings: int, songs: int, seed: int = 7):
+	from django.contrib.auth import get_user_model
+	from django.db import connection, transaction
+	from stats.models import Playback, Rating
+
+	rng = random.Random(seed)
+	base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+	span = 180 * 24 * 3600
+	user = get_user_model().objects.create(username="bench")
+	plays_sql = (
+		f"INSERT INTO {Playback._meta.db_table} (song_id, seconds, valid, played_at, label_id) "
+		"VALUES (%s, %s, %s, %s, %s)"
+	)
+	ratings_sql = (
+		f"INSERT INTO {Rating._meta.db_table} "
+		"(user_id, song_id, artist_id, stars, comment, label_id, rated_at, resolution_pending) "
+		"VALUES (%s, %s, %s, %s, '', %s, %s, 0)"
+	)
+	adapt = connection.ops.adapt_datetimefield_value
+	batch = 50_000
+	with transaction.atomic(), connection.cursor() as cursor:
+		for lo in range(0, rows, batch):
+			chunk = []
+			for _ in range(min(batch, rows - lo)):
+				song = rng.randrange(songs)
+				when = base + timedelta(seconds=rng.randrange(span))
+				chunk.append((f"s{song}", rng.randrange(240), rng.random() < 0.9, adapt(when), f"l{song % 50}"))
+			cursor.executemany(plays_sql, chunk)
+		for lo in range(0, ratings, batch):
+			chunk = []
+			for _ in range(min(batch, ratings - lo)):
+				song = rng.randrange(songs)
+				when = base + timedelta(seconds=rng.randrange(span))
+				chunk.append((user.pk, f"s{song}", f"a{song % 500}", rng.randint(1, 5), f"l{song % 50}", adapt(when)))
+			cursor.executemany(ratings_sql, chunk)
+
+
+def run(args) -> dict:
+	import django
+
+	sys.path.insert(0, str(ROOT))
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend_estadisticas.settings")
+	django.setup()
+
+	from django.core.management import call_command
+	from django.db.models import Avg, Count
+	from stats import analytics
+	from stats.models import Playback, Rating
+
+	call_command("migrate", verbosity=0)
+	started = time.perf_counter()
+	fill(args.rows, args.ratings, args.songs)
+	filled = round(time.perf_counter() - started, 2)
+
+	sql = {
+		"plays_by_song": lambda: list(
+			Playback.objects.filter(valid=True).order_by().values("song_id").annotate(n=Count("id"))
+		),
+		"top_songs": lambda: list(
+			Playback.objects.order_by().values("song_id").annotate(n=Count("id")).order_by("-n")[:10]
+		),
+		"song_count": lambda: Playback.objects.filter(song_id="s1").count(),
+		"artists_ratings": lambda: list(
+			Rating.objects.order_by().values("artist_id").annotate(n=Count("id"), avg=Avg("stars"))
+		),
+	}
+	engine = {
+		"plays_by_song": lambda: analytics.playbacks.count_by("song", valid=True),
+		"top_songs": lambda: analytics.playbacks.top("song", 10),
+		"song_count": lambda: analytics.playbacks.count(song="s1"),
+		"artists_ratings": lambda: analytics.ratings.stats_by("artist"),
+	}
+
+	started = time.perf_counter()
+	analytics.playbacks.refresh(force=True)
+	analytics.ratings.refresh(force=True)
+	load = round(time.perf_counter() - started, 2)
+
+	return {
+		"rows": args.rows,
+		"ratings": args.ratings,
+		"fill_seconds": filled,
+		"engine_load_seconds": load,
+		"queries_ms": {
+			name: {"sql": _timed(sql[name], args.repeat), "engine": _timed(engine[name], args.repeat)}
+			for name in sql
+		},
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--rows", type=int, default=10_000_000, help="plays to insert")
+	parser.add_argument("--ratings", type=int, default=1_000_000)
+	parser.add_argument("--songs", type=int, default=5000)
+	parser.add_argument("--repeat", type=int, default=3, help="runs per query; the best one is reported")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		os.environ.update({
+			"DJANGO_DB_ENGINE": "sqlite",
+			"DJANGO_DB_PATH": os.path.join(tmp, "bench.sqlite3"),
+			"STATS_ANALYTICS_ENGINE": "True",
+		})
+		result = run(args)
+
+	print(json.dumps({k: v for k, v in result.items() if k != "queries_ms"}))
+	for name, times in result["queries_ms"].items():
+		speedup = times["sql"] / times["engine"] if times["engine"] else float("inf")
+		print(f"{name:>16}: sql {times['sql']:>9.2f} ms  engine {times['engine']:>8.2f} ms  x{speedup:.1f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,125 @@
+"""Concurrent play-insert benchmark for the database profiles.
+
+Runs the same write workload against a throw-away SQLite file twice: once
+with the old defaults (rollback journal, ``synchronous=FULL``, a new
+connection per request) and once with the tuned profile from
+``backend_estadisticas.settings`` (WAL, ``synchronous=NORMAL``, persistent
+connections). Each thread simulates requests that insert one ``Playback`` and
+then finish the request like Django's request cycle does.
+
+Usage::
+
+    python benchmarks/bench_db_writes.py --threads 8 --writes 300
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+PROFILES = {
+	"before": {
+		"DJANGO_SQLITE_WAL": "False",
+		"DJANGO_SQLITE_SYNCHRONOUS": "FULL",
+		"DJANGO_SQLITE_MMAP_SIZE": "0",
+		"DJANGO_DB_CONN_MAX_AGE": "0",
+	},
+	"after": {
+		"DJANGO_SQLITE_WAL": "True",
+		"DJANGO_SQLITE_SYNCHRONOUS": "NORMAL",
+		"DJANGO_DB_CONN_MAX_AGE": "60",
+	},
+}
+
+
+def run_workload(threads: int, writes: int) -> dict:
+	import django
+
+	sys.path.insert(0, str(ROOT))
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend_estadisticas.settings")
+	django.setup()
+
+	from django.core.management import call_command
+	from django.db import close_old_connections, connection, OperationalError
+	from stats.models import Playback
+
+	call_command("migrate", verbosity=0)
+	connection.close()
+
+	errors = []
+	latencies = []
+	lock = threading.Lock()
+
+	def worker(n: int):
+		local = []
+		for i in range(writes):
+			start = time.perf_counter()
+			try:
+				Playback.objects.create(song_id=f"bench-{n}-{i % 50}", seconds=30)
+			except OperationalError as exc:
+				with lock:
+					errors.append(str(exc))
+			finally:
+				# Equivalente a request_finished: cierra si CONN_MAX_AGE expiró
+				close_old_connections()
+			local.append(time.perf_counter() - start)
+		with lock:
+			latencies.extend(local)
+		connection.close()
+
+	pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+	started = time.perf_counter()
+	for t in pool:
+		t.start()
+	for t in pool:
+		t.join()
+	elapsed = time.perf_counter() - started
+
+	latencies.sort()
+	done = len(latencies) - len(errors)
+	return {
+		"writes": done,
+		"errors": len(errors),
+		"seconds": round(elapsed, 3),
+		"writes_per_second": round(done / elapsed, 1) if elapsed else None,
+		"p50_ms": round(latencies[len(latencies) // 2] * 1000, 2) if latencies else None,
+		"p99_ms": round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 2) if latencies else None,
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--threads", type=int, default=8)
+	parser.add_argument("--writes", type=int, default=300, help="writes per thread")
+	parser.add_argument("--child", choices=sorted(PROFILES), help=argparse.SUPPRESS)
+	args = parser.parse_args()
+
+	if args.child:
+		print(json.dumps(run_workload(args.threads, args.writes)))
+		return
+
+	results = {}
+	for name, overrides in PROFILES.items():
+		with tempfile.TemporaryDirectory() as tmp:
+			env = {**os.environ, **overrides, "DJANGO_DB_ENGINE": "sqlite", "DJANGO_DB_PATH": os.path.join(tmp, "bench.sqlite3")}
+			out = subprocess.run(
+				[sys.executable, __file__, "--child", name, "--threads", str(args.threads), "--writes", str(args.writes)],
+				env=env, check=True, capture_output=True, text=True,
+			)
+			results[name] = json.loads(out.stdout.strip().splitlines()[-1])
+
+	for name, res in results.items():
+		print(f"{name:>6}: {res}")
+	before, after = results["before"]["writes_per_second"], results["after"]["writes_per_second"]
+	if before and after:
+		print(f"speedup: x{after / before:.2f}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,128 @@
+"""``rebuild_rollups`` benchmark: wall time with 1, 2, 4 … worker processes.
+
+Fills a throw-away SQLite file with ``--plays`` plays (spread over
+``--songs`` songs, 20 labels and 90 days) plus a tenth as many sales and
+ratings, then runs ``manage.py rebuild_rollups --workers N`` for each
+``--workers`` value. It reports the wall time, the raw rows read per second
+and the speedup over one worker, and checks that every run writes the same
+rollups and sketches.
+
+The speedup is bounded by the cores of the machine (``os.cpu_count()`` is
+printed) and by the final write, which is not parallel.
+
+Usage::
+
+    python benchmarks/bench_rebuild.py --plays 2000000 --workers 1,2,4,8
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def fill(plays: int, songs: int, seed: int = 7):
+	from django.contrib.auth import get_user_model
+	from django.db import connection, transaction
+	from stats.models import AlbumSale, Playback, Rating
+
+	rng = random.Random(seed)
+	user = get_user_model().objects.create(username="bench")
+
+	def stamp():
+		return f"2024-{1 + rng.randrange(3):02d}-{1 + rng.randrange(28):02d} {rng.randrange(24):02d}:00:00"
+
+	batch = 50_000
+	with transaction.atomic(), connection.cursor() as cursor:
+		sql = (
+			f"INSERT INTO {Playback._meta.db_table} (song_id, seconds, valid, played_at, label_id) "
+			"VALUES (%s, %s, %s, %s, %s)"
+		)
+		for lo in range(0, plays, batch):
+			chunk = []
+			for _ in range(min(batch, plays - lo)):
+				song = rng.randrange(songs)
+				chunk.append((f"s{song}", rng.randrange(1, 300), rng.random() < 0.9, stamp(), f"lab-{song % 20}"))
+			cursor.executemany(sql, chunk)
+		cursor.executemany(
+			f"INSERT INTO {AlbumSale._meta.db_table} (album_id, units, amount, currency, purchased_at, label_id) "
+			"VALUES (%s, %s, %s, %s, %s, %s)",
+			[
+				(f"al{rng.randrange(songs // 10 + 1)}", 1 + rng.randrange(3), "9.99", rng.choice(["EUR", "USD"]), stamp(), f"lab-{rng.randrange(20)}")
+				for _ in range(plays // 10)
+			],
+		)
+		cursor.executemany(
+			f"INSERT INTO {Rating._meta.db_table} "
+			"(user_id, song_id, artist_id, stars, comment, label_id, rated_at, resolution_pending) "
+			"VALUES (%s, %s, NULL, %s, '', %s, %s, 0)",
+			[
+				(user.pk, f"s{rng.randrange(songs)}", rng.randint(1, 5), f"lab-{rng.randrange(20)}", stamp())
+				for _ in range(plays // 10)
+			],
+		)
+
+
+def fingerprint() -> str:
+	"""Hash of every rollup and sketch row, to compare the runs."""
+	from stats.models import LabelDailyRevenue, LabelDailyRollup, ListenDurationSketch, SongDailyRollup
+
+	digest = hashlib.blake2b(digest_size=12)
+	for model in (LabelDailyRollup, LabelDailyRevenue, SongDailyRollup, ListenDurationSketch):
+		fields = [f.name for f in model._meta.fields if f.name != "id"]
+		for row in model.objects.order_by(*fields[:3]).values_list(*fields):
+			digest.update(repr(row).encode())
+	return digest.hexdigest()
+
+
+def run(args):
+	import django
+
+	sys.path.insert(0, str(ROOT))
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend_estadisticas.settings")
+	django.setup()
+
+	from django.core.management import call_command
+
+	call_command("migrate", verbosity=0)
+	started = time.perf_counter()
+	fill(args.plays, args.songs)
+	filled = round(time.perf_counter() - started, 2)
+	raw_rows = args.plays + 2 * (args.plays // 10)
+
+	runs = {}
+	for workers in [int(w) for w in args.workers.split(",")]:
+		started = time.perf_counter()
+		call_command("rebuild_rollups", workers=workers, stdout=io.StringIO())
+		seconds = time.perf_counter() - started
+		runs[workers] = {"seconds": round(seconds, 2), "rows_per_s": round(raw_rows / seconds), "fingerprint": fingerprint()}
+	return {"plays": args.plays, "raw_rows": raw_rows, "fill_seconds": filled, "cpus": os.cpu_count(), "runs": runs}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--plays", type=int, default=2_000_000)
+	parser.add_argument("--songs", type=int, default=20_000)
+	parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		os.environ.update({"DJANGO_DB_ENGINE": "sqlite", "DJANGO_DB_PATH": os.path.join(tmp, "bench.sqlite3")})
+		result = run(args)
+
+	print(json.dumps({k: v for k, v in result.items() if k != "runs"}))
+	base = next(iter(result["runs"].values()))["seconds"]
+	for workers, r in result["runs"].items():
+		same = "same rollups" if r["fingerprint"] == next(iter(result["runs"].values()))["fingerprint"] else "ROLLUPS DIFFER"
+		print(f"{workers:>3} workers: {r['seconds']:>8.2f} s  {r['rows_per_s']:>10,} rows/s  x{base / r['seconds']:.2f}  ({same})")
+
+
+if __name__ == "__main__":
+	main()
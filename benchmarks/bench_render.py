@@ -0,0 +1,133 @@
+"""Response rendering benchmark: DRF ``JSONRenderer`` vs ``FastJSONRenderer``, plus gzip.
+
+Builds two payloads shaped like the largest stats responses, an enriched
+``artists/aggregate?limit=1000&enrich=1`` leaderboard and a page of
+``songs/<id>/ratings``, then reports per request:
+
+- CPU time to encode with DRF's renderer and with ``FastJSONRenderer``;
+- CPU time of a result-cache hit: unpickle the data and render it (before)
+  vs unpickle the pre-encoded body (now);
+- body size raw and gzipped, and the CPU time gzip adds.
+
+No database is needed.
+
+Usage::
+
+    python benchmarks/bench_render.py --items 1000 --repeat 50
+"""
+import argparse
+import gzip
+import json
+import os
+import pickle
+import random
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def _cpu(fn, repeat):
+	"""Best CPU time of ``fn`` over ``repeat`` runs, in ms."""
+	best = None
+	for _ in range(repeat):
+		started = time.process_time()
+		fn()
+		elapsed = time.process_time() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return round(best * 1000, 3)
+
+
+def leaderboard(items: int, rng) -> dict:
+	page = []
+	for i in range(items):
+		page.append({
+			"artist_id": f"artist-{i}",
+			"plays": rng.randrange(10_000_000),
+			"valid_plays": rng.randrange(10_000_000),
+			"ratings_count": rng.randrange(100_000),
+			"ratings_average": round(rng.uniform(1, 5), 2),
+			"revenue": Decimal(f"{rng.uniform(0, 100000):.2f}"),
+			"artist": {
+				"id": f"artist-{i}",
+				"name": f"Artista número {i}",
+				"image": f"https://cdn.example.com/artists/{i}/cover.jpg",
+				"genres": ["pop", "indie", "rock"][: 1 + i % 3],
+				"country": "ES",
+			},
+		})
+	return {"total": items * 3, "limit": items, "offset": 0, "items": page}
+
+
+def rating_page(items: int, rng) -> dict:
+	base = datetime(2024, 1, 1, tzinfo=timezone.utc)
+	results = [
+		{
+			"id": i,
+			"user_id": rng.randrange(1000),
+			"username": f"user{rng.randrange(1000)}",
+			"song_id": "song-1",
+			"artist_id": "artist-1",
+			"stars": rng.randint(1, 5),
+			"comment": "Muy buena canción, la escucho a diario" if i % 3 else "",
+			# serialize_rating_rows ya entrega las fechas como texto
+			"rated_at": (base + timedelta(seconds=rng.randrange(10_000_000))).isoformat().replace("+00:00", "Z"),
+			"resolution_pending": False,
+			"label_id": "label-1",
+		}
+		for i in range(items)
+	]
+	return {"count": items * 10, "next": None, "previous": None, "results": results}
+
+
+def measure(data, repeat) -> dict:
+	from rest_framework.renderers import JSONRenderer
+	from stats.renderers import FastJSONRenderer
+
+	drf, fast = JSONRenderer(), FastJSONRenderer()
+	body = fast.render(data)
+	assert body == drf.render(data), "FastJSONRenderer output differs from JSONRenderer"
+	pickled_data, pickled_body = pickle.dumps(data), pickle.dumps((body, 200))
+	zipped = gzip.compress(body, compresslevel=6)
+	return {
+		"bytes": len(body),
+		"gzip_bytes": len(zipped),
+		"encode_ms": {"drf": _cpu(lambda: drf.render(data), repeat), "fast": _cpu(lambda: fast.render(data), repeat)},
+		"cache_hit_ms": {
+			"data": _cpu(lambda: drf.render(pickle.loads(pickled_data)), repeat),
+			"pre_encoded": _cpu(lambda: pickle.loads(pickled_body), repeat),
+		},
+		"gzip_ms": _cpu(lambda: gzip.compress(body, compresslevel=6), repeat),
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--items", type=int, default=1000, help="rows per payload")
+	parser.add_argument("--repeat", type=int, default=50, help="runs per measure; the best one is reported")
+	args = parser.parse_args()
+
+	import django
+
+	sys.path.insert(0, str(ROOT))
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend_estadisticas.settings")
+	django.setup()
+
+	rng = random.Random(7)
+	payloads = {"artists_aggregate": leaderboard(args.items, rng), "song_ratings": rating_page(args.items, rng)}
+	results = {name: measure(data, args.repeat) for name, data in payloads.items()}
+	print(json.dumps({"items": args.items, "repeat": args.repeat}))
+	for name, r in results.items():
+		enc, hit = r["encode_ms"], r["cache_hit_ms"]
+		print(
+			f"{name:>18}: encode drf {enc['drf']:>7.2f} ms  fast {enc['fast']:>6.2f} ms  x{enc['drf'] / max(enc['fast'], 1e-3):.1f}"
+			f" | cache hit {hit['data']:>7.2f} -> {hit['pre_encoded']:>5.2f} ms"
+			f" | {r['bytes']:>8} B -> gzip {r['gzip_bytes']:>7} B ({r['gzip_bytes'] / r['bytes']:.0%}, +{r['gzip_ms']:.2f} ms)"
+		)
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,140 @@
+"""Comment search benchmark: ``LIKE '%word%'`` scans vs the full-text index.
+
+Fills a throw-away SQLite file with ``--ratings`` ratings whose comments are
+drawn from a ``--vocabulary`` of made-up words with Zipf frequencies (like
+real text: a few very common words, a long tail of rare ones). It then
+times queries of common, mid and rare words through ``stats.search`` and
+as ``icontains`` filters (what a LIKE search runs). Both return the first
+page and the total.
+
+Usage::
+
+    python benchmarks/bench_search.py --ratings 1000000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+SYLLABLES = "ba be bi bo bu ca ce ci co cu da de di do du la le li lo lu ma me mi mo mu na ne ni no nu ra re ri ro ru ta te ti to tu".split()
+
+
+def vocabulary(size: int, rng) -> list:
+	words = set()
+	while len(words) < size:
+		words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+	return sorted(words)
+
+
+def queries(words) -> dict:
+	"""Queries by word frequency rank (``words`` is sorted most common first)."""
+	return {
+		"common": words[5],
+		"mid": words[200],
+		"rare": words[len(words) // 2],
+		"two mid": f"{words[100]} {words[300]}",
+		"prefix": words[50][:4] + "*",
+	}
+
+
+def _timed(fn, repeat):
+	best = None
+	for _ in range(repeat):
+		started = time.perf_counter()
+		fn()
+		elapsed = time.perf_counter() - started
+		best = elapsed if best is None else min(best, elapsed)
+	return round(best * 1000, 2)
+
+
+def fill(ratings: int, words, seed: int = 7):
+	from django.contrib.auth import get_user_model
+	from django.db import connection, transaction
+	from stats.models import Rating
+
+	rng = random.Random(seed)
+	cum_weights, total = [], 0.0
+	for rank in range(1, len(words) + 1):
+		total += 1 / rank
+		cum_weights.append(total)
+	user = get_user_model().objects.create(username="bench")
+	sql = (
+		f"INSERT INTO {Rating._meta.db_table} "
+		"(user_id, song_id, artist_id, stars, comment, label_id, rated_at, resolution_pending) "
+		"VALUES (%s, %s, %s, %s, %s, NULL, '2024-01-01 00:00:00', 0)"
+	)
+	batch = 50_000
+	with transaction.atomic(), connection.cursor() as cursor:
+		for lo in range(0, ratings, batch):
+			chunk = []
+			for _ in range(min(batch, ratings - lo)):
+				song = rng.randrange(5000)
+				comment = " ".join(rng.choices(words, cum_weights=cum_weights, k=rng.randint(3, 25)))
+				chunk.append((user.pk, f"s{song}", f"a{song % 500}", rng.randint(1, 5), comment))
+			cursor.executemany(sql, chunk)
+
+
+def run(args):
+	import django
+
+	sys.path.insert(0, str(ROOT))
+	os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend_estadisticas.settings")
+	django.setup()
+
+	from django.core.management import call_command
+	from stats import search
+	from stats.models import Rating
+
+	call_command("migrate", verbosity=0)
+	words = vocabulary(args.vocabulary, random.Random(1))
+	random.Random(2).shuffle(words)
+	started = time.perf_counter()
+	fill(args.ratings, words)
+	filled = round(time.perf_counter() - started, 2)
+
+	def like(q):
+		qs = Rating.objects.all()
+		for word, _ in search.terms(q):
+			qs = qs.filter(comment__icontains=word)
+		qs = qs.order_by("-rated_at", "-id")
+		return qs.count(), list(qs.values_list("pk", flat=True)[:20])
+
+	return {
+		"ratings": args.ratings,
+		"fill_seconds": filled,
+		"queries_ms": {
+			f"{name} ({q})": {
+				"like": _timed(lambda: like(q), args.repeat),
+				"fts": _timed(lambda: search.search(q, using="default"), args.repeat),
+				"total": search.search(q, using="default")[0],
+			}
+			for name, q in queries(words).items()
+		},
+	}
+
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+	parser.add_argument("--ratings", type=int, default=1_000_000)
+	parser.add_argument("--vocabulary", type=int, default=20_000, help="distinct words")
+	parser.add_argument("--repeat", type=int, default=3, help="runs per query; the best one is reported")
+	args = parser.parse_args()
+
+	with tempfile.TemporaryDirectory() as tmp:
+		os.environ.update({"DJANGO_DB_ENGINE": "sqlite", "DJANGO_DB_PATH": os.path.join(tmp, "bench.sqlite3")})
+		result = run(args)
+
+	print(json.dumps({k: v for k, v in result.items() if k != "queries_ms"}))
+	for q, times in result["queries_ms"].items():
+		speedup = times["like"] / times["fts"] if times["fts"] else float("inf")
+		print(f"{q:>28}: like {times['like']:>9.2f} ms  fts {times['fts']:>8.2f} ms  x{speedup:.1f}  ({times['total']} hits)")
+
+
+if __name__ == "__main__":
+	main()
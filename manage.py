@@ -7,6 +7,9 @@ import sys
 def main():
     """Run administrative tasks."""
     # Switch default settings module to the consolidated backend package.
+    # `manage.py test` uses the test settings (shard aliases, in-memory caches).
+    if sys.argv[1:2] == ['test']:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_estadisticas.test_settings')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend_estadisticas.settings')
     try:
         from django.core.management import execute_from_command_line
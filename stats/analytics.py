@@ -0,0 +1,284 @@
+"""Optional in-process analytics engine over ``Playback`` and ``Rating`` facts.
+
+With ``STATS_ANALYTICS_ENGINE`` enabled, aggregate endpoints answer from
+NumPy column arrays held in each worker instead of issuing a SQL query per
+slice. String keys (song, artist, label) are dictionary-encoded to int32
+codes, so a group-by is a ``bincount`` over a boolean filter mask and a
+top-K is an ``argpartition``.
+
+Freshness: before each query the engine compares the model's version stamp
+(``stats.versioning``) with the one it last loaded. When it changed, rows
+with an id above the loaded watermark are appended. Updates and deletes
+made by this process mark the table for a full reload. Changes made by
+other workers that are not inserts are picked up by the full reload every
+``STATS_ANALYTICS_FULL_RELOAD_SECONDS``. Only raw rows are held; compacted
+history (``stats.retention``) is added by the callers as before.
+
+Rows are loaded from where they are written: ``Playback`` from every
+playback shard when sharding is on, everything else from ``default``. The
+read replica is never used, since the version stamps that trigger a reload
+describe the primary.
+"""
+import threading
+import time
+
+import numpy as np
+from django.conf import settings
+
+from . import retention, sharding
+from .utils import get_playback_model, get_rating_model
+from .versioning import get_stamps
+
+CHUNK = 50_000
+
+
+def enabled() -> bool:
+	return bool(getattr(settings, "STATS_ANALYTICS_ENGINE", False))
+
+
+class Dictionary:
+	"""str <-> int32 code mapping; ``None`` and ``""`` map to -1."""
+
+	def __init__(self):
+		self.codes = {}
+		self.values = []
+
+	def encode(self, value) -> int:
+		if value is None or value == "":
+			return -1
+		code = self.codes.get(value)
+		if code is None:
+			code = self.codes[value] = len(self.values)
+			self.values.append(value)
+		return code
+
+	def lookup(self, value) -> int | None:
+		return self.codes.get(value)
+
+
+class FactTable:
+	"""Append-only columns for one model, loaded by increasing id."""
+
+	model_getter = None
+	scope = ""
+	time_field = ""
+	# nombre de columna -> (campo del modelo, dtype, diccionario o None)
+	columns = {}
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._reset()
+
+	def _reset(self):
+		self.dicts = {name: Dictionary() for name, (_, _, encoded) in self.columns.items() if encoded}
+		self.data = {name: np.empty(0, dtype=dtype) for name, (_, dtype, _) in self.columns.items()}
+		self.data["epoch"] = np.empty(0, dtype=np.int64)
+		self.size = 0
+		# Último id cargado por base (cada shard numera por su cuenta)
+		self.last_ids = {}
+		self.stamp = None
+		self.loaded_at = 0.0
+		self.raw_since = None
+		self.needs_reload = False
+
+	def invalidate(self):
+		self.needs_reload = True
+
+	def _append(self, rows):
+		n = len(rows)
+		needed = self.size + n
+		for name in self.data:
+			col = self.data[name]
+			if needed > len(col):
+				grown = np.empty(max(needed, 2 * len(col), 1024), dtype=col.dtype)
+				grown[:self.size] = col[:self.size]
+				self.data[name] = grown
+		fields = list(self.columns)
+		for offset, name in enumerate(fields, start=1):
+			_, dtype, encoded = self.columns[name]
+			values = [r[offset] for r in rows]
+			if encoded:
+				enc = self.dicts[name].encode
+				values = [enc(v) for v in values]
+			self.data[name][self.size:needed] = np.asarray(values, dtype=dtype)
+		self.data["epoch"][self.size:needed] = [int(r[-1].timestamp()) for r in rows]
+		self.size = needed
+
+	def retained_since(self):
+		"""Lower bound of the rows kept raw in the database (``None``: all)."""
+		return None
+
+	def aliases(self) -> list:
+		"""Databases the rows are loaded from (the shards of a sharded model)."""
+		model = type(self).model_getter()
+		return sharding.shards() if sharding.is_sharded(model) else ["default"]
+
+	def _load_new(self):
+		model = type(self).model_getter()
+		names = [field for field, _, _ in self.columns.values()]
+		for db in self.aliases():
+			qs = model.objects.using(db).all()
+			if self.raw_since is not None:
+				qs = qs.filter(**{f"{self.time_field}__gte": self.raw_since})
+			while True:
+				rows = list(
+					qs.filter(id__gt=self.last_ids.get(db, 0)).order_by("id")
+					.values_list("id", *names, self.time_field)[:CHUNK]
+				)
+				if not rows:
+					break
+				self._append(rows)
+				self.last_ids[db] = rows[-1][0]
+
+	def refresh(self, force=False):
+		stamp, bumped_at = get_stamps([self.scope])[0]
+		since = self.retained_since()
+		full_every = getattr(settings, "STATS_ANALYTICS_FULL_RELOAD_SECONDS", 300)
+		with self._lock:
+			stale = time.monotonic() - self.loaded_at > full_every
+			if force or stale or self.needs_reload or since != self.raw_since:
+				self._reset()
+				self.raw_since = since
+				self.loaded_at = time.monotonic()
+			# Un sello recién subido puede llegar antes que sus filas a esta
+			# conexión (réplica, snapshot abierto): durante un instante se
+			# sigue buscando filas nuevas aunque no cambie
+			settled = time.time() - bumped_at > getattr(settings, "STATS_ANALYTICS_SETTLE_SECONDS", 2)
+			if self.stamp == stamp and self.loaded_at and settled:
+				return
+			self._load_new()
+			self.stamp = stamp
+
+	def view(self) -> dict:
+		"""Consistent snapshot of the loaded columns (no copy) and their dictionaries."""
+		self.refresh()
+		with self._lock:
+			n = self.size
+			cols = {name: col[:n] for name, col in self.data.items()}
+			cols["dicts"] = self.dicts
+			return cols
+
+	def mask(self, cols, start=None, end=None, **equals):
+		"""Boolean filter; ``equals`` values are raw strings/bools, ``None`` = any."""
+		mask = np.ones(len(cols["epoch"]), dtype=bool)
+		if start is not None:
+			mask &= cols["epoch"] >= int(start.timestamp())
+		if end is not None:
+			mask &= cols["epoch"] <= int(end.timestamp())
+		for name, value in equals.items():
+			if value is None:
+				continue
+			if name in cols["dicts"]:
+				code = cols["dicts"][name].lookup(value)
+				if code is None:
+					return np.zeros_like(mask)
+				mask &= cols[name] == code
+			else:
+				mask &= cols[name] == value
+		return mask
+
+	def grouped(self, cols, by, mask, weights=None):
+		"""``(counts, sums)`` per code of ``by`` over the rows in ``mask``."""
+		codes = cols[by][mask]
+		keep = codes >= 0
+		codes = codes[keep]
+		size = len(cols["dicts"][by].values)
+		counts = np.bincount(codes, minlength=size)
+		sums = np.bincount(codes, weights=weights[mask][keep], minlength=size) if weights is not None else None
+		return counts, sums
+
+	@staticmethod
+	def decode(cols, by, codes):
+		values = cols["dicts"][by].values
+		return [values[c] for c in codes]
+
+
+class PlaybackFacts(FactTable):
+	model_getter = staticmethod(get_playback_model)
+	scope = "playback"
+	time_field = "played_at"
+	columns = {
+		"song": ("song_id", np.int32, True),
+		"label": ("label_id", np.int32, True),
+		"seconds": ("seconds", np.uint32, False),
+		"valid": ("valid", np.bool_, False),
+	}
+
+	def retained_since(self):
+		return retention.watermark()
+
+	def count(self, song=None, label=None, valid=None, start=None, end=None) -> int:
+		cols = self.view()
+		return int(self.mask(cols, start, end, song=song, label=label, valid=valid).sum())
+
+	def count_by(self, by: str, song=None, label=None, valid=None, start=None, end=None) -> dict:
+		"""``{key: plays}`` grouped by ``song`` or ``label``."""
+		cols = self.view()
+		counts, _ = self.grouped(cols, by, self.mask(cols, start, end, song=song, label=label, valid=valid))
+		hit = np.nonzero(counts)[0]
+		return dict(zip(self.decode(cols, by, hit), counts[hit].tolist()))
+
+	def top(self, by: str, k: int, song=None, label=None, valid=None, start=None, end=None) -> list:
+		"""``[(key, plays)]`` of the ``k`` keys with most plays."""
+		cols = self.view()
+		counts, _ = self.grouped(cols, by, self.mask(cols, start, end, song=song, label=label, valid=valid))
+		if k < len(counts):
+			candidates = np.argpartition(-counts, k - 1)[:k]
+		else:
+			candidates = np.arange(len(counts))
+		candidates = candidates[counts[candidates] > 0]
+		items = zip(self.decode(cols, by, candidates), counts[candidates].tolist())
+		return sorted(items, key=lambda kv: (-kv[1], kv[0]))
+
+
+class RatingFacts(FactTable):
+	model_getter = staticmethod(get_rating_model)
+	scope = "rating"
+	time_field = "rated_at"
+	columns = {
+		"song": ("song_id", np.int32, True),
+		"artist": ("artist_id", np.int32, True),
+		"label": ("label_id", np.int32, True),
+		"stars": ("stars", np.int16, False),
+	}
+
+	def stats(self, song=None, artist=None, label=None, start=None, end=None):
+		"""``(count, sum of stars)`` of the matching ratings."""
+		cols = self.view()
+		mask = self.mask(cols, start, end, song=song, artist=artist, label=label)
+		return int(mask.sum()), int(cols["stars"][mask].sum(dtype=np.int64))
+
+	def stats_by(self, by: str, start=None, end=None, **filters) -> dict:
+		"""``{key: (count, sum of stars)}`` grouped by ``song``, ``artist`` or ``label``."""
+		cols = self.view()
+		counts, sums = self.grouped(cols, by, self.mask(cols, start, end, **filters), weights=cols["stars"])
+		hit = np.nonzero(counts)[0]
+		return {key: (int(counts[i]), int(sums[i])) for key, i in zip(self.decode(cols, by, hit), hit)}
+
+
+playbacks = PlaybackFacts()
+ratings = RatingFacts()
+
+
+def reset():
+	for table in (playbacks, ratings):
+		with table._lock:
+			table._reset()
+
+
+def snapshot() -> dict:
+	return {
+		name: {"rows": table.size, "last_ids": dict(table.last_ids)}
+		for name, table in (("playback", playbacks), ("rating", ratings))
+	}
+
+
+def invalidate_on_change(sender, instance, created=False, **kwargs):
+	"""Signal receiver: updates and deletes can't be applied incrementally."""
+	if created:
+		return
+	name = instance._meta.model_name
+	if name == "playback":
+		playbacks.invalidate()
+	elif name == "rating":
+		ratings.invalidate()
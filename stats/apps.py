@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class StatsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'stats'
+
+    def ready(self):
+        from django.db.models.signals import post_migrate
+
+        from . import db, search, signals
+
+        db.connect_signals()
+        signals.connect_signals()
+        # Reconstruir una tabla en SQLite borra sus triggers: se reponen tras cada migrate
+        post_migrate.connect(search.install_after_migrate, sender=self, dispatch_uid="stats_rating_search")
@@ -0,0 +1,195 @@
+"""Columnar cold archive of ``Playback`` rows, one directory per month.
+
+``manage.py archive_playbacks`` exports each closed month to
+``STATS_ARCHIVE_DIR/playback/YYYY-MM/``:
+
+- ``songs.npy``: sorted song ids, the dictionary for the codes below;
+- ``song_code.npy`` (int32), ``epoch.npy`` (int64 seconds, UTC) and
+  ``seconds.npy`` (uint32), sorted by (song, time);
+- ``valid.npy``: the ``valid`` flags packed eight per byte;
+- ``meta.json``: month, row count and export time.
+
+Files are opened memory-mapped, so a scan touches only the pages it reads
+and aggregations are NumPy operations. A month is read from the archive once
+``compact_playbacks`` has moved the retention watermark past its end (its raw
+rows are gone); until then the database is authoritative.
+"""
+import json
+import os
+import shutil
+from datetime import date, datetime, timezone as dt_timezone
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from . import series
+
+COLUMNS = ("song_code", "epoch", "seconds")
+
+_open = {}
+
+
+def archive_root(using: str = "default") -> Path:
+	"""Directory of the archive of database ``using`` (one per playback shard)."""
+	base = Path(getattr(settings, "STATS_ARCHIVE_DIR", "archive"))
+	return base / "playback" if using == "default" else base / f"playback-{using}"
+
+
+def month_bounds(month: date):
+	"""Aware UTC datetimes of the first instant of ``month`` and of the next one."""
+	start = datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc)
+	nxt = datetime(month.year + month.month // 12, month.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+	return start, nxt
+
+
+def _epoch(dt) -> int:
+	return int(dt.timestamp())
+
+
+class MonthArchive:
+	def __init__(self, path: Path):
+		self.path = path
+		meta = json.loads((path / "meta.json").read_text())
+		self.month = date.fromisoformat(meta["month"] + "-01")
+		self.rows = meta["rows"]
+		self.start, self.end = month_bounds(self.month)
+		self.songs = np.load(path / "songs.npy")
+		for name in COLUMNS:
+			setattr(self, name, np.load(path / f"{name}.npy", mmap_mode="r"))
+		self._valid = np.load(path / "valid.npy", mmap_mode="r")
+
+	def valid_bits(self, lo: int, hi: int):
+		"""Unpacked ``valid`` flags of rows ``lo``..``hi`` (only their bytes are read)."""
+		first = lo // 8
+		bits = np.unpackbits(np.asarray(self._valid[first:(hi + 7) // 8]))
+		return bits[lo - first * 8:hi - first * 8].astype(bool)
+
+	def song_range(self, song_id: str):
+		pos = int(np.searchsorted(self.songs, song_id))
+		if pos >= len(self.songs) or self.songs[pos] != song_id:
+			return 0, 0
+		lo = int(np.searchsorted(self.song_code, pos, side="left"))
+		hi = int(np.searchsorted(self.song_code, pos, side="right"))
+		return lo, hi
+
+	def _select(self, song_id=None, start=None, end=None, valid=None):
+		"""``(epochs, codes, mask)`` of the candidate rows; ``codes`` is ``None``
+		for a single song."""
+		if song_id is not None:
+			lo, hi = self.song_range(song_id)
+			epochs = np.asarray(self.epoch[lo:hi])
+			# Dentro de un tema las filas están ordenadas por tiempo
+			if start is not None:
+				lo_t = int(np.searchsorted(epochs, _epoch(start), side="left"))
+			else:
+				lo_t = 0
+			hi_t = int(np.searchsorted(epochs, _epoch(end), side="right")) if end is not None else len(epochs)
+			lo, hi = lo + lo_t, lo + hi_t
+			epochs = epochs[lo_t:hi_t]
+			mask = np.ones(hi - lo, dtype=bool)
+			codes = None
+		else:
+			lo, hi = 0, self.rows
+			epochs = np.asarray(self.epoch)
+			mask = np.ones(self.rows, dtype=bool)
+			if start is not None:
+				mask &= epochs >= _epoch(start)
+			if end is not None:
+				mask &= epochs <= _epoch(end)
+			codes = np.asarray(self.song_code)
+		if valid is not None and hi > lo:
+			bits = self.valid_bits(lo, hi)
+			mask &= bits if valid else ~bits
+		return epochs, codes, mask
+
+	def count(self, song_id=None, start=None, end=None, valid=None) -> int:
+		_, _, mask = self._select(song_id, start, end, valid)
+		return int(mask.sum())
+
+	def counts_by_song(self, start=None, end=None, valid=None) -> dict:
+		_, codes, mask = self._select(None, start, end, valid)
+		totals = np.bincount(codes[mask], minlength=len(self.songs))
+		hit = np.nonzero(totals)[0]
+		return dict(zip(self.songs[hit].tolist(), totals[hit].tolist()))
+
+	def bucketed(self, song_id, interval, start=None, end=None, valid=None):
+		"""``(bucket datetime64 keys, counts)`` of one song's plays per ``interval``."""
+		epochs, _, mask = self._select(song_id, start, end, valid)
+		keys = series.floor_bucket(epochs[mask].astype("datetime64[s]"), interval)
+		return np.unique(keys, return_counts=True)
+
+
+def export_month(Playback, month: date, using: str = "default", root: Path | None = None) -> Path:
+	"""Write the archive of ``month`` from the raw table and return its directory."""
+	root = Path(root or archive_root(using))
+	start, end = month_bounds(month)
+	rows = (
+		Playback.objects.using(using).filter(played_at__gte=start, played_at__lt=end)
+		.order_by().values_list("song_id", "played_at", "seconds", "valid")
+	)
+	song_ids, epochs, seconds, valid = [], [], [], []
+	for song_id, played_at, secs, is_valid in rows.iterator(chunk_size=10000):
+		song_ids.append(song_id)
+		epochs.append(_epoch(played_at))
+		seconds.append(secs or 0)
+		valid.append(bool(is_valid))
+
+	songs, codes = np.unique(np.array(song_ids, dtype=str), return_inverse=True)
+	codes = codes.astype(np.int32)
+	epochs = np.array(epochs, dtype=np.int64)
+	order = np.lexsort((epochs, codes))
+	label = f"{month.year:04d}-{month.month:02d}"
+	final = root / label
+	tmp = root / f".{label}.tmp"
+	shutil.rmtree(tmp, ignore_errors=True)
+	tmp.mkdir(parents=True)
+	np.save(tmp / "songs.npy", songs)
+	np.save(tmp / "song_code.npy", codes[order])
+	np.save(tmp / "epoch.npy", epochs[order])
+	np.save(tmp / "seconds.npy", np.array(seconds, dtype=np.uint32)[order])
+	np.save(tmp / "valid.npy", np.packbits(np.array(valid, dtype=bool)[order]))
+	(tmp / "meta.json").write_text(json.dumps({
+		"month": label, "rows": int(len(order)), "exported_at": timezone.now().isoformat(),
+	}))
+	# Sustitución atómica: un lector nunca ve un mes a medio escribir
+	if final.exists():
+		old = root / f".{label}.old"
+		shutil.rmtree(old, ignore_errors=True)
+		os.replace(final, old)
+		os.replace(tmp, final)
+		shutil.rmtree(old, ignore_errors=True)
+	else:
+		os.replace(tmp, final)
+	_open.pop(final, None)
+	return final
+
+
+def months(root: Path | None = None, using: str = "default") -> list:
+	"""Every archived month, oldest first."""
+	root = Path(root or archive_root(using))
+	if not root.is_dir():
+		return []
+	out = []
+	for path in sorted(p for p in root.iterdir() if p.is_dir() and not p.name.startswith(".")):
+		meta = path / "meta.json"
+		if not meta.exists():
+			continue
+		stamp = meta.stat().st_mtime
+		hit = _open.get(path)
+		if hit is None or hit[0] != stamp:
+			hit = _open[path] = (stamp, MonthArchive(path))
+		out.append(hit[1])
+	return out
+
+
+def sealed(before, start=None, end=None, using: str = "default") -> list:
+	"""Archived months that end at or before ``before`` (the retention
+	watermark) and overlap ``start``..``end``."""
+	if before is None:
+		return []
+	return [
+		m for m in months(using=using)
+		if m.end <= before and (start is None or m.end > start) and (end is None or m.start <= end)
+	]
@@ -0,0 +1,143 @@
+"""Circuit breaker for calls to external services.
+
+The breaker keeps the outcome of the last ``window`` calls. When at least
+``min_calls`` are recorded and the failure rate reaches ``failure_rate`` it
+opens: calls fail immediately with :class:`CircuitOpenError` for
+``open_seconds``. After that it goes half-open and lets ``half_open_probes``
+calls through; a successful probe closes it, a failed one opens it again.
+"""
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULTS = {
+	"failure_rate": 0.5,
+	"window": 20,
+	"min_calls": 5,
+	"open_seconds": 30.0,
+	"half_open_probes": 1,
+}
+
+
+class CircuitOpenError(Exception):
+	"""Raised instead of calling a service whose circuit is open."""
+
+
+class CircuitBreaker:
+	def __init__(self, name, failure_rate=0.5, window=20, min_calls=5, open_seconds=30.0,
+				 half_open_probes=1, clock=time.monotonic):
+		self.name = name
+		self.failure_rate = failure_rate
+		self.min_calls = min_calls
+		self.open_seconds = open_seconds
+		self.half_open_probes = half_open_probes
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._outcomes = deque(maxlen=window)
+		self._state = CLOSED
+		self._opened_at = None
+		self._probes = 0
+		self.counters = {"calls": 0, "failures": 0, "short_circuited": 0, "opened": 0}
+
+	@property
+	def state(self):
+		with self._lock:
+			return self._current_state()
+
+	def _current_state(self):
+		if self._state == OPEN and self._clock() - self._opened_at >= self.open_seconds:
+			self._state = HALF_OPEN
+			self._probes = 0
+		return self._state
+
+	def _open(self):
+		self._state = OPEN
+		self._opened_at = self._clock()
+		self._outcomes.clear()
+		self.counters["opened"] += 1
+
+	def allow(self) -> bool:
+		"""Reserve a call slot; ``False`` means the caller must fail fast."""
+		with self._lock:
+			state = self._current_state()
+			if state == CLOSED:
+				return True
+			if state == HALF_OPEN and self._probes < self.half_open_probes:
+				self._probes += 1
+				return True
+			self.counters["short_circuited"] += 1
+			return False
+
+	def record_success(self):
+		with self._lock:
+			self.counters["calls"] += 1
+			if self._state == HALF_OPEN:
+				self._state = CLOSED
+				self._outcomes.clear()
+			self._outcomes.append(True)
+
+	def record_failure(self):
+		with self._lock:
+			self.counters["calls"] += 1
+			self.counters["failures"] += 1
+			if self._state == HALF_OPEN:
+				self._open()
+				return
+			self._outcomes.append(False)
+			calls = len(self._outcomes)
+			failures = calls - sum(self._outcomes)
+			if calls >= self.min_calls and failures / calls >= self.failure_rate:
+				self._open()
+
+	def call(self, func, *args, **kwargs):
+		if not self.allow():
+			raise CircuitOpenError(self.name)
+		try:
+			result = func(*args, **kwargs)
+		except Exception:
+			self.record_failure()
+			raise
+		self.record_success()
+		return result
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			state = self._current_state()
+			calls = len(self._outcomes)
+			failures = calls - sum(self._outcomes)
+			return {
+				"state": state,
+				"window_calls": calls,
+				"window_failure_rate": round(failures / calls, 4) if calls else 0.0,
+				**self.counters,
+			}
+
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+	"""Process-wide breaker for ``name`` configured from ``STATS_BREAKERS``."""
+	with _registry_lock:
+		breaker = _breakers.get(name)
+		if breaker is None:
+			conf = {**DEFAULTS, **(getattr(settings, "STATS_BREAKERS", {}) or {}).get(name, {})}
+			breaker = _breakers[name] = CircuitBreaker(name, **conf)
+		return breaker
+
+
+def all_breakers() -> dict:
+	with _registry_lock:
+		return dict(_breakers)
+
+
+def reset_breakers():
+	with _registry_lock:
+		_breakers.clear()
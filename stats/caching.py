@@ -0,0 +1,120 @@
+"""Result cache of the stats read endpoints, shared by the workers of a host.
+
+``SharedFileCache`` is Django's file-based cache (one file per entry, safe
+across processes) that counts the entries it culls. The ``stats`` cache
+alias uses it by default, so no external service is needed; any other
+Django backend can be configured instead.
+
+``cached_result`` stores the JSON body and status of a view's 2xx
+responses (except ``Cache-Control: no-store`` ones) under a key made of the path, the sorted query string and the
+version stamps of its ``conditional`` scopes (plus the replica copy, see
+``stats.versioning``). A hit is served as
+``PreEncoded`` bytes, without unpickling the data or encoding it again. A write bumps the stamps of the
+entities it touches, so only the results that depend on it stop being
+found. Old entries are left to expire (``TIMEOUT``) or to be culled.
+"""
+import functools
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from rest_framework.response import Response
+
+from .renderers import FastJSONRenderer, PreEncoded, dumps, loads
+from .singleflight import request_key
+from .versioning import unversioned
+
+RESULT_PREFIX = "stats:result:v2:"
+
+_lock = threading.Lock()
+counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+
+def _count(name: str, n: int = 1):
+	with _lock:
+		counters[name] += n
+
+
+class SharedFileCache(FileBasedCache):
+	"""``FileBasedCache`` that records how many entries its culls delete.
+
+	Listing the directory costs O(entries), so the size is only checked
+	every ``CULL_EVERY`` writes (option, default 32) instead of on each one.
+	"""
+
+	def __init__(self, dir, params):
+		options = dict(params.get("OPTIONS") or {})
+		self._cull_every = max(1, int(options.pop("CULL_EVERY", 32)))
+		super().__init__(dir, {**params, "OPTIONS": options})
+		self._writes = 0
+
+	def _cull(self):
+		self._writes += 1
+		if self._writes % self._cull_every:
+			return
+		filelist = self._list_cache_files()
+		num_entries = len(filelist)
+		if num_entries < self._max_entries:
+			return
+		if self._cull_frequency == 0:
+			self.clear()
+			_count("evictions", num_entries)
+			return
+		removed = 0
+		for fname in random.sample(filelist, int(num_entries / self._cull_frequency)):
+			removed += bool(self._delete(fname))
+		_count("evictions", removed)
+
+
+def result_cache():
+	alias = getattr(settings, "STATS_RESULT_CACHE", None)
+	return caches[alias] if alias else None
+
+
+def snapshot() -> dict:
+	with _lock:
+		out = dict(counters)
+	lookups = out["hits"] + out["misses"]
+	out["hit_ratio"] = round(out["hits"] / lookups, 4) if lookups else None
+	out["alias"] = getattr(settings, "STATS_RESULT_CACHE", None)
+	return out
+
+
+def reset():
+	with _lock:
+		for name in counters:
+			counters[name] = 0
+
+
+def cached_result(view):
+	"""Serve a DRF function view from the result cache.
+
+	Goes below ``conditional`` (the key needs the request's version stamps)
+	and above ``single_flight``, so a miss is computed once per worker.
+	"""
+	@functools.wraps(view)
+	def wrapper(request, *args, **kwargs):
+		cache = result_cache()
+		if cache is None or request.method != "GET" or unversioned(request):
+			return view(request, *args, **kwargs)
+		key = RESULT_PREFIX + request_key(request)
+		# Sin el renderer rápido (p. ej. la API navegable) hacen falta los datos
+		encoded = isinstance(getattr(request, "accepted_renderer", None), FastJSONRenderer)
+		found = cache.get(key)
+		if found is not None:
+			_count("hits")
+			body, status = found
+			return Response(PreEncoded(body) if encoded else loads(body), status=status)
+		_count("misses")
+		response = view(request, *args, **kwargs)
+		if 200 <= response.status_code < 300 and "no-store" not in response.get("Cache-Control", ""):
+			body = dumps(response.data)
+			cache.set(key, (body, response.status_code))
+			_count("stores")
+			if encoded:
+				response.data = PreEncoded(body)
+		return response
+
+	return wrapper
@@ -0,0 +1,123 @@
+"""Client for the content service (``CONTENT_API_BASE``).
+
+Every call goes through the ``content`` circuit breaker. Successful JSON
+responses are also kept in the default cache for ``STATS_CONTENT_STALE_TTL``
+seconds; when the service fails or the circuit is open, callers get that
+last known payload instead of waiting out the request timeout.
+
+Views decorated with ``degradable`` whose response was built while a call
+failed (or with data still pending, see ``degrade``) get
+``Cache-Control: no-store``: the result cache, single-flight and the
+conditional GET validators skip those responses.
+"""
+import functools
+import hashlib
+import logging
+import time
+from contextvars import ContextVar
+
+import requests
+from django.conf import settings
+from django.core.cache import cache
+
+from .breaker import CircuitOpenError, get_breaker
+from .profiling import record_http
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASE = "http://127.0.0.1:8001/api/v1"
+STALE_PREFIX = "stats:content:"
+BREAKER = "content"
+
+_degraded = ContextVar("stats_content_degraded", default=None)
+
+
+class ServiceError(Exception):
+	"""5xx answer from the content service (counts as a breaker failure)."""
+
+
+class Unavailable(Exception):
+	"""The content service could not answer and there is no cached payload."""
+
+
+def base_url() -> str:
+	return getattr(settings, "CONTENT_API_BASE", DEFAULT_BASE)
+
+
+def available() -> bool:
+	"""``False`` while the content circuit is open."""
+	return get_breaker(BREAKER).state != "open"
+
+
+def degrade():
+	"""Mark the response being built by a ``degradable`` view as incomplete."""
+	flag = _degraded.get()
+	if flag is not None:
+		flag.append(True)
+
+
+def degradable(view):
+	"""Send ``Cache-Control: no-store`` when ``view`` called ``degrade``.
+
+	Goes right above the view function, below ``single_flight``.
+	"""
+	@functools.wraps(view)
+	def wrapper(request, *args, **kwargs):
+		token = _degraded.set([])
+		try:
+			response = view(request, *args, **kwargs)
+			if _degraded.get():
+				response["Cache-Control"] = "no-store"
+			return response
+		finally:
+			_degraded.reset(token)
+
+	return wrapper
+
+
+def _stale_key(url: str, params) -> str:
+	raw = url + "?" + repr(sorted((params or {}).items()))
+	return STALE_PREFIX + hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _fetch(url, params, timeout):
+	started = time.perf_counter()
+	try:
+		response = requests.get(url, params=params, timeout=timeout)
+	finally:
+		record_http(time.perf_counter() - started)
+	if response.status_code >= 500:
+		raise ServiceError(f"{response.status_code} from {url}")
+	return response
+
+
+def get_json(path: str, params: dict | None = None, timeout: float = 3, required: bool = False):
+	"""GET ``CONTENT_API_BASE + path`` and return the decoded JSON or ``None``.
+
+	4xx answers return ``None`` (the service is healthy, the item is not
+	there). Network errors, 5xx and an open circuit return the last cached
+	payload for the same URL, or ``None`` if there is none; with
+	``required`` they raise :class:`Unavailable` instead of that ``None``, so
+	callers can tell "not there" from "could not ask".
+	"""
+	url = f"{base_url()}{path}"
+	key = _stale_key(url, params)
+	try:
+		response = get_breaker(BREAKER).call(_fetch, url, params, timeout)
+	except Exception as exc:  # noqa: BLE001 - circuito abierto, red, timeout o 5xx
+		if not isinstance(exc, CircuitOpenError):
+			logger.debug("content service call failed: %s %s", url, exc)
+		degrade()
+		stale = cache.get(key)
+		if stale is None and required:
+			raise Unavailable(url) from exc
+		return stale
+
+	if not response.ok:
+		return None
+	try:
+		data = response.json()
+	except ValueError:
+		return None
+	cache.set(key, data, getattr(settings, "STATS_CONTENT_STALE_TTL", 24 * 3600))
+	return data
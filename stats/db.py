@@ -0,0 +1,33 @@
+"""Database connection tuning for the ``stats`` app.
+
+SQLite does not accept PRAGMAs through ``DATABASES[...]["OPTIONS"]`` on the
+Django version we pin, so they are applied when each connection is opened.
+"""
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+# Solo se aceptan estos PRAGMAs para no interpolar texto arbitrario en SQL.
+ALLOWED_PRAGMAS = ("auto_vacuum", "journal_mode", "synchronous", "busy_timeout", "mmap_size")
+# Fijar auto_vacuum pide el lock de escritura aunque no cambie nada: con un
+# rebuild en marcha (ver stats.rollups.write_lock) las conexiones nuevas fallarían
+AUTO_VACUUM_MODES = {"NONE": 0, "FULL": 1, "INCREMENTAL": 2}
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+	if connection.vendor != "sqlite":
+		return
+	pragmas = getattr(settings, "STATS_SQLITE_PRAGMAS", None) or {}
+	with connection.cursor() as cursor:
+		for name in ALLOWED_PRAGMAS:
+			value = pragmas.get(name)
+			if value is None or not str(value).isalnum():
+				continue
+			if name == "auto_vacuum":
+				cursor.execute("PRAGMA auto_vacuum")
+				if cursor.fetchone()[0] == AUTO_VACUUM_MODES.get(str(value).upper()):
+					continue
+			cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def connect_signals():
+	connection_created.connect(apply_sqlite_pragmas, dispatch_uid="stats_sqlite_pragmas")
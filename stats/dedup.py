@@ -0,0 +1,100 @@
+"""Time-windowed duplicate filter for client event ids.
+
+A rotating pair of Bloom filters remembers the ids seen in the last
+``window_seconds`` (up to twice that). Checking and adding are O(1) and
+never touch the database. A "maybe seen" answer can be a false positive, so
+callers confirm it with a lookup; a "not seen" answer is exact for this
+process, and the unique constraint on ``Playback.event_id`` catches the
+duplicates that went to other workers or rotated out.
+"""
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+
+
+class BloomFilter:
+	def __init__(self, capacity: int, error_rate: float):
+		self.capacity = max(1, capacity)
+		bits = int(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))
+		self.size = max(8, bits)
+		self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+		self.bits = bytearray((self.size + 7) // 8)
+		self.count = 0
+
+	def _positions(self, key: str):
+		digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+		h1 = int.from_bytes(digest[:8], "little")
+		h2 = int.from_bytes(digest[8:], "little") | 1
+		return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+	def add(self, key: str):
+		for p in self._positions(key):
+			self.bits[p >> 3] |= 1 << (p & 7)
+		self.count += 1
+
+	def __contains__(self, key: str) -> bool:
+		return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class RotatingDedupFilter:
+	"""Two Bloom generations; the older one is dropped every ``window_seconds``
+	or as soon as the current one reaches its capacity."""
+
+	def __init__(self, window_seconds=3600, capacity=1_000_000, error_rate=0.001, clock=time.monotonic):
+		self.window = window_seconds
+		self.capacity = capacity
+		self.error_rate = error_rate
+		self._clock = clock
+		self._lock = threading.Lock()
+		self._current = BloomFilter(capacity, error_rate)
+		self._previous = None
+		self._started = clock()
+		self.rotations = 0
+
+	def _maybe_rotate(self):
+		if self._clock() - self._started >= self.window or self._current.count >= self.capacity:
+			self._previous = self._current
+			self._current = BloomFilter(self.capacity, self.error_rate)
+			self._started = self._clock()
+			self.rotations += 1
+
+	def seen(self, key: str) -> bool:
+		with self._lock:
+			self._maybe_rotate()
+			return key in self._current or (self._previous is not None and key in self._previous)
+
+	def add(self, key: str):
+		with self._lock:
+			self._maybe_rotate()
+			self._current.add(key)
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			return {
+				"window_seconds": self.window,
+				"current_items": self._current.count,
+				"bits_per_generation": self._current.size,
+				"rotations": self.rotations,
+			}
+
+
+_filter = None
+_filter_lock = threading.Lock()
+
+
+def play_dedup() -> RotatingDedupFilter:
+	global _filter
+	with _filter_lock:
+		if _filter is None:
+			conf = getattr(settings, "STATS_PLAY_DEDUP", {}) or {}
+			_filter = RotatingDedupFilter(**conf)
+		return _filter
+
+
+def reset_play_dedup():
+	global _filter
+	with _filter_lock:
+		_filter = None
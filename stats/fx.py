@@ -0,0 +1,123 @@
+"""Currency normalization for revenue aggregates.
+
+Rates are loaded locally with ``manage.py load_fx_rates`` into ``FxRate``
+(units of currency per 1 EUR, as published by the ECB). Conversion is done
+on ``(currency, day, amount)`` sums produced by a GROUP BY in SQL, never per
+sale row. Each currency's series is loaded once per process and reused until
+the ``"fx"`` version stamp changes, that is until rates are reloaded.
+"""
+import bisect
+import threading
+from decimal import Decimal
+
+from .models import FxRate
+from .versioning import get_stamps
+
+BASE_CURRENCY = "EUR"
+QUANT = Decimal("0.01")
+
+
+class FxTable:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._series = {}
+		self._token = None
+
+	def refresh(self):
+		"""Drop the loaded series if the rates were reloaded since."""
+		token = get_stamps(["fx"])[0][0]
+		with self._lock:
+			if token != self._token:
+				self._series.clear()
+				self._token = token
+
+	def _series_for(self, currency):
+		with self._lock:
+			series = self._series.get(currency)
+		if series is None:
+			rows = list(FxRate.objects.filter(currency=currency).order_by("day").values_list("day", "rate"))
+			series = ([d for d, _ in rows], [r for _, r in rows])
+			with self._lock:
+				self._series[currency] = series
+		return series
+
+	def _rate(self, currency, day):
+		if currency == BASE_CURRENCY:
+			return Decimal(1)
+		days, rates = self._series_for(currency)
+		i = bisect.bisect_right(days, day)
+		return rates[i - 1] if i else None
+
+	def _convert(self, amount, currency, day, target):
+		if currency == target:
+			return Decimal(amount)
+		src, dst = self._rate(currency, day), self._rate(target, day)
+		if not src or not dst:
+			return None
+		return Decimal(amount) / src * dst
+
+	def rate(self, currency, day):
+		"""Units of ``currency`` per EUR on ``day`` (latest published on or before it)."""
+		self.refresh()
+		return self._rate((currency or "").upper(), day)
+
+	def convert(self, amount, currency, day, target):
+		self.refresh()
+		return self._convert(amount, (currency or "").upper(), day, (target or "").upper())
+
+	def normalize(self, groups, target):
+		"""Sum ``(currency, day, amount)`` groups in ``target``.
+
+		Returns ``(total, missing)`` where ``missing`` lists the
+		``(currency, day)`` pairs without a usable rate; ``total`` is ``None``
+		when any is missing.
+		"""
+		self.refresh()
+		target = (target or "").upper()
+		total = Decimal(0)
+		missing = []
+		for currency, day, amount in groups:
+			converted = self._convert(amount or 0, (currency or "").upper(), day, target)
+			if converted is None:
+				missing.append((currency, day))
+			else:
+				total += converted
+		if missing:
+			return None, missing
+		return total.quantize(QUANT), []
+
+
+fx_table = FxTable()
+
+
+def revenue_by_currency(groups) -> dict:
+	"""``{currency: amount}`` from ``(currency, day, amount)`` groups."""
+	out = {}
+	for currency, _day, amount in groups:
+		key = (currency or "").upper()
+		out[key] = out.get(key, Decimal(0)) + Decimal(amount or 0)
+	return out
+
+
+def revenue_payload(groups, normalize_to=None) -> dict:
+	"""Revenue fields shared by the album, label and global endpoints."""
+	groups = list(groups)
+	by_currency = revenue_by_currency(groups)
+	payload = {"revenue_by_currency": {c: float(a) for c, a in sorted(by_currency.items())}}
+	if normalize_to:
+		target = normalize_to.upper()
+		total, missing = fx_table.normalize(groups, target)
+		payload["revenue"] = float(total) if total is not None else None
+		payload["currency"] = target
+		if missing:
+			payload["fx_missing"] = sorted({f"{c}@{d.isoformat()}" for c, d in missing})
+	elif len(by_currency) <= 1:
+		# Una sola moneda: la suma es correcta tal cual
+		currency, amount = next(iter(by_currency.items()), (None, Decimal(0)))
+		payload["revenue"] = float(amount)
+		payload["currency"] = currency
+	else:
+		# Monedas mezcladas sin normalize_to: no hay un total con sentido
+		payload["revenue"] = None
+		payload["currency"] = None
+	return payload
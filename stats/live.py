@@ -0,0 +1,127 @@
+"""In-process pub/sub of live counters for the SSE stream.
+
+Signal receivers publish the delta every committed ``Playback``, ``AlbumSale``
+or ``Rating`` write adds to its song or album. Each open stream holds a
+``Subscription`` for a set of keys; deltas for the same key are merged while
+they wait, so a stream draining every ``interval`` seconds sends at most one
+event per key per interval however many writes happened.
+
+The broker only sees the writes handled by its own process. Streams
+re-read their counters from the database every ``STATS_LIVE_RESYNC_SECONDS``
+to pick up the writes that other workers served.
+"""
+import threading
+
+from django.db.models import Count, Sum
+
+from . import retention, sharding
+from .utils import get_album_sale_model, get_playback_model, get_rating_model
+
+SONG = "song"
+ALBUM = "album"
+
+
+def live_deltas(instance) -> list:
+	"""``(key, deltas)`` pairs ``instance`` adds to the live counters."""
+	name = instance._meta.model_name
+	if name == "playback":
+		return [((SONG, str(instance.song_id)), {"plays": 1})]
+	if name == "rating":
+		return [((SONG, str(instance.song_id)), {"ratings_count": 1, "ratings_sum": int(instance.stars or 0)})]
+	if name == "albumsale":
+		return [((ALBUM, str(instance.album_id)), {"sales_count": 1, "units_sold": int(instance.units or 0)})]
+	return []
+
+
+class Subscription:
+	def __init__(self, keys):
+		self.keys = frozenset(keys)
+		self.pending = {}
+
+	def _merge(self, key, deltas, sign):
+		slot = self.pending.setdefault(key, {})
+		for field, value in deltas.items():
+			slot[field] = slot.get(field, 0) + sign * value
+
+
+class LiveBroker:
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._by_key = {}
+		self.published = 0
+
+	def subscribe(self, keys) -> Subscription:
+		sub = Subscription(keys)
+		with self._lock:
+			for key in sub.keys:
+				self._by_key.setdefault(key, set()).add(sub)
+		return sub
+
+	def unsubscribe(self, sub: Subscription):
+		with self._lock:
+			for key in sub.keys:
+				subs = self._by_key.get(key)
+				if subs is None:
+					continue
+				subs.discard(sub)
+				if not subs:
+					del self._by_key[key]
+
+	def publish(self, items, sign=1):
+		with self._lock:
+			self.published += 1
+			for key, deltas in items:
+				for sub in self._by_key.get(key, ()):
+					sub._merge(key, deltas, sign)
+
+	def drain(self, sub: Subscription) -> dict:
+		"""Take the deltas accumulated for ``sub`` since the last drain."""
+		with self._lock:
+			pending, sub.pending = sub.pending, {}
+		return pending
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			return {"keys": len(self._by_key), "streams": len(set().union(*self._by_key.values())) if self._by_key else 0}
+
+
+broker = LiveBroker()
+
+
+def read_counters(keys) -> dict:
+	"""Current totals for ``keys`` straight from the database."""
+	songs = [k for kind, k in keys if kind == SONG]
+	albums = [k for kind, k in keys if kind == ALBUM]
+	out = {}
+	for song_id in songs:
+		out[(SONG, song_id)] = {"plays": 0, "ratings_count": 0, "ratings_sum": 0}
+	for album_id in albums:
+		out[(ALBUM, album_id)] = {"sales_count": 0, "units_sold": 0}
+
+	Playback, Rating, AlbumSale = get_playback_model(), get_rating_model(), get_album_sale_model()
+	if songs and Playback is not None:
+		for shard, ids in sharding.group_by_shard(songs).items():
+			with sharding.on(shard):
+				for song_id, n in retention.compacted_by_song(ids).items():
+					out[(SONG, song_id)]["plays"] = n
+				rows = retention.raw_only(Playback.objects.filter(song_id__in=ids)).values("song_id").annotate(n=Count("id"))
+				for row in rows:
+					out[(SONG, row["song_id"])]["plays"] += row["n"]
+	if songs and Rating is not None:
+		rows = Rating.objects.filter(song_id__in=songs).values("song_id").annotate(n=Count("id"), s=Sum("stars"))
+		for row in rows:
+			out[(SONG, row["song_id"])].update(ratings_count=row["n"], ratings_sum=row["s"] or 0)
+	if albums and AlbumSale is not None:
+		rows = AlbumSale.objects.filter(album_id__in=albums).values("album_id").annotate(n=Count("id"), u=Sum("units"))
+		for row in rows:
+			out[(ALBUM, row["album_id"])].update(sales_count=row["n"], units_sold=row["u"] or 0)
+	return out
+
+
+def event_payload(key, counters: dict) -> dict:
+	kind, ident = key
+	payload = {f"{kind}_id": ident, **counters}
+	if kind == SONG:
+		count = counters.get("ratings_count") or 0
+		payload["ratings_average"] = round(counters["ratings_sum"] / count, 4) if count else None
+	return payload
@@ -0,0 +1,56 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from stats import archive, retention
+from stats.utils import get_playback_model
+
+
+class Command(BaseCommand):
+	help = (
+		"Exporta los meses cerrados de reproducciones al archivo columnar (STATS_ARCHIVE_DIR). "
+		"Ejecutar antes de compact_playbacks: solo se exportan meses con todas sus filas en crudo."
+	)
+
+	def add_arguments(self, parser):
+		parser.add_argument("--month", action="append", default=[], help="Mes YYYY-MM (repetible); por defecto todos los cerrados")
+		parser.add_argument("--force", action="store_true", help="Reescribir meses ya archivados")
+		parser.add_argument("--database", default="default", help="Alias de la base de datos")
+
+	def handle(self, *args, **options):
+		using = options["database"]
+		Playback = get_playback_model()
+		today = timezone.now()
+		current = date(today.year, today.month, 1)
+		if options["month"]:
+			try:
+				wanted = [date.fromisoformat(m + "-01") for m in options["month"]]
+			except ValueError as e:
+				raise CommandError(f"Mes inválido: {e}")
+		else:
+			wanted = [d.replace(day=1) for d in Playback.objects.using(using).dates("played_at", "month")]
+		done = {m.month for m in archive.months(using=using)}
+		wm = retention.watermark(using=using)
+
+		written = 0
+		for month in sorted(set(wanted)):
+			start, end = archive.month_bounds(month)
+			if month >= current:
+				self.stdout.write(f"{month:%Y-%m}: mes abierto, se omite")
+				continue
+			if month in done and not options["force"]:
+				continue
+			if wm is not None and start < wm:
+				self.stdout.write(self.style.WARNING(f"{month:%Y-%m}: ya compactado, no quedan filas crudas completas"))
+				continue
+			expected = Playback.objects.using(using).filter(played_at__gte=start, played_at__lt=end).count()
+			if not expected:
+				continue
+			path = archive.export_month(Playback, month, using=using)
+			rows = archive.MonthArchive(path).rows
+			if rows != expected:
+				raise CommandError(f"{month:%Y-%m}: {rows} filas archivadas, {expected} en la base de datos")
+			written += 1
+			self.stdout.write(f"{month:%Y-%m}: {rows} reproducciones -> {path}")
+		self.stdout.write(self.style.SUCCESS(f"{written} meses archivados"))
@@ -0,0 +1,62 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from stats import retention
+from stats.utils import get_playback_model
+
+
+class Command(BaseCommand):
+	help = "Borra las reproducciones crudas anteriores al horizonte de retención una vez cubiertas por los rollups diarios."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--days", type=int, default=getattr(settings, "STATS_PLAYBACK_RETENTION_DAYS", 365),
+			help="Días de reproducciones crudas que se conservan",
+		)
+		parser.add_argument("--chunk-size", type=int, default=5000, help="Rango de ids borrado por sentencia")
+		parser.add_argument("--pause", type=float, default=0.05, help="Segundos de espera entre lotes")
+		parser.add_argument("--repair", action="store_true", help="Corregir los rollups que no cuadren en lugar de abortar")
+		parser.add_argument("--vacuum", action="store_true", help="VACUUM completo al terminar (bloquea la BD)")
+		parser.add_argument("--dry-run", action="store_true", help="Solo comprobar la cobertura")
+		parser.add_argument("--database", default="default", help="Alias de la base de datos")
+
+	def handle(self, *args, **options):
+		using = options["database"]
+		Playback = get_playback_model()
+		cutoff = retention.day_start(timezone.localdate() - timedelta(days=options["days"]))
+		current = retention.watermark(using=using)
+		if current is not None and current > cutoff:
+			# Nunca se retrocede: solo se terminan borrados pendientes
+			cutoff = current
+
+		gaps = retention.coverage_gaps(Playback, cutoff, using=using)
+		if gaps:
+			if not options["repair"]:
+				sample = ", ".join(f"{song}@{day}" for song, day, _, _ in gaps[:5])
+				raise CommandError(f"{len(gaps)} días de tema sin rollup exacto ({sample}...); use --repair")
+			retention.repair(gaps, using=using)
+			self.stdout.write(f"{len(gaps)} rollups por tema corregidos")
+		if options["dry_run"]:
+			self.stdout.write(self.style.SUCCESS(f"Rollups cubren todo lo anterior a {cutoff.isoformat()}"))
+			return
+
+		if current is None or cutoff > current:
+			retention.set_watermark(cutoff, using=using)
+			# Los workers cachean el watermark: esperar a que todos lo vean
+			time.sleep(getattr(settings, "STATS_RETENTION_CACHE_SECONDS", 30))
+
+		def progress(deleted, position, last):
+			if options["verbosity"] > 1:
+				self.stdout.write(f"{deleted} borradas (id {position}/{last})")
+
+		deleted = retention.delete_before(
+			Playback, cutoff, chunk_size=options["chunk_size"], pause=options["pause"], using=using, progress=progress,
+		)
+		ran = retention.reclaim_space(Playback, full=options["vacuum"], using=using)
+		self.stdout.write(self.style.SUCCESS(
+			f"{deleted} reproducciones anteriores a {cutoff.isoformat()} borradas" + (f"; {ran}" if ran else "")
+		))
@@ -0,0 +1,36 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from stats.models import FxRate
+from stats.versioning import bump
+
+
+class Command(BaseCommand):
+	help = "Carga tipos de cambio diarios desde un CSV `date,currency,rate` (unidades por 1 EUR)."
+
+	def add_arguments(self, parser):
+		parser.add_argument("path", help="Fichero CSV con cabecera date,currency,rate")
+
+	def handle(self, *args, **options):
+		rates = []
+		with open(options["path"], newline="") as fh:
+			for n, row in enumerate(csv.DictReader(fh), start=2):
+				try:
+					day = parse_date((row.get("date") or "").strip())
+					rate = Decimal((row.get("rate") or "").strip())
+				except (InvalidOperation, ValueError):
+					raise CommandError(f"Línea {n}: valor no válido {row}")
+				currency = (row.get("currency") or "").strip().upper()
+				if not day or len(currency) != 3 or rate <= 0:
+					raise CommandError(f"Línea {n}: fila no válida {row}")
+				rates.append(FxRate(day=day, currency=currency, rate=rate))
+
+		FxRate.objects.bulk_create(
+			rates, batch_size=1000,
+			update_conflicts=True, unique_fields=["currency", "day"], update_fields=["rate"],
+		)
+		bump("fx")
+		self.stdout.write(self.style.SUCCESS(f"{len(rates)} tipos de cambio cargados"))
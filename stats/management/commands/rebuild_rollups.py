@@ -0,0 +1,72 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from stats import sharding
+from stats.rollups import rebuild_label_rollups, rebuild_song_rollups
+from stats.sketches import rebuild_listen_sketches
+
+
+def _init_process():
+	# Con fork el hijo hereda las conexiones del padre: que abra las suyas
+	connections.close_all()
+
+
+def _ready():
+	return True
+
+
+class Command(BaseCommand):
+	help = "Recalcula los rollups diarios y los sketches de duración a partir de las tablas crudas."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--database", default="default", help="Alias de la base de datos")
+		parser.add_argument("--workers", type=int, default=1,
+							help="Procesos que agregan en paralelo; 1 lo hace todo en este proceso")
+		parser.add_argument("--partitions", type=int, default=0,
+							help="Rangos de id en que se parte cada tabla (por defecto 4 por proceso)")
+
+	def handle(self, *args, **options):
+		workers = max(1, options["workers"])
+		partitions = options["partitions"] or (4 * workers if workers > 1 else 1)
+		started = time.monotonic()
+		if workers == 1:
+			self._rebuild(options["database"], partitions, None)
+		else:
+			connections.close_all()
+			with ProcessPoolExecutor(max_workers=workers, initializer=_init_process) as pool:
+				# Los procesos se crean en el primer submit: que sea ahora, sin
+				# conexiones abiertas, y no dentro de la transacción del rebuild
+				pool.submit(_ready).result()
+				self._rebuild(options["database"], partitions, pool)
+		self.stdout.write(f"Terminado en {time.monotonic() - started:.1f}s ({workers} procesos, {partitions} particiones)")
+
+	def _rebuild(self, database, partitions, pool):
+		n = rebuild_label_rollups(
+			using=database, partitions=partitions, executor=pool, progress=self._progress("rollups por discográfica"),
+		)
+		self.stdout.write(self.style.SUCCESS(f"{n} filas de rollup por discográfica"))
+		# Con shards, los rollups por tema y los sketches se recalculan en cada uno
+		for using in sharding.shards() or [database]:
+			n = rebuild_song_rollups(
+				using=using, partitions=partitions, executor=pool, progress=self._progress(f"rollups por tema ({using})"),
+			)
+			self.stdout.write(self.style.SUCCESS(f"{n} filas de rollup por tema ({using})"))
+			n = rebuild_listen_sketches(
+				using=using, partitions=partitions, executor=pool, progress=self._progress(f"sketches ({using})"),
+			)
+			self.stdout.write(self.style.SUCCESS(f"{n} sketches de duración de escucha ({using})"))
+
+	def _progress(self, what):
+		started = time.monotonic()
+		read = 0
+
+		def report(done, total, rows):
+			nonlocal read
+			read += rows
+			rate = read / max(time.monotonic() - started, 1e-6)
+			self.stdout.write(f"  {what}: {done}/{total} particiones, {read} filas leídas ({rate:,.0f} filas/s)")
+
+		return report
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from stats.resolution import resolve_pending_ratings
+
+
+class Command(BaseCommand):
+	help = "Canonicaliza los song_id de las valoraciones pendientes contra el servicio de contenidos."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--batch-size", type=int, default=100, help="song_id distintos por lote")
+		parser.add_argument("--workers", type=int, default=8, help="Peticiones HTTP concurrentes por lote")
+		parser.add_argument("--loop", action="store_true", help="Seguir procesando indefinidamente")
+		parser.add_argument("--interval", type=float, default=5, help="Espera entre lotes vacíos con --loop")
+
+	def handle(self, *args, **options):
+		total = 0
+		while True:
+			n = resolve_pending_ratings(batch_size=options["batch_size"], workers=options["workers"])
+			total += n
+			if n:
+				self.stdout.write(f"{n} valoraciones resueltas")
+				continue
+			if not options["loop"]:
+				break
+			time.sleep(options["interval"])
+		self.stdout.write(self.style.SUCCESS(f"Total: {total} valoraciones resueltas"))
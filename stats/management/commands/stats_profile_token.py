@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from stats.profiling import HEADER, MODES, make_token
+
+
+class Command(BaseCommand):
+	help = "Genera un token firmado para perfilar una petición con la cabecera X-Stats-Profile."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--mode", choices=MODES, default="sample", help="sample (pila muestreada) o cprofile")
+
+	def handle(self, *args, **options):
+		self.stdout.write(f"{HEADER}: {make_token(options['mode'])}")
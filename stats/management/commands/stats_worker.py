@@ -0,0 +1,103 @@
+import os
+import socket
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from stats import tasks
+
+
+def _init_process():
+	# Con fork el hijo hereda las conexiones del padre: que abra las suyas
+	connections.close_all()
+
+
+def _run(task_id: int) -> str:
+	try:
+		return tasks.run_task(task_id)
+	finally:
+		connections.close_all()
+
+
+class Command(BaseCommand):
+	help = "Ejecuta las tareas en segundo plano de `stats` (cola en base de datos)."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--processes", type=int, default=getattr(settings, "STATS_TASK_PROCESSES", 2),
+							help="Procesos del pool; 0 ejecuta las tareas en este proceso")
+		parser.add_argument("--poll", type=float, default=1.0, help="Segundos entre consultas con la cola vacía")
+		parser.add_argument("--kind", action="append", dest="kinds", help="Solo estos tipos de tarea (repetible)")
+		parser.add_argument("--once", action="store_true", help="Vaciar las tareas pendientes y salir")
+
+	def handle(self, *args, **options):
+		worker_id = f"{socket.gethostname()}:{os.getpid()}"
+		kinds = options["kinds"] or None
+		unknown = set(kinds or ()) - set(tasks.REGISTRY)
+		if unknown:
+			self.stderr.write(self.style.ERROR(f"Tipos de tarea desconocidos: {', '.join(sorted(unknown))}"))
+			return
+		if "rating_artists" in (kinds or tasks.REGISTRY):
+			# Valoraciones sin artista escritas sin pasar por la API (cargas, SQL)
+			tasks.enqueue("rating_artists", key="pending")
+		keep_done = getattr(settings, "STATS_TASK_KEEP_DONE_SECONDS", 24 * 3600)
+		processes = options["processes"]
+		self.stdout.write(f"Worker {worker_id}: {processes or 'sin'} procesos, tipos {', '.join(kinds or tasks.REGISTRY)}")
+
+		if processes <= 0:
+			self._loop_inline(worker_id, kinds, options, keep_done)
+			return
+		connections.close_all()
+		with ProcessPoolExecutor(max_workers=processes, initializer=_init_process) as pool:
+			self._loop_pool(pool, processes, worker_id, kinds, options, keep_done)
+
+	def _housekeeping(self, keep_done):
+		n = tasks.requeue_expired()
+		if n:
+			self.stdout.write(f"{n} tareas con lease caducado devueltas a la cola")
+		tasks.purge_done(keep_done)
+
+	def _report(self, task, status):
+		style = self.style.SUCCESS if status == tasks.Task.DONE else self.style.WARNING
+		self.stdout.write(style(f"{task.kind} #{task.pk}: {status}"))
+
+	def _loop_inline(self, worker_id, kinds, options, keep_done):
+		while True:
+			self._housekeeping(keep_done)
+			claimed = tasks.claim(worker_id, limit=1, kinds=kinds)
+			for task in claimed:
+				self._report(task, tasks.run_task(task.pk))
+			if claimed:
+				continue
+			if options["once"]:
+				return
+			time.sleep(options["poll"])
+
+	def _loop_pool(self, pool, processes, worker_id, kinds, options, keep_done):
+		in_flight = {}
+		last_housekeeping = 0.0
+		while True:
+			if time.monotonic() - last_housekeeping > options["poll"]:
+				self._housekeeping(keep_done)
+				last_housekeeping = time.monotonic()
+			free = processes - len(in_flight)
+			if free > 0:
+				running = {}
+				for task in in_flight.values():
+					running[task.kind] = running.get(task.kind, 0) + 1
+				for task in tasks.claim(worker_id, running=running, limit=free, kinds=kinds):
+					in_flight[pool.submit(_run, task.pk)] = task
+			if not in_flight:
+				if options["once"]:
+					return
+				time.sleep(options["poll"])
+				continue
+			done, _ = wait(in_flight, timeout=options["poll"], return_when=FIRST_COMPLETED)
+			for future in done:
+				task = in_flight.pop(future)
+				try:
+					self._report(task, future.result())
+				except Exception as exc:  # noqa: BLE001 - el lease caducará y se reintentará
+					self.stderr.write(self.style.ERROR(f"{task.kind} #{task.pk}: {exc}"))
@@ -0,0 +1,60 @@
+import sqlite3
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from stats import versioning
+
+
+def copy_sqlite_database(source: str, target: str):
+	"""Copy ``source`` over ``target`` with SQLite's online backup API.
+
+	The backup takes a consistent snapshot (WAL included) and writes into the
+	existing replica file, so readers holding persistent connections see the
+	new pages without reopening the file.
+	"""
+	src = sqlite3.connect(source)
+	dst = sqlite3.connect(target)
+	try:
+		src.backup(dst)
+	finally:
+		dst.close()
+		src.close()
+
+
+class Command(BaseCommand):
+	help = "Sincroniza la réplica SQLite de lectura copiando la base de datos principal."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--source", default="default", help="Alias de la base de datos principal")
+		parser.add_argument("--target", default=None, help="Alias de la réplica (STATS_READ_REPLICA_ALIAS por defecto)")
+		parser.add_argument("--interval", type=float, default=0, help="Repetir cada N segundos (0 = una vez)")
+
+	def handle(self, *args, **options):
+		source = options["source"]
+		target = options["target"] or getattr(settings, "STATS_READ_REPLICA_ALIAS", None)
+		if not target or target not in settings.DATABASES:
+			raise CommandError("No hay réplica configurada (DJANGO_DB_REPLICA_PATH).")
+		for alias in (source, target):
+			if settings.DATABASES[alias]["ENGINE"] != "django.db.backends.sqlite3":
+				raise CommandError(f"'{alias}' no es SQLite; usa la replicación nativa del motor.")
+
+		src_path = str(settings.DATABASES[source]["NAME"])
+		dst_path = str(settings.DATABASES[target]["NAME"])
+		while True:
+			started = time.monotonic()
+			try:
+				copy_sqlite_database(src_path, dst_path)
+			except sqlite3.OperationalError as exc:
+				# "database is locked": un lector o escritor retiene el fichero
+				if options["interval"] <= 0:
+					raise CommandError(f"{source} -> {target}: {exc}") from exc
+				self.stderr.write(self.style.WARNING(f"{source} -> {target}: {exc}; se reintenta en {options['interval']}s"))
+			else:
+				# Los resultados leídos de la réplica antes de la copia dejan de valer
+				versioning.bump_replica()
+				self.stdout.write(f"{source} -> {target} copiada en {time.monotonic() - started:.3f}s")
+			if options["interval"] <= 0:
+				break
+			time.sleep(options["interval"])
@@ -0,0 +1,65 @@
+"""Middleware for the ``stats`` app."""
+import logging
+
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+from .profiling import RequestProfile, requested_mode
+from .routers import SAFE_METHODS, pin_primary
+
+logger = logging.getLogger(__name__)
+
+
+class ReplicaPinMiddleware:
+	"""Pin a client to the primary database right after a successful write."""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		response = self.get_response(request)
+		if request.method not in SAFE_METHODS and response.status_code < 400:
+			pin_primary(request, response)
+		return response
+
+
+class ProfilingMiddleware:
+	"""Profile the requests selected by ``stats.profiling.requested_mode``."""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		mode = requested_mode(request)
+		if mode is None:
+			return self.get_response(request)
+
+		with RequestProfile(mode, request.path) as profile:
+			response = self.get_response(request)
+		match = getattr(request, "resolver_match", None)
+		profile.endpoint = f"{request.method} {match._func_path if match else request.path}"
+		profile.status = response.status_code
+		try:
+			path = profile.save()
+		except OSError:
+			logger.exception("could not write profile for %s", profile.endpoint)
+			return response
+		response["X-Stats-Profile-Id"] = path.stem
+		return response
+
+
+class ThresholdGZipMiddleware(GZipMiddleware):
+	"""``GZipMiddleware`` that leaves bodies under ``STATS_GZIP_MIN_BYTES`` uncompressed.
+
+	Small bodies save a few bytes and still cost the compression CPU and the
+	``Vary`` header; Django's own limit is 200 bytes. Streaming responses are
+	never compressed: each chunk of the SSE stream would become its own gzip
+	member, larger than the event, and buffering proxies would hold it back.
+	"""
+
+	def process_response(self, request, response):
+		if response.streaming or response.get("Content-Type", "").startswith("text/event-stream"):
+			return response
+		if len(response.content) < getattr(settings, "STATS_GZIP_MIN_BYTES", 1024):
+			return response
+		return super().process_response(request, response)
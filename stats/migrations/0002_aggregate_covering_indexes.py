@@ -0,0 +1,43 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:01
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='albumsale',
+            name='stats_album_album_i_6ed574_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='playback',
+            name='stats_playb_song_id_830617_idx',
+        ),
+        migrations.AddIndex(
+            model_name='albumsale',
+            index=models.Index(fields=['album_id', 'purchased_at', 'units', 'amount'], name='stats_album_cov_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='playback',
+            index=models.Index(fields=['song_id', 'played_at', 'valid'], name='stats_playb_song_played_valid'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['artist_id', 'rated_at', 'stars'], name='stats_rating_artist_cov_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(fields=['song_id', 'rated_at', 'stars'], name='stats_rating_song_cov_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rating',
+            index=models.Index(condition=models.Q(('artist_id__isnull', True)), fields=['song_id', 'rated_at', 'stars', 'artist_id'], name='stats_rating_unresolved_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0002_aggregate_covering_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rating',
+            name='resolution_pending',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0003_rating_resolution_pending'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LabelDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label_id', models.CharField(max_length=64)),
+                ('day', models.DateField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('sales_count', models.PositiveIntegerField(default=0)),
+                ('units_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+                ('ratings_count', models.PositiveIntegerField(default=0)),
+                ('ratings_sum', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='albumsale',
+            name='label_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='playback',
+            name='label_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='rating',
+            name='label_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='labeldailyrollup',
+            constraint=models.UniqueConstraint(fields=('label_id', 'day'), name='stats_label_rollup_label_day'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:07
+
+from django.db import migrations, models
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_label_revenue(apps, schema_editor):
+    AlbumSale = apps.get_model("stats", "AlbumSale")
+    LabelDailyRevenue = apps.get_model("stats", "LabelDailyRevenue")
+    db = schema_editor.connection.alias
+    rows = (
+        AlbumSale.objects.using(db).exclude(label_id__isnull=True).exclude(label_id="")
+        .annotate(day=TruncDate("purchased_at")).order_by()
+        .values("label_id", "day", "currency").annotate(amount=Sum("amount"))
+    )
+    LabelDailyRevenue.objects.using(db).bulk_create([
+        LabelDailyRevenue(label_id=r["label_id"], day=r["day"], currency=(r["currency"] or "").upper(), amount=r["amount"] or 0)
+        for r in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0004_label_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FxRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18)),
+            ],
+            options={
+                'ordering': ['currency', 'day'],
+            },
+        ),
+        migrations.CreateModel(
+            name='LabelDailyRevenue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('label_id', models.CharField(max_length=64)),
+                ('day', models.DateField()),
+                ('currency', models.CharField(max_length=3)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=16)),
+            ],
+        ),
+        migrations.RemoveIndex(
+            model_name='albumsale',
+            name='stats_album_cov_idx',
+        ),
+        migrations.AddIndex(
+            model_name='albumsale',
+            index=models.Index(fields=['album_id', 'purchased_at', 'units', 'amount', 'currency'], name='stats_album_cov_cur_idx'),
+        ),
+        migrations.RunPython(backfill_label_revenue, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='labeldailyrollup',
+            name='revenue',
+        ),
+        migrations.AddConstraint(
+            model_name='fxrate',
+            constraint=models.UniqueConstraint(fields=('currency', 'day'), name='stats_fxrate_currency_day'),
+        ),
+        migrations.AddConstraint(
+            model_name='labeldailyrevenue',
+            constraint=models.UniqueConstraint(fields=('label_id', 'day', 'currency'), name='stats_label_revenue_key'),
+        ),
+    ]
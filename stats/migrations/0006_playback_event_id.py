@@ -0,0 +1,22 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0005_currency_revenue'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playback',
+            name='event_id',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='playback',
+            constraint=models.UniqueConstraint(condition=models.Q(('event_id__isnull', False)), fields=('event_id',), name='stats_playback_event_id_uniq'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0006_playback_event_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListenDurationSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('song_id', models.CharField(max_length=64)),
+                ('day', models.DateField()),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('digest', models.BinaryField()),
+                ('version', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='listendurationsketch',
+            constraint=models.UniqueConstraint(fields=('song_id', 'day'), name='stats_listen_sketch_song_day'),
+        ),
+    ]
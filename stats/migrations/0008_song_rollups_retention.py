@@ -0,0 +1,55 @@
+# Generated by Django 5.0.3 on 2026-10-19 03:17
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+
+
+def backfill_song_rollups(apps, schema_editor):
+    Playback = apps.get_model("stats", "Playback")
+    SongDailyRollup = apps.get_model("stats", "SongDailyRollup")
+    db = schema_editor.connection.alias
+    rows = (
+        Playback.objects.using(db).annotate(day=TruncDate("played_at")).order_by()
+        .values("song_id", "day")
+        .annotate(plays=Count("id"), valid_plays=Count("id", filter=Q(valid=True)), seconds=Sum("seconds"))
+    )
+    SongDailyRollup.objects.using(db).bulk_create([
+        SongDailyRollup(song_id=r["song_id"], day=r["day"], plays=r["plays"], valid_plays=r["valid_plays"], seconds=r["seconds"] or 0)
+        for r in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0007_listen_duration_sketch'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=32, unique=True)),
+                ('before', models.DateTimeField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SongDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('song_id', models.CharField(max_length=64)),
+                ('day', models.DateField()),
+                ('plays', models.PositiveIntegerField(default=0)),
+                ('valid_plays', models.PositiveIntegerField(default=0)),
+                ('seconds', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='songdailyrollup',
+            constraint=models.UniqueConstraint(fields=('song_id', 'day'), name='stats_song_rollup_song_day'),
+        ),
+        migrations.RunPython(backfill_song_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.0.3 on 2026-10-19 04:12
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    # FTS5 + triggers en SQLite, índice GIN en PostgreSQL (ver stats.search)
+    from stats import search
+
+    search.install(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    from stats import search
+
+    search.uninstall(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stats', '0009_task_queue'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
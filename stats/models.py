@@ -1,38 +1,70 @@
 from django.conf import settings
-from django.db import models
+from django.db import models, router, transaction
+from django.db.models import Q
+from django.utils import timezone
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
-class Playback(models.Model):
+class AtomicSaveMixin:
+	"""Save the row and run its ``post_save`` receivers in one transaction.
+
+	In autocommit Django commits the INSERT before ``post_save``: a rollup
+	rebuild (``stats.rollups.write_lock``) could take its lock in between,
+	count the row and then get its delta on top. Inside one transaction the
+	rebuild waits for both. Swapped fact models (``STATS_*_MODEL``) should
+	use it too.
+	"""
+
+	def save(self, *args, **kwargs):
+		using = kwargs.get("using") or router.db_for_write(type(self), instance=self)
+		with transaction.atomic(using=using):
+			super().save(*args, **kwargs)
+
+
+class Playback(AtomicSaveMixin, models.Model):
 	song_id = models.CharField(max_length=64, db_index=True)
 	seconds = models.PositiveIntegerField(default=0)
 	valid = models.BooleanField(default=True)
 	played_at = models.DateTimeField(auto_now_add=True)
+	# Discográfica del tema, resuelta al escribir (petición o servicio de contenidos)
+	label_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+	# Id de evento del cliente para descartar reintentos (idempotencia)
+	event_id = models.CharField(max_length=64, null=True, blank=True)
 
 	class Meta:
-		indexes = [models.Index(fields=["song_id", "played_at"])]
+		constraints = [
+			models.UniqueConstraint(
+				fields=["event_id"], condition=Q(event_id__isnull=False), name="stats_playback_event_id_uniq",
+			),
+		]
+		# `valid` al final: los conteos con ?valid= se resuelven solo con el índice
+		indexes = [models.Index(fields=["song_id", "played_at", "valid"], name="stats_playb_song_played_valid")]
 		ordering = ["-played_at"]
 
 	def __str__(self):
 		return f"{self.song_id} · {self.seconds}s · {'valid' if self.valid else 'invalid'}"
 
 
-class AlbumSale(models.Model):
+class AlbumSale(AtomicSaveMixin, models.Model):
 	album_id = models.CharField(max_length=64, db_index=True)
 	purchased_at = models.DateTimeField(auto_now_add=True)
 	units = models.PositiveIntegerField(default=1)
 	amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
 	currency = models.CharField(max_length=3, default="EUR")
+	label_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 
 	class Meta:
-		indexes = [models.Index(fields=["album_id", "purchased_at"])]
+		# Índice cubriente: count/Sum(units)/ingresos por moneda/última compra sin tocar la tabla
+		indexes = [
+			models.Index(fields=["album_id", "purchased_at", "units", "amount", "currency"], name="stats_album_cov_cur_idx"),
+		]
 		ordering = ["-purchased_at"]
 
 	def __str__(self):
 		return f"{self.album_id} · {self.units}u · {self.amount}{self.currency}"
 
 
-class Rating(models.Model):
+class Rating(AtomicSaveMixin, models.Model):
 	# Usuario que valora (soporta AUTH_USER_MODEL custom)
 	user = models.ForeignKey(
 		settings.AUTH_USER_MODEL,
@@ -41,14 +73,17 @@ class Rating(models.Model):
 	)
 	# Identificadores funcionales
 	song_id = models.CharField(max_length=64, db_index=True)
-	artist_id = models.CharField(max_length=64, db_index=True, blank=True)
+	artist_id = models.CharField(max_length=64, db_index=True, blank=True, null=True)
 
 	# Puntuación 1..5
 	stars = models.PositiveSmallIntegerField(
 		validators=[MinValueValidator(0), MaxValueValidator(5)]
 	)
 	comment = models.CharField(max_length=512, blank=True)
+	label_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
 	rated_at = models.DateTimeField(auto_now_add=True)
+	# song_id guardado tal cual llegó; pendiente de canonicalizar en segundo plano
+	resolution_pending = models.BooleanField(default=False, db_index=True)
 
 	class Meta:
 		# Allow multiple individual ratings per user/song (each save is a new record).
@@ -59,8 +94,148 @@ class Rating(models.Model):
 		# migration.
 		indexes = [
 			models.Index(fields=["song_id", "artist_id", "rated_at"]),
+			# Índices cubrientes para los agregados de `stats.views`
+			models.Index(fields=["artist_id", "rated_at", "stars"], name="stats_rating_artist_cov_idx"),
+			models.Index(fields=["song_id", "rated_at", "stars"], name="stats_rating_song_cov_idx"),
+			# Valoraciones sin artista resuelto (rama artist_id IS NULL). `artist_id`
+			# se incluye para que SQLite lo considere cubriente con ese WHERE.
+			models.Index(
+				fields=["song_id", "rated_at", "stars", "artist_id"],
+				condition=Q(artist_id__isnull=True),
+				name="stats_rating_unresolved_idx",
+			),
 		]
 		ordering = ["-rated_at"]
 
 	def __str__(self):
 		return f"{self.user} → {self.song_id}: {self.stars}★"
+
+
+class LabelDailyRollup(models.Model):
+	"""Totales diarios por discográfica, mantenidos en cada escritura."""
+	label_id = models.CharField(max_length=64)
+	day = models.DateField()
+	plays = models.PositiveIntegerField(default=0)
+	sales_count = models.PositiveIntegerField(default=0)
+	units_sold = models.PositiveIntegerField(default=0)
+	ratings_count = models.PositiveIntegerField(default=0)
+	ratings_sum = models.PositiveIntegerField(default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=["label_id", "day"], name="stats_label_rollup_label_day"),
+		]
+
+	def __str__(self):
+		return f"{self.label_id} · {self.day} · {self.plays} plays"
+
+
+class SongDailyRollup(models.Model):
+	"""Reproducciones diarias por tema; sustituyen a las filas crudas ya compactadas."""
+	song_id = models.CharField(max_length=64)
+	day = models.DateField()
+	plays = models.PositiveIntegerField(default=0)
+	valid_plays = models.PositiveIntegerField(default=0)
+	seconds = models.PositiveBigIntegerField(default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=["song_id", "day"], name="stats_song_rollup_song_day"),
+		]
+
+	def __str__(self):
+		return f"{self.song_id} · {self.day} · {self.plays} plays"
+
+
+class RetentionWatermark(models.Model):
+	"""Las filas crudas de `name` anteriores a `before` se han borrado tras compactarlas."""
+	name = models.CharField(max_length=32, unique=True)
+	before = models.DateTimeField()
+	updated_at = models.DateTimeField(auto_now=True)
+
+	def __str__(self):
+		return f"{self.name} < {self.before.isoformat()}"
+
+
+class LabelDailyRevenue(models.Model):
+	"""Ingresos diarios por discográfica y moneda (sin convertir)."""
+	label_id = models.CharField(max_length=64)
+	day = models.DateField()
+	currency = models.CharField(max_length=3)
+	amount = models.DecimalField(max_digits=16, decimal_places=2, default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=["label_id", "day", "currency"], name="stats_label_revenue_key"),
+		]
+
+	def __str__(self):
+		return f"{self.label_id} · {self.day} · {self.amount}{self.currency}"
+
+
+class FxRate(models.Model):
+	"""Tipo de cambio diario: unidades de `currency` por 1 EUR (convención BCE)."""
+	day = models.DateField()
+	currency = models.CharField(max_length=3)
+	rate = models.DecimalField(max_digits=18, decimal_places=8)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=["currency", "day"], name="stats_fxrate_currency_day"),
+		]
+		ordering = ["currency", "day"]
+
+	def __str__(self):
+		return f"{self.day} · 1 EUR = {self.rate} {self.currency}"
+
+
+class ListenDurationSketch(models.Model):
+	"""t-digest serializado de la duración de escucha de un tema en un día."""
+	song_id = models.CharField(max_length=64)
+	day = models.DateField()
+	count = models.PositiveIntegerField(default=0)
+	digest = models.BinaryField()
+	# Control de concurrencia optimista de `stats.sketches.record_listen`
+	version = models.PositiveIntegerField(default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=["song_id", "day"], name="stats_listen_sketch_song_day"),
+		]
+
+	def __str__(self):
+		return f"{self.song_id} · {self.day} · {self.count} escuchas"
+
+
+class Task(models.Model):
+	"""Trabajo en segundo plano de `stats.tasks`, ejecutado por `manage.py stats_worker`."""
+	QUEUED = "queued"
+	RUNNING = "running"
+	DONE = "done"
+	FAILED = "failed"
+	STATUSES = [(QUEUED, QUEUED), (RUNNING, RUNNING), (DONE, DONE), (FAILED, FAILED)]
+
+	kind = models.CharField(max_length=64)
+	# Clave de deduplicación: como mucho una tarea en cola por (kind, key)
+	key = models.CharField(max_length=200, blank=True)
+	payload = models.JSONField(default=dict, blank=True)
+	status = models.CharField(max_length=16, choices=STATUSES, default=QUEUED)
+	attempts = models.PositiveSmallIntegerField(default=0)
+	run_after = models.DateTimeField(default=timezone.now)
+	# Lease del worker que la ejecuta; caducado, la tarea vuelve a la cola
+	locked_by = models.CharField(max_length=64, blank=True)
+	locked_until = models.DateTimeField(null=True, blank=True)
+	last_error = models.TextField(blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	finished_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(
+				fields=["kind", "key"], condition=Q(status="queued"), name="stats_task_queued_uniq",
+			),
+		]
+		indexes = [models.Index(fields=["status", "run_after"], name="stats_task_status_run_idx")]
+
+	def __str__(self):
+		return f"{self.kind}[{self.key}] · {self.status} · {self.attempts} intentos"
@@ -0,0 +1,193 @@
+"""Opt-in per-request profiling.
+
+``stats.middleware.ProfilingMiddleware`` profiles a request when it carries a
+valid ``X-Stats-Profile`` token (see ``manage.py stats_profile_token``) or
+when it falls in the ``STATS_PROFILE_SAMPLE_RATE`` sample. Two modes exist:
+
+- ``sample``: a background thread records the request thread's stack every
+  ``STATS_PROFILE_INTERVAL_MS`` and writes collapsed stacks (``.collapsed``),
+  the input of ``flamegraph.pl`` and speedscope. Cheap enough for production.
+- ``cprofile``: deterministic ``cProfile`` output (``.pstats``).
+
+Each profile gets a ``.json`` sidecar in ``STATS_PROFILE_DIR`` with the
+endpoint, status, wall time, number of SQL queries and the time spent in
+content service calls. The directory keeps the newest
+``STATS_PROFILE_MAX_FILES`` profiles; older ones are deleted on save.
+"""
+import contextvars
+import cProfile
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from django.conf import settings
+from django.core import signing
+from django.db import connections
+
+HEADER = "X-Stats-Profile"
+SALT = "stats.profiling"
+MODES = ("sample", "cprofile")
+
+_http = contextvars.ContextVar("stats_profile_http", default=None)
+
+
+def make_token(mode: str = "sample") -> str:
+	if mode not in MODES:
+		raise ValueError(f"mode must be one of {MODES}")
+	return signing.dumps({"mode": mode}, salt=SALT)
+
+
+def requested_mode(request) -> str | None:
+	"""Profiling mode for ``request``, or ``None`` to run it normally."""
+	token = request.headers.get(HEADER)
+	if token:
+		try:
+			data = signing.loads(token, salt=SALT, max_age=getattr(settings, "STATS_PROFILE_TOKEN_MAX_AGE", 3600))
+		except signing.BadSignature:
+			return None
+		mode = data.get("mode")
+		return mode if mode in MODES else None
+	rate = getattr(settings, "STATS_PROFILE_SAMPLE_RATE", 0.0)
+	if rate and random.random() < rate:
+		return getattr(settings, "STATS_PROFILE_MODE", "sample")
+	return None
+
+
+def record_http(seconds: float):
+	"""Called by ``stats.content`` after each outbound request."""
+	stats = _http.get()
+	if stats is not None:
+		stats["calls"] += 1
+		stats["seconds"] += seconds
+
+
+def prune(directory: Path, keep: int) -> int:
+	"""Delete all but the newest ``keep`` profiles (and their sidecars) in ``directory``."""
+	sidecars = []
+	for meta in directory.glob("*.json"):
+		try:
+			sidecars.append((meta.stat().st_mtime_ns, meta))
+		except FileNotFoundError:  # otro proceso la acaba de borrar
+			continue
+	sidecars.sort(reverse=True)
+	for _, meta in sidecars[keep:]:
+		for suffix in (".json", ".pstats", ".collapsed"):
+			meta.with_suffix(suffix).unlink(missing_ok=True)
+	return max(0, len(sidecars) - keep)
+
+
+def _frame_label(frame) -> str:
+	code = frame.f_code
+	return f"{frame.f_globals.get('__name__', '?')}:{code.co_name}"
+
+
+class StackSampler:
+	def __init__(self, thread_id: int, interval: float):
+		self.thread_id = thread_id
+		self.interval = interval
+		self.stacks = Counter()
+		self._stop = threading.Event()
+		self._thread = threading.Thread(target=self._run, name="stats-profiler", daemon=True)
+
+	def _run(self):
+		while not self._stop.wait(self.interval):
+			frame = sys._current_frames().get(self.thread_id)
+			stack = []
+			while frame is not None:
+				stack.append(_frame_label(frame))
+				frame = frame.f_back
+			if stack:
+				self.stacks[";".join(reversed(stack))] += 1
+
+	def start(self):
+		self._thread.start()
+
+	def stop(self):
+		self._stop.set()
+		self._thread.join()
+
+	def write(self, path: Path):
+		with open(path, "w") as fh:
+			for stack, count in self.stacks.most_common():
+				fh.write(f"{stack} {count}\n")
+
+
+class RequestProfile:
+	"""Context manager that profiles the code it wraps."""
+
+	def __init__(self, mode: str, endpoint: str):
+		self.mode = mode
+		self.endpoint = endpoint
+		self.queries = 0
+		self.http = {"calls": 0, "seconds": 0.0}
+		self.status = None
+		self.path = None
+		self._wrappers = []
+
+	def _count_query(self, execute, sql, params, many, context):
+		self.queries += 1
+		return execute(sql, params, many, context)
+
+	def __enter__(self):
+		for conn in connections.all():
+			cm = conn.execute_wrapper(self._count_query)
+			cm.__enter__()
+			self._wrappers.append(cm)
+		self._token = _http.set(self.http)
+		self._started = time.perf_counter()
+		if self.mode == "cprofile":
+			self._profiler = cProfile.Profile()
+			self._profiler.enable()
+		else:
+			interval = getattr(settings, "STATS_PROFILE_INTERVAL_MS", 5) / 1000
+			self._profiler = StackSampler(threading.get_ident(), interval)
+			self._profiler.start()
+		return self
+
+	def __exit__(self, *exc):
+		if self.mode == "cprofile":
+			self._profiler.disable()
+		else:
+			self._profiler.stop()
+		self.elapsed = time.perf_counter() - self._started
+		_http.reset(self._token)
+		for cm in reversed(self._wrappers):
+			cm.__exit__(None, None, None)
+		self._wrappers = []
+		return False
+
+	def save(self, directory=None) -> Path:
+		directory = Path(directory or getattr(settings, "STATS_PROFILE_DIR", "profiles"))
+		directory.mkdir(parents=True, exist_ok=True)
+		slug = re.sub(r"[^A-Za-z0-9]+", "-", self.endpoint).strip("-")[:80] or "root"
+		# Varias peticiones del mismo proceso pueden caer en el mismo segundo
+		stem = f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}-{uuid.uuid4().hex[:8]}-{slug}"
+		if self.mode == "cprofile":
+			self.path = directory / f"{stem}.pstats"
+			self._profiler.dump_stats(str(self.path))
+		else:
+			self.path = directory / f"{stem}.collapsed"
+			self._profiler.write(self.path)
+		meta = {
+			"endpoint": self.endpoint,
+			"mode": self.mode,
+			"status": self.status,
+			"wall_ms": round(self.elapsed * 1000, 3),
+			"queries": self.queries,
+			"http_calls": self.http["calls"],
+			"http_ms": round(self.http["seconds"] * 1000, 3),
+			"profile": self.path.name,
+		}
+		with open(directory / f"{stem}.json", "w") as fh:
+			json.dump(meta, fh, indent=2)
+		keep = getattr(settings, "STATS_PROFILE_MAX_FILES", 500)
+		if keep:
+			prune(directory, keep)
+		return self.path
@@ -0,0 +1,152 @@
+"""Background canonicalization of rating song ids.
+
+Ratings are stored with the song id the client sent and
+``resolution_pending=True``. This module resolves those ids against the
+content service outside the request, in batches, rewrites the ratings and
+bumps the version stamps of both the raw and canonical keys. Ids the
+service could not be asked about (outage, open circuit) stay pending and
+are not cached, so they are retried later instead of being taken as
+canonical.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from . import analytics, content
+from .utils import get_rating_model
+from .versioning import bump
+
+logger = logging.getLogger(__name__)
+
+CANONICAL_PREFIX = "stats:song-canonical:"
+CANONICAL_TTL = 24 * 3600
+
+_lock = threading.Lock()
+_running = False
+_dirty = False
+
+
+def known_canonical(song_id: str) -> str | None:
+	"""Canonical id for ``song_id`` if it is already known, without HTTP calls."""
+	cached = cache.get(CANONICAL_PREFIX + song_id)
+	if cached:
+		return cached
+	# Si ya hay valoraciones resueltas con ese id, el id ya es canónico
+	Rating = get_rating_model()
+	if Rating.objects.filter(song_id=song_id, resolution_pending=False).exists():
+		return song_id
+	return None
+
+
+def _resolve_one(song_id: str) -> str | None:
+	"""Canonical id of ``song_id``, or ``None`` if the content service could not answer."""
+	from .views import normalize_song_id
+
+	try:
+		canonical = str(normalize_song_id(song_id, required=True) or song_id)
+	except content.Unavailable:
+		return None
+	cache.set(CANONICAL_PREFIX + song_id, canonical, CANONICAL_TTL)
+	return canonical
+
+
+def _resolve_batch(batch_size: int, workers: int) -> tuple[int, int]:
+	"""``(ratings updated, song ids left pending because the service was unavailable)``."""
+	Rating = get_rating_model()
+	raw_ids = list(
+		Rating.objects.filter(resolution_pending=True)
+		.order_by()
+		.values_list("song_id", flat=True)
+		.distinct()[:batch_size]
+	)
+	if not raw_ids:
+		return 0, 0
+	# Con el circuito abierto no se puede resolver nada: mejor esperar
+	if not content.available():
+		return 0, len(raw_ids)
+
+	# Las llamadas HTTP del lote se solapan; las escrituras van después
+	with ThreadPoolExecutor(max_workers=max(1, min(workers, len(raw_ids)))) as pool:
+		resolved = dict(zip(raw_ids, pool.map(_resolve_one, raw_ids)))
+
+	updated = 0
+	unresolved = 0
+	for raw, canonical in resolved.items():
+		if canonical is None:
+			unresolved += 1
+			continue
+		n = Rating.objects.filter(resolution_pending=True, song_id=raw).update(
+			song_id=canonical, resolution_pending=False,
+		)
+		if n:
+			updated += n
+			bump("rating", f"rating:song_id:{raw}", f"rating:song_id:{canonical}")
+			# .update() no emite señales: el motor analítico debe recargar
+			analytics.ratings.invalidate()
+	if unresolved:
+		logger.info("%d song ids left pending: content service unavailable", unresolved)
+	return updated, unresolved
+
+
+def resolve_pending_ratings(batch_size: int = 100, workers: int = 8) -> int:
+	"""Resolve one batch of distinct pending song ids. Returns ratings updated."""
+	return _resolve_batch(batch_size, workers)[0]
+
+
+def resolve_all_pending(batch_size: int = 100) -> int:
+	"""Resolve every pending rating. Raises ``content.Unavailable`` if some
+	were left pending because the content service could not answer."""
+	total = 0
+	while True:
+		n, unresolved = _resolve_batch(batch_size, 8)
+		if not n:
+			if unresolved:
+				raise content.Unavailable(f"{unresolved} song ids left pending")
+			return total
+		total += n
+
+
+def _run_in_background():
+	global _running, _dirty
+	try:
+		while True:
+			with _lock:
+				if not _dirty:
+					_running = False
+					return
+				_dirty = False
+			resolve_all_pending()
+	except content.Unavailable as exc:
+		# Quedan pendientes: la próxima valoración o resolve_song_ids las reintenta
+		logger.warning("Background song id resolution paused: %s", exc)
+		with _lock:
+			_running = False
+	except Exception:  # noqa: BLE001 - el comando resolve_song_ids lo reintentará
+		logger.exception("Background song id resolution failed")
+		with _lock:
+			_running = False
+	finally:
+		connection.close()
+
+
+def schedule_resolution():
+	"""Wake the in-process resolver thread, starting it if needed, or queue a
+	``resolve_song_ids`` task when ``STATS_TASKS_ENABLED``."""
+	global _running, _dirty
+	from . import tasks
+
+	if tasks.enabled():
+		tasks.enqueue("resolve_song_ids", key="pending")
+		return
+	if not getattr(settings, "STATS_RESOLVE_IN_BACKGROUND", True):
+		return
+	with _lock:
+		_dirty = True
+		if _running:
+			return
+		_running = True
+	threading.Thread(target=_run_in_background, name="stats-song-resolver", daemon=True).start()
@@ -0,0 +1,237 @@
+"""Retention of raw ``Playback`` rows.
+
+``manage.py compact_playbacks`` deletes the raw plays older than the
+retention horizon once ``SongDailyRollup`` is verified to cover them, and
+records the cut in a ``RetentionWatermark``. Readers split their ranges at
+the watermark: raw rows from the watermark on; before it, the columnar
+archive (``stats.archive``) for the months it holds and the daily rollups
+for the rest. Ranges answered from rollups resolve to whole days.
+
+Workers cache the watermark for ``STATS_RETENTION_CACHE_SECONDS``; the
+command waits that long after moving the watermark before deleting rows, so
+no worker still counts the rows being removed as raw data.
+"""
+import time
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Count, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import archive, sharding
+from .models import RetentionWatermark, SongDailyRollup
+
+PLAYBACK = "playback"
+
+_cached = {}
+
+
+def _cache_seconds() -> float:
+	return getattr(settings, "STATS_RETENTION_CACHE_SECONDS", 30)
+
+
+def watermark(name: str = PLAYBACK, using: str | None = None):
+	"""Start of the raw data of ``name`` (aware datetime) or ``None``.
+
+	Without ``using``: the selected playback shard, else ``default``.
+	"""
+	using = sharding.alias(using)
+	key = (name, using)
+	hit = _cached.get(key)
+	now = time.monotonic()
+	if hit and hit[0] > now:
+		return hit[1]
+	value = RetentionWatermark.objects.using(using).filter(name=name).values_list("before", flat=True).first()
+	_cached[key] = (now + _cache_seconds(), value)
+	return value
+
+
+def set_watermark(before, name: str = PLAYBACK, using: str = "default"):
+	RetentionWatermark.objects.using(using).update_or_create(name=name, defaults={"before": before})
+	_cached.pop((name, using), None)
+
+
+def clear_cache():
+	_cached.clear()
+
+
+def day_start(day):
+	"""Aware datetime at the start of ``day`` in the current time zone."""
+	return timezone.make_aware(datetime.combine(day, dt_time.min))
+
+
+def raw_only(qs, field: str = "played_at", using: str | None = None):
+	"""``qs`` limited to the rows newer than the watermark."""
+	wm = watermark(using=using)
+	return qs.filter(**{f"{field}__gte": wm}) if wm else qs
+
+
+def _compacted_qs(start=None, end=None, using=None):
+	using = sharding.alias(using)
+	wm = watermark(using=using)
+	if wm is None or (start is not None and start >= wm):
+		return None
+	qs = SongDailyRollup.objects.using(using).filter(day__lt=timezone.localtime(wm).date())
+	if start is not None:
+		qs = qs.filter(day__gte=timezone.localtime(start).date())
+	if end is not None:
+		qs = qs.filter(day__lte=timezone.localtime(end).date())
+	# Los meses archivados se leen del archivo columnar, con detalle por fila
+	for month in archive.sealed(wm, using=using):
+		qs = qs.exclude(day__gte=month.start.date(), day__lt=month.end.date())
+	return qs
+
+
+def _archived(start=None, end=None, using=None) -> list:
+	using = sharding.alias(using)
+	wm = watermark(using=using)
+	if wm is None or (start is not None and start >= wm):
+		return []
+	return archive.sealed(wm, start, end, using=using)
+
+
+def _plays_expr(valid):
+	if valid is True:
+		return Sum("valid_plays")
+	if valid is False:
+		return Sum("plays") - Sum("valid_plays")
+	return Sum("plays")
+
+
+def compacted_plays(song_id=None, start=None, end=None, valid=None, using=None) -> int:
+	"""Plays before the watermark (from the rollups) within ``start``..``end``."""
+	qs = _compacted_qs(start, end, using)
+	if qs is None:
+		return 0
+	if song_id is not None:
+		qs = qs.filter(song_id=song_id)
+	total = qs.aggregate(n=_plays_expr(valid))["n"] or 0
+	return total + sum(m.count(song_id, start, end, valid) for m in _archived(start, end, using))
+
+
+def compacted_by_song(song_ids, start=None, end=None, valid=None, using=None) -> dict:
+	"""Plays before the watermark per song; every song when ``song_ids`` is ``None``."""
+	qs = _compacted_qs(start, end, using)
+	if qs is None:
+		return {}
+	if song_ids is not None:
+		song_ids = list(song_ids)
+		qs = qs.filter(song_id__in=song_ids)
+	rows = qs.values("song_id").annotate(n=_plays_expr(valid)).order_by()
+	out = {r["song_id"]: r["n"] or 0 for r in rows}
+	for month in _archived(start, end, using):
+		if song_ids is None:
+			counts = month.counts_by_song(start, end, valid)
+		else:
+			counts = {s: month.count(s, start, end, valid) for s in song_ids}
+		for song_id, n in counts.items():
+			if n:
+				out[song_id] = out.get(song_id, 0) + n
+	return out
+
+
+def compacted_rows(song_id, interval, start=None, end=None, valid=None, using=None) -> list:
+	"""``[{"bucket": datetime, "plays": n}]`` before the watermark, for time series.
+
+	Rollup days land on their day start; archived months keep full detail.
+	"""
+	qs = _compacted_qs(start, end, using)
+	if qs is None:
+		return []
+	rows = qs.filter(song_id=song_id).values("day").annotate(plays=_plays_expr(valid)).order_by("day")
+	out = [{"bucket": day_start(r["day"]), "plays": r["plays"] or 0} for r in rows]
+	for month in _archived(start, end, using):
+		keys, counts = month.bucketed(song_id, interval, start, end, valid)
+		out.extend(
+			{"bucket": k.astype("datetime64[s]").item().replace(tzinfo=dt_timezone.utc), "plays": int(n)}
+			for k, n in zip(keys, counts)
+		)
+	return out
+
+
+def coverage_gaps(Playback, before, using="default") -> list:
+	"""``(song_id, day, raw, rollup)`` for every day before ``before`` where
+	``SongDailyRollup`` disagrees with the raw rows."""
+	raw = (
+		Playback.objects.using(using).filter(played_at__lt=before)
+		.annotate(day=TruncDate("played_at")).order_by()
+		.values("song_id", "day")
+		.annotate(plays=Count("id"), valid_plays=Count("id", filter=Q(valid=True)), seconds=Sum("seconds"))
+	)
+	gaps = []
+	days = {}
+	for row in raw.iterator(chunk_size=5000):
+		days.setdefault(row["day"], {})[row["song_id"]] = (row["plays"], row["valid_plays"], row["seconds"] or 0)
+	for day, songs in days.items():
+		rolled = {
+			r[0]: r[1:]
+			for r in SongDailyRollup.objects.using(using).filter(day=day, song_id__in=list(songs))
+			.values_list("song_id", "plays", "valid_plays", "seconds")
+		}
+		for song_id, values in songs.items():
+			if rolled.get(song_id) != values:
+				gaps.append((song_id, day, values, rolled.get(song_id)))
+	return gaps
+
+
+def repair(gaps, using="default"):
+	for song_id, day, (plays, valid_plays, seconds), _ in gaps:
+		SongDailyRollup.objects.using(using).update_or_create(
+			song_id=song_id, day=day,
+			defaults={"plays": plays, "valid_plays": valid_plays, "seconds": seconds},
+		)
+
+
+def delete_before(Playback, before, chunk_size=5000, pause=0.05, using="default", progress=None) -> int:
+	"""Delete raw rows older than ``before`` in primary-key ranges of ``chunk_size``.
+
+	Each chunk is its own short statement (autocommit), with ``pause``
+	seconds between chunks so writers get the lock in between. The DELETE
+	is raw SQL: the rollups must keep the rows' contributions.
+	"""
+	old = Playback.objects.using(using).filter(played_at__lt=before).order_by()
+	bounds = old.values_list("pk", flat=True)
+	lo = bounds.order_by("pk").first()
+	hi = bounds.order_by("-pk").first()
+	if lo is None:
+		return 0
+	table = Playback._meta.db_table
+	pk = Playback._meta.pk.column
+	conn = connections[using]
+	qn = conn.ops.quote_name
+	sql = f"DELETE FROM {qn(table)} WHERE {qn(pk)} >= %s AND {qn(pk)} < %s AND {qn('played_at')} < %s"
+	cutoff = conn.ops.adapt_datetimefield_value(before)
+	deleted = 0
+	while lo <= hi:
+		with conn.cursor() as cursor:
+			cursor.execute(sql, [lo, lo + chunk_size, cutoff])
+			deleted += max(cursor.rowcount, 0)
+		lo += chunk_size
+		if progress:
+			progress(deleted, lo, hi)
+		if pause and lo <= hi:
+			time.sleep(pause)
+	return deleted
+
+
+def reclaim_space(Playback, full=False, using="default") -> str:
+	"""Give the freed pages back to the filesystem; returns what was run."""
+	conn = connections[using]
+	with conn.cursor() as cursor:
+		if conn.vendor == "sqlite":
+			cursor.execute("PRAGMA auto_vacuum")
+			if full:
+				cursor.execute("VACUUM")
+				return "VACUUM"
+			if cursor.fetchone()[0] == 2:
+				cursor.execute("PRAGMA incremental_vacuum")
+				return "PRAGMA incremental_vacuum"
+			return ""
+		if conn.vendor == "postgresql":
+			table = conn.ops.quote_name(Playback._meta.db_table)
+			statement = f"VACUUM {'FULL ' if full else ''}ANALYZE {table}"
+			cursor.execute(statement)
+			return statement
+	return ""
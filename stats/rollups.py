@@ -0,0 +1,336 @@
+"""Daily rollups maintained from the write paths.
+
+``LabelDailyRollup`` keeps, per label and day, the plays, sales, units and
+rating totals of the label's catalog, and ``LabelDailyRevenue`` the revenue
+per label, day and currency. Signal receivers in ``stats.signals`` apply each
+write as a delta, so reading a label summary only sums a handful of rollup
+rows. ``manage.py rebuild_rollups`` recomputes them from the raw tables after
+an import or a bug; with ``--workers`` each table is split in id ranges that
+a process pool aggregates, and the partial sums are merged before writing.
+
+A rebuild holds the write lock of the tables it reads (``write_lock``) from
+before the first read until the new rollups are committed, so no write and
+no signal delta can land in between and be overwritten. Writes wait for it
+meanwhile (on SQLite, those that wait longer than ``busy_timeout`` fail), so
+run rebuilds at a quiet time. The fact models save the raw row and apply
+its deltas in one transaction (``stats.models.AtomicSaveMixin``), so the
+lock is taken either before both or after both.
+"""
+import logging
+from concurrent.futures import as_completed
+from contextlib import ExitStack, contextmanager
+from decimal import Decimal
+
+from django.db import IntegrityError, connections, transaction
+from django.db.models import Count, F, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from . import retention, sharding
+from .models import LabelDailyRevenue, LabelDailyRollup, SongDailyRollup
+from .utils import get_album_sale_model, get_playback_model, get_rating_model
+
+logger = logging.getLogger(__name__)
+
+LABEL_FIELDS = ("plays", "sales_count", "units_sold", "ratings_count", "ratings_sum")
+
+
+def _day(ts):
+	if ts is None:
+		ts = timezone.now()
+	return timezone.localtime(ts).date() if timezone.is_aware(ts) else ts.date()
+
+
+def contributions(instance) -> list:
+	"""``(rollup model, key fields, deltas)`` that ``instance`` adds to the rollups."""
+	out = []
+	label = getattr(instance, "label_id", None)
+	name = instance._meta.model_name
+	if name == "playback":
+		out.append((SongDailyRollup, {"song_id": instance.song_id, "day": _day(instance.played_at)}, {
+			"plays": 1, "valid_plays": int(bool(instance.valid)), "seconds": int(instance.seconds or 0),
+		}))
+	if label and name == "playback":
+		out.append((LabelDailyRollup, {"label_id": label, "day": _day(instance.played_at)}, {"plays": 1}))
+	elif label and name == "albumsale":
+		day = _day(instance.purchased_at)
+		out.append((LabelDailyRollup, {"label_id": label, "day": day}, {
+			"sales_count": 1, "units_sold": int(instance.units or 0),
+		}))
+		out.append((
+			LabelDailyRevenue,
+			{"label_id": label, "day": day, "currency": (instance.currency or "").upper()},
+			{"amount": Decimal(str(instance.amount or 0))},
+		))
+	elif label and name == "rating":
+		out.append((LabelDailyRollup, {"label_id": label, "day": _day(instance.rated_at)}, {
+			"ratings_count": 1, "ratings_sum": int(instance.stars or 0),
+		}))
+	return out
+
+
+def apply_delta(model, keys, deltas, sign=1, using="default"):
+	deltas = {k: v * sign for k, v in deltas.items() if v}
+	if not deltas:
+		return
+	qs = model.objects.using(using).filter(**keys)
+	increments = {k: F(k) + v for k, v in deltas.items()}
+	try:
+		with transaction.atomic(using=using):
+			if qs.update(**increments):
+				return
+			if sign < 0:
+				logger.warning("No %s row to subtract from for %s", model.__name__, keys)
+				return
+			try:
+				with transaction.atomic(using=using):
+					model.objects.using(using).create(**keys, **deltas)
+			except IntegrityError:
+				# Otra escritura creó la fila entre el UPDATE y el INSERT
+				qs.update(**increments)
+	except IntegrityError:
+		# Restar por debajo de 0 indica rollups desfasados: rebuild_rollups lo corrige
+		logger.warning("%s drift for %s: %s", model.__name__, keys, deltas)
+
+
+def apply_contributions(items, sign=1, using="default"):
+	for model, keys, deltas in items:
+		# Con shards, la escritura llega por el shard del tema pero los rollups por discográfica viven en default
+		apply_delta(model, keys, deltas, sign=sign, using=sharding.db_for(model, using))
+
+
+def _day_range(qs, start, end):
+	if start:
+		qs = qs.filter(day__gte=start)
+	if end:
+		qs = qs.filter(day__lte=end)
+	return qs
+
+
+def label_summary(label_id, start=None, end=None, using="default") -> dict:
+	"""Totals of ``label_id`` plus its revenue as ``(currency, day, amount)`` sums."""
+	qs = _day_range(LabelDailyRollup.objects.using(using).filter(label_id=label_id), start, end)
+	totals = qs.aggregate(**{k: Sum(k) for k in LABEL_FIELDS})
+	summary = {k: (totals[k] or 0) for k in LABEL_FIELDS}
+	revenue = _day_range(LabelDailyRevenue.objects.using(using).filter(label_id=label_id), start, end)
+	summary["revenue_groups"] = list(revenue.values_list("currency", "day", "amount"))
+	return summary
+
+
+@contextmanager
+def write_lock(tables: dict):
+	"""Block writes to ``{alias: [model, ...]}`` until the block ends; reads go on.
+
+	PostgreSQL locks those tables in ``SHARE ROW EXCLUSIVE`` mode. SQLite has
+	a single write lock per file: an empty ``UPDATE`` takes it.
+	"""
+	with ExitStack() as stack:
+		for alias, models in tables.items():
+			models = [m for m in models if m is not None]
+			if not models:
+				continue
+			stack.enter_context(transaction.atomic(using=alias))
+			connection = connections[alias]
+			names = [connection.ops.quote_name(m._meta.db_table) for m in models]
+			with connection.cursor() as cursor:
+				if connection.vendor == "postgresql":
+					cursor.execute(f"LOCK TABLE {', '.join(names)} IN SHARE ROW EXCLUSIVE MODE")
+				elif connection.vendor == "sqlite":
+					cursor.execute(f"UPDATE {names[0]} SET id = id WHERE 0")
+		yield
+
+
+LABEL_SOURCES = {
+	"playback": ("played_at", {"plays": ("count", None)}),
+	"albumsale": ("purchased_at", {"sales_count": ("count", None), "units_sold": ("sum", "units")}),
+	"rating": ("rated_at", {"ratings_count": ("count", None), "ratings_sum": ("sum", "stars")}),
+}
+
+
+def _source_model(source: str):
+	return {"playback": get_playback_model, "albumsale": get_album_sale_model, "rating": get_rating_model}[source]()
+
+
+def id_ranges(qs, partitions: int) -> list:
+	"""Split the primary keys of ``qs`` into about ``partitions`` ``(lo, hi)`` ranges, ``hi`` excluded.
+
+	A single ``(None, None)`` range (the whole table) when ``partitions`` is 1.
+	"""
+	if partitions <= 1:
+		return [(None, None)]
+	bounds = qs.aggregate(lo=Min("pk"), hi=Max("pk"))
+	if bounds["lo"] is None:
+		return []
+	lo, hi = bounds["lo"], bounds["hi"] + 1
+	step = -(-(hi - lo) // partitions)
+	return [(start, min(start + step, hi)) for start in range(lo, hi, step)]
+
+
+def _id_range(qs, lo, hi):
+	if lo is not None:
+		qs = qs.filter(pk__gte=lo)
+	if hi is not None:
+		qs = qs.filter(pk__lt=hi)
+	return qs
+
+
+def run_partitions(fn, jobs, executor=None, progress=None) -> list:
+	"""``[fn(*job) for job in jobs]``, submitted to ``executor`` (a process pool) if given.
+
+	Each job returns a tuple whose last item is the number of raw rows it
+	read; ``progress(done, total, rows)`` is called as each one finishes.
+	"""
+	if executor is None:
+		results = []
+		for job in jobs:
+			results.append(fn(*job))
+			if progress:
+				progress(len(results), len(jobs), results[-1][-1])
+		return results
+	futures = [executor.submit(fn, *job) for job in jobs]
+	for done, future in enumerate(as_completed(futures), 1):
+		if progress:
+			progress(done, len(jobs), future.result()[-1])
+	return [future.result() for future in futures]
+
+
+def label_partition(source: str, db: str, lo=None, hi=None, wm=None):
+	"""Label rollup sums of the ``source`` rows of ``db`` with ``lo <= id < hi``.
+
+	Returns ``(rows, revenue, read)``: ``{(label, day): {field: n}}``,
+	``{(label, day, currency): amount}`` (sales only) and the rows read.
+	"""
+	ts_field, fields = LABEL_SOURCES[source]
+	base = _id_range(_source_model(source).objects.using(db), lo, hi)
+	base = base.exclude(label_id__isnull=True).exclude(label_id="")
+	if wm is not None and ts_field == "played_at":
+		base = base.filter(played_at__gte=wm)
+	aggs = {name: (Count("id") if kind == "count" else Sum(col)) for name, (kind, col) in fields.items()}
+	grouped = (
+		base.annotate(day=TruncDate(ts_field)).order_by()
+		.values("label_id", "day").annotate(rows_read=Count("id"), **aggs)
+	)
+	rows, read = {}, 0
+	for row in grouped.iterator(chunk_size=2000):
+		rows[(row["label_id"], row["day"])] = {name: row[name] or 0 for name in fields}
+		read += row["rows_read"]
+	revenue = {}
+	if source == "albumsale":
+		grouped = (
+			base.annotate(day=TruncDate(ts_field)).order_by()
+			.values("label_id", "day", "currency").annotate(amount=Sum("amount"))
+		)
+		for row in grouped.iterator(chunk_size=2000):
+			key = (row["label_id"], row["day"], (row["currency"] or "").upper())
+			revenue[key] = revenue.get(key, 0) + (row["amount"] or 0)
+	return rows, revenue, read
+
+
+def rebuild_label_rollups(using="default", partitions: int = 1, executor=None, progress=None) -> int:
+	"""Recompute every label rollup from the raw tables. Returns rows written.
+
+	Each table is read in ``partitions`` id ranges, in ``executor`` if given
+	(see ``run_partitions``); the partial sums are merged here. Writes to the
+	raw tables and the rollups wait until it finishes (``write_lock``).
+	"""
+	Playback = get_playback_model()
+	play_dbs = sharding.shards() if Playback is not None and sharding.is_sharded(Playback) else [using]
+	tables = {db: [Playback] for db in play_dbs}
+	tables.setdefault(using, []).extend(
+		[get_album_sale_model(), get_rating_model(), LabelDailyRollup, LabelDailyRevenue],
+	)
+	with write_lock(tables):
+		return _rebuild_label_rollups(using, play_dbs, partitions, executor, progress)
+
+
+def _rebuild_label_rollups(using, play_dbs, partitions, executor, progress) -> int:
+	rows = {}
+	marks = {retention.watermark(using=db) for db in play_dbs}
+	if len(marks) > 1:
+		raise ValueError("Playback shards have different retention watermarks; compact them with the same --days")
+	wm = marks.pop()
+	if wm is not None:
+		# Las reproducciones compactadas ya no están en crudo: se conservan las del rollup
+		kept = LabelDailyRollup.objects.using(using).filter(day__lt=_day(wm), plays__gt=0)
+		for label, day, plays in kept.values_list("label_id", "day", "plays"):
+			rows[(label, day)] = {**dict.fromkeys(LABEL_FIELDS, 0), "plays": plays}
+	jobs = []
+	for source in LABEL_SOURCES:
+		model = _source_model(source)
+		if model is None:
+			continue
+		for db in (play_dbs if source == "playback" else [using]):
+			jobs += [(source, db, lo, hi, wm) for lo, hi in id_ranges(model.objects.using(db), partitions)]
+
+	revenue = {}
+	for part_rows, part_revenue, _ in run_partitions(label_partition, jobs, executor, progress):
+		for key, vals in part_rows.items():
+			cur = rows.setdefault(key, dict.fromkeys(LABEL_FIELDS, 0))
+			for name, n in vals.items():
+				cur[name] += n
+		for key, amount in part_revenue.items():
+			revenue[key] = revenue.get(key, 0) + amount
+
+	with transaction.atomic(using=using):
+		LabelDailyRollup.objects.using(using).all().delete()
+		LabelDailyRevenue.objects.using(using).all().delete()
+		LabelDailyRollup.objects.using(using).bulk_create(
+			[LabelDailyRollup(label_id=label, day=day, **vals) for (label, day), vals in rows.items()],
+			batch_size=1000,
+		)
+		LabelDailyRevenue.objects.using(using).bulk_create(
+			[
+				LabelDailyRevenue(label_id=label, day=day, currency=currency, amount=amount)
+				for (label, day, currency), amount in revenue.items()
+			],
+			batch_size=1000,
+		)
+	return len(rows) + len(revenue)
+
+
+def song_partition(db: str, lo=None, hi=None, wm=None):
+	"""``({(song_id, day): [plays, valid_plays, seconds]}, read)`` of the plays of ``db`` with ``lo <= id < hi``."""
+	raw = _id_range(get_playback_model().objects.using(db), lo, hi)
+	if wm is not None:
+		raw = raw.filter(played_at__gte=wm)
+	grouped = (
+		raw.annotate(day=TruncDate("played_at")).order_by()
+		.values("song_id", "day")
+		.annotate(plays=Count("id"), valid_plays=Count("id", filter=Q(valid=True)), seconds=Sum("seconds"))
+	)
+	rows, read = {}, 0
+	for r in grouped.iterator(chunk_size=2000):
+		rows[(r["song_id"], r["day"])] = [r["plays"], r["valid_plays"], r["seconds"] or 0]
+		read += r["plays"]
+	return rows, read
+
+
+def rebuild_song_rollups(using="default", partitions: int = 1, executor=None, progress=None) -> int:
+	"""Recompute ``SongDailyRollup`` from the raw plays still kept. Returns rows written."""
+	Playback = get_playback_model()
+	if Playback is None:
+		return 0
+	with write_lock({using: [Playback, SongDailyRollup]}):
+		return _rebuild_song_rollups(Playback, using, partitions, executor, progress)
+
+
+def _rebuild_song_rollups(Playback, using, partitions, executor, progress) -> int:
+	wm = retention.watermark(using=using)
+	existing = SongDailyRollup.objects.using(using)
+	if wm is not None:
+		existing = existing.filter(day__gte=_day(wm))
+	jobs = [(using, lo, hi, wm) for lo, hi in id_ranges(Playback.objects.using(using), partitions)]
+	totals = {}
+	for part, _ in run_partitions(song_partition, jobs, executor, progress):
+		for key, vals in part.items():
+			cur = totals.setdefault(key, [0, 0, 0])
+			for i, n in enumerate(vals):
+				cur[i] += n
+	objs = [
+		SongDailyRollup(song_id=song_id, day=day, plays=plays, valid_plays=valid_plays, seconds=seconds)
+		for (song_id, day), (plays, valid_plays, seconds) in totals.items()
+	]
+	with transaction.atomic(using=using):
+		existing.delete()
+		SongDailyRollup.objects.using(using).bulk_create(objs, batch_size=1000)
+	return len(objs)
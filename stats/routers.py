@@ -0,0 +1,110 @@
+"""Database routing for the ``stats`` app.
+
+Aggregate endpoints opt in to the read replica with :func:`replica_reads`.
+Everything else (and every write) keeps using ``default``. After a client
+writes, its reads are pinned to the primary for
+``STATS_REPLICA_STICKY_SECONDS`` so it always sees its own changes even if
+the replica has not been synced yet.
+
+The pin is kept in the ``STATS_REPLICA_PIN_CACHE`` cache (shared by every
+worker) under the user id, else the session key, else a random
+``stats_pin`` cookie that the write response sets.
+
+The replica lags behind the version stamps, so ``stats.versioning`` keys
+the validators and cached results of replica reads on the last
+``sync_replica`` copy too, and keeps primary reads apart.
+"""
+import secrets
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+PIN_PREFIX = "stats:replica-pin:"
+PIN_COOKIE = "stats_pin"
+
+_use_replica = ContextVar("stats_use_replica", default=False)
+
+
+def replica_alias():
+	alias = getattr(settings, "STATS_READ_REPLICA_ALIAS", None)
+	if alias and alias in settings.DATABASES:
+		return alias
+	return None
+
+
+def reading_replica() -> bool:
+	"""``True`` inside a ``replica_reads`` view whose reads go to the replica."""
+	return _use_replica.get()
+
+
+def pin_cache():
+	return caches[getattr(settings, "STATS_REPLICA_PIN_CACHE", "stats")]
+
+
+def _client_key(request):
+	user = getattr(request, "user", None)
+	if user is not None and user.is_authenticated:
+		return f"{PIN_PREFIX}user:{user.pk}"
+	session = getattr(request, "session", None)
+	if session is not None and session.session_key:
+		return f"{PIN_PREFIX}session:{session.session_key}"
+	token = request.COOKIES.get(PIN_COOKIE)
+	return f"{PIN_PREFIX}client:{token}" if token else None
+
+
+def pin_primary(request, response):
+	"""Send this client's reads to the primary for the stickiness window."""
+	seconds = int(getattr(settings, "STATS_REPLICA_STICKY_SECONDS", 5) or 0)
+	if seconds <= 0 or not replica_alias():
+		return
+	key = _client_key(request)
+	if key is None:
+		# Cliente anónimo sin sesión: se le identifica con una cookie propia
+		token = secrets.token_urlsafe(16)
+		response.set_cookie(PIN_COOKIE, token, max_age=seconds, httponly=True, samesite="Lax")
+		key = f"{PIN_PREFIX}client:{token}"
+	pin_cache().set(key, 1, seconds)
+
+
+def is_pinned(request) -> bool:
+	key = _client_key(request)
+	return key is not None and bool(pin_cache().get(key))
+
+
+def replica_reads(func):
+	"""Run the view's ORM reads on the replica unless the client is pinned."""
+	@wraps(func)
+	def wrapper(request, *args, **kwargs):
+		if request.method not in SAFE_METHODS or not replica_alias() or is_pinned(request):
+			return func(request, *args, **kwargs)
+		token = _use_replica.set(True)
+		try:
+			return func(request, *args, **kwargs)
+		finally:
+			_use_replica.reset(token)
+	return wrapper
+
+
+class ReadReplicaRouter:
+	def db_for_read(self, model, **hints):
+		if model._meta.app_label != "stats" or not _use_replica.get():
+			return None
+		return replica_alias()
+
+	def db_for_write(self, model, **hints):
+		return None
+
+	def allow_relation(self, obj1, obj2, **hints):
+		dbs = {"default", replica_alias()}
+		if obj1._state.db in dbs and obj2._state.db in dbs:
+			return True
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# La réplica es una copia del fichero principal: nunca se migra.
+		if db == replica_alias():
+			return False
+		return None
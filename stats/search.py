@@ -0,0 +1,186 @@
+"""Full-text search over ``Rating.comment``.
+
+- SQLite: ``stats_rating_fts`` is an FTS5 table over the rating table
+  (external content, so the text is not stored twice). Triggers on insert,
+  delete and comment update keep it in sync with every write path:
+  ``save()``, ``bulk_create``, ``update()`` and raw SQL. Results are ranked
+  by bm25.
+- PostgreSQL: a GIN index on ``to_tsvector('simple', comment)``; ranked by
+  ``ts_rank``. There is nothing to keep in sync.
+- Without either (an SQLite build without FTS5, other backends) ``search``
+  falls back to ``icontains`` filters ordered by date, with no score.
+
+``install`` creates the index. Migration 0010 runs it, and so does every
+``migrate``: when Django rebuilds a SQLite table to alter it, the table's
+triggers are dropped.
+
+Every word of the query must match; ``word*`` matches a prefix. Other
+characters are ignored, so user input cannot break the query syntax.
+"""
+import logging
+import re
+
+from django.db import DatabaseError, connections, router
+from django.db.migrations.recorder import MigrationRecorder
+
+from .utils import get_rating_model
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = "stats_rating_fts"
+PG_INDEX = "stats_rating_comment_fts"
+PG_CONFIG = "simple"
+MIGRATION = "0010_rating_search"
+_TERM = re.compile(r"(\w+)(\*?)")
+_available = {}
+
+
+def terms(q) -> list:
+	"""``[(word, prefix)]`` of a query string."""
+	return [(word.lower(), bool(star)) for word, star in _TERM.findall(q or "")]
+
+
+def _fts5_query(parts) -> str:
+	return " ".join(f'"{word}"' + ("*" if prefix else "") for word, prefix in parts)
+
+
+def _tsquery(parts) -> str:
+	return " & ".join(word + (":*" if prefix else "") for word, prefix in parts)
+
+
+def _sqlite_statements(table: str) -> list:
+	new = f"INSERT INTO {FTS_TABLE}(rowid, comment) VALUES (new.id, new.comment);"
+	old = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, comment) VALUES ('delete', old.id, old.comment);"
+	return [
+		f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {table} BEGIN {new} END",
+		f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {table} BEGIN {old} END",
+		f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF comment ON {table} BEGIN {old} {new} END",
+	]
+
+
+def install(connection) -> bool:
+	"""Create the search index on ``connection`` if it is missing; returns whether there is one."""
+	Rating = get_rating_model()
+	if Rating is None:
+		return False
+	table = Rating._meta.db_table
+	if table not in connection.introspection.table_names():
+		return False
+	_available.pop(connection.alias, None)
+	with connection.cursor() as cursor:
+		if connection.vendor == "postgresql":
+			cursor.execute(
+				f"CREATE INDEX IF NOT EXISTS {PG_INDEX} ON {table} USING GIN (to_tsvector('{PG_CONFIG}', comment))"
+			)
+			return True
+		if connection.vendor != "sqlite":
+			return False
+		try:
+			cursor.execute(
+				f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+				f"comment, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+			)
+		except DatabaseError:
+			logger.warning("SQLite without FTS5: rating search falls back to LIKE")
+			return False
+		cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE %s", [f"{FTS_TABLE}_a_"])
+		if cursor.fetchone()[0] == 3:
+			return True
+		for statement in _sqlite_statements(table):
+			cursor.execute(statement)
+		# Sin triggers el índice pudo quedar desfasado: se rehace desde la tabla
+		cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+	return True
+
+
+def uninstall(connection):
+	with connection.cursor() as cursor:
+		if connection.vendor == "postgresql":
+			cursor.execute(f"DROP INDEX IF EXISTS {PG_INDEX}")
+		elif connection.vendor == "sqlite":
+			for suffix in ("ai", "ad", "au"):
+				cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+			cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+	_available.pop(connection.alias, None)
+
+
+def install_after_migrate(sender, using="default", **kwargs):
+	connection = connections[using]
+	# Tras deshacer la migración 0010 no hay que volver a crearlo
+	if ("stats", MIGRATION) in MigrationRecorder(connection).applied_migrations():
+		install(connection)
+
+
+def available(using: str = "default") -> bool:
+	"""Whether ``using`` has an index to search (checked once per alias)."""
+	if using not in _available:
+		connection = connections[using]
+		if connection.vendor == "postgresql":
+			_available[using] = True
+		elif connection.vendor == "sqlite":
+			with connection.cursor() as cursor:
+				cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [FTS_TABLE])
+				_available[using] = cursor.fetchone() is not None
+		else:
+			_available[using] = False
+	return _available[using]
+
+
+def search(q: str, song_id=None, artist_id=None, limit: int = 20, offset: int = 0, using=None):
+	"""``(total, [(rating id, score)])`` of the ratings whose comment matches ``q``, best first.
+
+	``score`` is higher for better matches and ``None`` in the fallback.
+	"""
+	parts = terms(q)
+	if not parts:
+		return 0, []
+	Rating = get_rating_model()
+	using = using or router.db_for_read(Rating) or "default"
+	if not available(using):
+		qs = Rating.objects.using(using)
+		for word, _ in parts:
+			qs = qs.filter(comment__icontains=word)
+		if song_id:
+			qs = qs.filter(song_id=song_id)
+		if artist_id:
+			qs = qs.filter(artist_id=artist_id)
+		qs = qs.order_by("-rated_at", "-id")
+		return qs.count(), [(pk, None) for pk in qs.values_list("pk", flat=True)[offset:offset + limit]]
+
+	connection = connections[using]
+	table = Rating._meta.db_table
+	filters, params = [], []
+	if song_id:
+		filters.append("song_id = %s")
+		params.append(song_id)
+	if artist_id:
+		filters.append("artist_id = %s")
+		params.append(artist_id)
+	if connection.vendor == "sqlite":
+		query = _fts5_query(parts)
+		where = f"{FTS_TABLE} MATCH %s"
+		if filters:
+			# Los filtros van por los índices de la tabla de valoraciones
+			where += f" AND rowid IN (SELECT id FROM {table} WHERE {' AND '.join(filters)})"
+		count_sql = f"SELECT COUNT(*) FROM {FTS_TABLE} WHERE {where}"
+		count_params = [query, *params]
+		# ORDER BY rank (bm25, menor es mejor) lo resuelve FTS5 sin tocar la tabla de contenido
+		page_sql = f"SELECT rowid, -rank FROM {FTS_TABLE} WHERE {where} ORDER BY rank LIMIT %s OFFSET %s"
+		page_params = [query, *params, limit, offset]
+	else:
+		query = _tsquery(parts)
+		vector = f"to_tsvector('{PG_CONFIG}', comment)"
+		where = " AND ".join([f"{vector} @@ to_tsquery('{PG_CONFIG}', %s)"] + filters)
+		count_sql = f"SELECT COUNT(*) FROM {table} WHERE {where}"
+		count_params = [query, *params]
+		page_sql = (
+			f"SELECT id, ts_rank({vector}, to_tsquery('{PG_CONFIG}', %s)) AS score FROM {table} WHERE {where} "
+			"ORDER BY score DESC, id DESC LIMIT %s OFFSET %s"
+		)
+		page_params = [query, query, *params, limit, offset]
+	with connection.cursor() as cursor:
+		cursor.execute(count_sql, count_params)
+		total = cursor.fetchone()[0]
+		cursor.execute(page_sql, page_params)
+		hits = [(pk, round(float(score), 4)) for pk, score in cursor.fetchall()]
+	return total, hits
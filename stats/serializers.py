@@ -1,6 +1,10 @@
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 from django.contrib.auth import get_user_model
 from django.apps import apps
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
 
 # Use apps.get_model to avoid importing models directly (keeps migration
 # compatibility during the refactor).
@@ -14,6 +18,51 @@ class RatingSerializer(serializers.ModelSerializer):
 	class Meta:
 		model = apps.get_model('stats', 'Rating')
 		fields = [
-			'id', 'user_id', 'username', 'song_id', 'artist_id', 'stars', 'comment', 'rated_at'
+			'id', 'user_id', 'username', 'song_id', 'artist_id', 'stars', 'comment', 'rated_at',
+			'resolution_pending', 'label_id',
 		]
-		read_only_fields = ['id', 'user_id', 'username', 'rated_at', 'song_id']
+		read_only_fields = ['id', 'user_id', 'username', 'rated_at', 'song_id', 'resolution_pending']
+
+
+def rating_rows(qs):
+	"""``values()`` of ``qs`` with the columns ``RatingSerializer`` outputs."""
+	return qs.values(
+		'id', 'user_id', 'song_id', 'artist_id', 'stars', 'comment', 'rated_at',
+		'resolution_pending', 'label_id', username=F('user__username'),
+	)
+
+
+def serialize_rating_rows(rows) -> list:
+	"""Same output as ``RatingSerializer(many=True)`` for ``rating_rows`` rows.
+
+	Used by the list endpoint: building plain dicts skips the per-row field
+	machinery of ``ModelSerializer``.
+	"""
+	if api_settings.DATETIME_FORMAT.lower() != 'iso-8601':
+		fmt = serializers.DateTimeField().to_representation
+	else:
+		tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+		def fmt(value):
+			if not value:
+				return None
+			if tz is not None:
+				value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+			value = value.isoformat()
+			return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+	return [
+		{
+			'id': r['id'],
+			'user_id': r['user_id'],
+			'username': r['username'],
+			'song_id': r['song_id'],
+			'artist_id': r['artist_id'],
+			'stars': r['stars'],
+			'comment': r['comment'],
+			'rated_at': fmt(r['rated_at']),
+			'resolution_pending': r['resolution_pending'],
+			'label_id': r['label_id'],
+		}
+		for r in rows
+	]
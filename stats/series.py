@@ -0,0 +1,117 @@
+"""Time-series bucketing for plays and sales.
+
+Counts are grouped in SQL with one ``GROUP BY`` on the truncated timestamp.
+The sparse result is then laid on a dense NumPy bucket grid, so gap filling
+and running totals are array operations instead of per-bucket Python loops.
+"""
+from datetime import timezone as dt_timezone
+
+import numpy as np
+from django.db.models.functions import Trunc
+
+INTERVALS = ("hour", "day", "week", "month")
+MAX_BUCKETS = 5000
+
+# Paso de la rejilla en unidades datetime64; las semanas empiezan en lunes
+_STEP = {
+	"hour": np.timedelta64(1, "h"),
+	"day": np.timedelta64(1, "D"),
+	"week": np.timedelta64(7, "D"),
+	"month": np.timedelta64(1, "M"),
+}
+_UNIT = {"hour": "h", "day": "D", "week": "D", "month": "M"}
+
+
+class SeriesError(ValueError):
+	"""Invalid interval or a range with too many buckets."""
+
+
+def floor_bucket(values, interval):
+	"""Truncate ``datetime64`` values to the start of their bucket."""
+	values = np.asarray(values, dtype="datetime64[s]").astype(f"datetime64[{_UNIT[interval]}]")
+	if interval == "week":
+		# 1970-01-01 fue jueves: (días + 3) % 7 da 0 para los lunes
+		values = values - ((values.astype(np.int64) + 3) % 7).astype("timedelta64[D]")
+	return values
+
+
+def to_datetime64(dt):
+	if dt.tzinfo is not None:
+		dt = dt.astimezone(dt_timezone.utc).replace(tzinfo=None)
+	return np.datetime64(dt, "s")
+
+
+def grouped_rows(qs, ts_field, interval, group_by=(), **aggregates):
+	"""One ``GROUP BY`` on ``ts_field`` truncated to ``interval`` (plus ``group_by``)."""
+	if interval not in INTERVALS:
+		raise SeriesError(f"interval must be one of {', '.join(INTERVALS)}")
+	return list(
+		qs.order_by()
+		.annotate(bucket=Trunc(ts_field, interval, tzinfo=dt_timezone.utc))
+		.values("bucket", *group_by)
+		.annotate(**aggregates)
+		.order_by("bucket")
+	)
+
+
+def merge_rows(rows, interval, fields):
+	"""Sum rows that fall in the same bucket (e.g. raw rows plus daily rollups)."""
+	keys = bucket_keys(rows, interval)
+	merged = {}
+	for key, row in zip(keys.tolist(), rows):
+		cur = merged.setdefault(key, {"bucket": row["bucket"], **dict.fromkeys(fields, 0)})
+		for f in fields:
+			cur[f] += row[f] or 0
+	return [merged[k] for k in sorted(merged)]
+
+
+def bucket_keys(rows, interval):
+	if not rows:
+		return np.array([], dtype=f"datetime64[{_UNIT[interval]}]")
+	return floor_bucket([to_datetime64(r["bucket"]) for r in rows], interval)
+
+
+def make_grid(keys, interval, start=None, end=None, fill=True):
+	"""Every bucket between ``start`` and ``end`` (or the data's bounds) if ``fill``."""
+	if not fill:
+		return keys
+	lo = floor_bucket([to_datetime64(start)], interval)[0] if start else (keys[0] if len(keys) else None)
+	hi = floor_bucket([to_datetime64(end)], interval)[0] if end else (keys[-1] if len(keys) else None)
+	if lo is None or hi is None or hi < lo:
+		return keys[:0]
+	step = _STEP[interval]
+	if (hi - lo) // step + 1 > MAX_BUCKETS:
+		raise SeriesError(f"range spans more than {MAX_BUCKETS} buckets")
+	return np.arange(lo, hi + step, step)
+
+
+def place(grid, keys, values):
+	"""Scatter ``values`` (one per key) onto ``grid``; missing buckets are 0."""
+	out = np.zeros(len(grid), dtype=np.float64)
+	if len(grid) and len(keys):
+		pos = np.clip(np.searchsorted(grid, keys), 0, len(grid) - 1)
+		inside = grid[pos] == keys
+		np.add.at(out, pos[inside], np.asarray(values, dtype=np.float64)[inside])
+	return out
+
+
+def render(grid, columns, cumulative=False):
+	"""``(bucket_labels, {field: list})`` ready for the response."""
+	if cumulative:
+		columns = {f: np.cumsum(col) for f, col in columns.items()}
+	labels = np.datetime_as_string(grid.astype("datetime64[s]"), unit="s", timezone="UTC").tolist()
+	return labels, {f: _as_numbers(col) for f, col in columns.items()}
+
+
+def dense_series(rows, interval, fields, start=None, end=None, cumulative=False, fill=True):
+	"""Lay grouped ``rows`` on a bucket grid and render them."""
+	keys = bucket_keys(rows, interval)
+	grid = make_grid(keys, interval, start, end, fill)
+	columns = {f: place(grid, keys, [r[f] or 0 for r in rows]) for f in fields}
+	return render(grid, columns, cumulative)
+
+
+def _as_numbers(col):
+	if len(col) and np.all(np.mod(col, 1) == 0):
+		return col.astype(np.int64).tolist()
+	return np.round(col, 2).tolist()
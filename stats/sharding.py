@@ -0,0 +1,153 @@
+"""Optional hash sharding of ``Playback`` across several databases.
+
+With ``STATS_PLAYBACK_SHARDS`` set to a list of database aliases, every play
+is stored in the shard picked by a stable hash of its ``song_id``. So are
+the per-song data derived from it: ``SongDailyRollup`` and
+``ListenDurationSketch``. Each shard also keeps its own
+``RetentionWatermark``, and is compacted and archived on its own
+(``--database``). Label rollups, sales, ratings and everything else stay in
+``default``.
+
+``PlaybackShardRouter`` routes a sharded model by the ``song_id`` of the
+instance being saved. When there is no instance, it uses the shard selected
+with ``for_song`` / ``on``. Without a selected shard the query goes to
+``default``, which holds no plays in this mode. Per-song reads therefore run
+inside ``for_song(song_id)``. Reads over every song ``scatter`` one call
+per shard, in parallel threads, and merge the results.
+
+The shard of a song depends on the number of shards. Changing the list
+requires moving the rows (not automated). Primary keys are only unique
+within a shard.
+"""
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+SHARDED_MODELS = {"playback", "songdailyrollup", "listendurationsketch", "retentionwatermark"}
+
+_current = ContextVar("stats_playback_shard", default=None)
+
+
+def shards() -> list:
+	return list(getattr(settings, "STATS_PLAYBACK_SHARDS", None) or ())
+
+
+def enabled() -> bool:
+	return bool(shards())
+
+
+def shard_for(song_id) -> str | None:
+	"""Alias of the shard of ``song_id`` (``None`` when sharding is off)."""
+	aliases = shards()
+	if not aliases:
+		return None
+	digest = hashlib.blake2b(str(song_id).encode(), digest_size=8).digest()
+	return aliases[int.from_bytes(digest, "little") % len(aliases)]
+
+
+def current() -> str | None:
+	return _current.get()
+
+
+def alias(using=None) -> str:
+	"""``using`` if given, else the selected shard, else ``default``."""
+	return using or _current.get() or "default"
+
+
+def is_sharded(model) -> bool:
+	return enabled() and model._meta.app_label == "stats" and model._meta.model_name in SHARDED_MODELS
+
+
+def db_for(model, using=None) -> str:
+	"""Where a write to ``model`` goes from code running against ``using``:
+	non-sharded models always go to ``default`` when sharding is on."""
+	if enabled() and not is_sharded(model):
+		return "default"
+	return alias(using)
+
+
+@contextmanager
+def on(shard):
+	token = _current.set(shard)
+	try:
+		yield shard
+	finally:
+		_current.reset(token)
+
+
+def for_song(song_id):
+	"""Select the shard of ``song_id`` for the sharded queries in the block."""
+	return on(shard_for(song_id))
+
+
+def group_by_shard(song_ids) -> dict:
+	"""``{alias: [song ids]}``; a single ``None`` group when sharding is off."""
+	out = {}
+	for song_id in song_ids:
+		out.setdefault(shard_for(song_id), []).append(song_id)
+	return out
+
+
+def _call_on(shard, fn):
+	try:
+		with on(shard):
+			return fn()
+	finally:
+		# Cada hilo del pool abre sus propias conexiones
+		connections.close_all()
+
+
+def scatter(fn, aliases=None) -> list:
+	"""``[fn() on each shard]``; just ``[fn()]`` when sharding is off.
+
+	Shards are queried in parallel threads unless ``STATS_SHARD_PARALLEL``
+	is off.
+	"""
+	aliases = list(aliases) if aliases is not None else shards()
+	if not aliases:
+		return [fn()]
+	if len(aliases) == 1 or not getattr(settings, "STATS_SHARD_PARALLEL", True):
+		out = []
+		for shard in aliases:
+			with on(shard):
+				out.append(fn())
+		return out
+	with ThreadPoolExecutor(max_workers=len(aliases), thread_name_prefix="stats-shard") as pool:
+		return list(pool.map(lambda shard: _call_on(shard, fn), aliases))
+
+
+def merge_counts(dicts) -> dict:
+	out = {}
+	for counts in dicts:
+		for key, n in counts.items():
+			out[key] = out.get(key, 0) + n
+	return out
+
+
+class PlaybackShardRouter:
+	def _route(self, model, hints):
+		if not is_sharded(model):
+			return None
+		instance = hints.get("instance")
+		song_id = getattr(instance, "song_id", None) if instance is not None else None
+		if song_id:
+			return shard_for(song_id)
+		return _current.get()
+
+	def db_for_read(self, model, **hints):
+		return self._route(model, hints)
+
+	def db_for_write(self, model, **hints):
+		return self._route(model, hints)
+
+	def allow_relation(self, obj1, obj2, **hints):
+		return None
+
+	def allow_migrate(self, db, app_label, model_name=None, **hints):
+		# Los shards llevan el esquema completo: las migraciones de datos
+		# (RunPython) consultan Playback en cualquier base
+		return None
@@ -0,0 +1,85 @@
+"""Signal receivers wiring the write paths to the derived state of ``stats``."""
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from .analytics import invalidate_on_change
+from .live import broker, live_deltas
+from .rollups import _day, apply_contributions, contributions
+from .sketches import record_listen
+from .utils import get_album_sale_model, get_playback_model, get_rating_model
+from .versioning import bump, scopes_for
+
+
+def bump_stamps(sender, instance, using="default", **kwargs):
+	scopes = scopes_for(instance)
+	# Antes del commit, una lectura concurrente guardaría datos viejos bajo el sello nuevo
+	transaction.on_commit(lambda: bump(*scopes), using=using)
+
+
+def remember_previous(sender, instance, raw=False, using=None, **kwargs):
+	# En una actualización hay que restar lo que la fila aportaba antes
+	if raw or instance._state.adding or instance.pk is None:
+		return
+	old = sender._base_manager.using(using).filter(pk=instance.pk).first()
+	instance._stats_previous = contributions(old) if old is not None else None
+	instance._stats_previous_live = live_deltas(old) if old is not None else None
+
+
+def update_rollups_on_save(sender, instance, created, raw=False, using="default", **kwargs):
+	if raw:
+		return
+	previous = getattr(instance, "_stats_previous", None)
+	if previous:
+		apply_contributions(previous, sign=-1, using=using)
+		instance._stats_previous = None
+	apply_contributions(contributions(instance), using=using)
+
+
+def update_rollups_on_delete(sender, instance, using="default", **kwargs):
+	apply_contributions(contributions(instance), sign=-1, using=using)
+
+
+def record_listen_on_create(sender, instance, created, raw=False, using="default", **kwargs):
+	if raw or not created or not instance.seconds:
+		return
+	record_listen(instance.song_id, _day(instance.played_at), instance.seconds, using=using)
+
+
+def publish_live_on_save(sender, instance, created, raw=False, using="default", **kwargs):
+	if raw:
+		return
+	items = live_deltas(instance)
+	previous = getattr(instance, "_stats_previous_live", None)
+	instance._stats_previous_live = None
+
+	def send():
+		if previous:
+			broker.publish(previous, sign=-1)
+		broker.publish(items)
+
+	# Solo lo confirmado llega a los streams
+	transaction.on_commit(send, using=using)
+
+
+def publish_live_on_delete(sender, instance, using="default", **kwargs):
+	items = live_deltas(instance)
+	transaction.on_commit(lambda: broker.publish(items, sign=-1), using=using)
+
+
+def connect_signals():
+	for model in (get_playback_model(), get_album_sale_model(), get_rating_model()):
+		if model is None:
+			continue
+		label = model._meta.label
+		pre_save.connect(remember_previous, sender=model, dispatch_uid=f"stats_previous_{label}")
+		post_save.connect(update_rollups_on_save, sender=model, dispatch_uid=f"stats_rollups_save_{label}")
+		post_delete.connect(update_rollups_on_delete, sender=model, dispatch_uid=f"stats_rollups_delete_{label}")
+		post_save.connect(bump_stamps, sender=model, dispatch_uid=f"stats_stamps_save_{label}")
+		post_delete.connect(bump_stamps, sender=model, dispatch_uid=f"stats_stamps_delete_{label}")
+		post_save.connect(publish_live_on_save, sender=model, dispatch_uid=f"stats_live_save_{label}")
+		post_delete.connect(publish_live_on_delete, sender=model, dispatch_uid=f"stats_live_delete_{label}")
+		post_save.connect(invalidate_on_change, sender=model, dispatch_uid=f"stats_analytics_save_{label}")
+		post_delete.connect(invalidate_on_change, sender=model, dispatch_uid=f"stats_analytics_delete_{label}")
+	playback = get_playback_model()
+	if playback is not None:
+		post_save.connect(record_listen_on_create, sender=playback, dispatch_uid="stats_listen_sketch")
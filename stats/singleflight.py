@@ -0,0 +1,156 @@
+"""Single-flight coalescing of identical expensive reads.
+
+Concurrent requests for the same endpoint and parameters share one
+execution: the first one (the leader) runs the view, the others wait for
+it and get a copy of its result. The key covers the path, the sorted query
+string and the version stamps of the view's ``conditional`` scopes, so a
+request that arrives after a write never gets a result computed before it.
+
+Across workers, with ``STATS_SINGLEFLIGHT_CACHE`` set to a shared cache
+alias, the leader also takes a lock there and publishes its result for
+``STATS_SINGLEFLIGHT_RESULT_SECONDS``. A worker that finds the lock taken
+polls for that result and runs the view itself if it does not show up in
+time.
+"""
+import functools
+import hashlib
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+LOCK_PREFIX = "stats:flight:lock:"
+RESULT_PREFIX = "stats:flight:result:"
+
+
+class _Call:
+	def __init__(self):
+		self.done = threading.Event()
+		self.result = None
+		self.error = None
+		self.waiters = 0
+
+
+class Group:
+	"""Per-key coalescing of calls within this process."""
+
+	def __init__(self):
+		self._lock = threading.Lock()
+		self._calls = {}
+		self.counters = {"executions": 0, "shared": 0, "remote": 0, "timeouts": 0}
+
+	def do(self, key: str, fn, timeout: float | None = None):
+		"""Run ``fn()`` once for all concurrent callers of ``key``."""
+		with self._lock:
+			call = self._calls.get(key)
+			if call is None:
+				call = self._calls[key] = _Call()
+				leader = True
+			else:
+				call.waiters += 1
+				leader = False
+		if not leader:
+			if call.done.wait(timeout):
+				with self._lock:
+					self.counters["shared"] += 1
+				if call.error is not None:
+					raise call.error
+				return call.result
+			# El líder tarda demasiado: se calcula aparte
+			with self._lock:
+				self.counters["timeouts"] += 1
+			return fn()
+		try:
+			call.result = fn()
+		except Exception as exc:
+			call.error = exc
+			raise
+		finally:
+			with self._lock:
+				self.counters["executions"] += 1
+				del self._calls[key]
+			call.done.set()
+		return call.result
+
+	def snapshot(self) -> dict:
+		with self._lock:
+			return {**self.counters, "in_flight": len(self._calls)}
+
+
+group = Group()
+
+
+def _shared_cache():
+	alias = getattr(settings, "STATS_SINGLEFLIGHT_CACHE", None)
+	return caches[alias] if alias else None
+
+
+def request_key(request) -> str:
+	params = sorted((k, v) for k, values in request.GET.lists() for v in values)
+	stamps = [token for token, _ in getattr(request, "_stats_stamps", None) or ()]
+	raw = "|".join([request.method, request.path, repr(params)] + stamps)
+	return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+def _from_peers(cache, key: str, wait: float):
+	"""Result published by the worker holding the lock of ``key``, or ``None``."""
+	deadline = time.monotonic() + wait
+	delay = 0.01
+	while True:
+		found = cache.get(RESULT_PREFIX + key)
+		if found is not None:
+			return found
+		if cache.get(LOCK_PREFIX + key) is None or time.monotonic() >= deadline:
+			return cache.get(RESULT_PREFIX + key)
+		time.sleep(delay)
+		delay = min(delay * 2, 0.2)
+
+
+def _run(view, request, args, kwargs, key: str):
+	"""``(data, status, no_store)`` of the view, going through the shared cache if configured."""
+	def compute():
+		response = view(request, *args, **kwargs)
+		return response.data, response.status_code, "no-store" in response.get("Cache-Control", "")
+
+	cache = _shared_cache()
+	if cache is None:
+		return compute()
+	wait = getattr(settings, "STATS_SINGLEFLIGHT_WAIT_SECONDS", 10)
+	found = cache.get(RESULT_PREFIX + key)
+	if found is None and not cache.add(LOCK_PREFIX + key, 1, timeout=wait):
+		found = _from_peers(cache, key, wait)
+	if found is not None:
+		with group._lock:
+			group.counters["remote"] += 1
+		return (*found, False)
+	try:
+		data, status, no_store = compute()
+		if 200 <= status < 300 and not no_store:
+			cache.set(RESULT_PREFIX + key, (data, status), getattr(settings, "STATS_SINGLEFLIGHT_RESULT_SECONDS", 2))
+		return data, status, no_store
+	finally:
+		cache.delete(LOCK_PREFIX + key)
+
+
+def single_flight(view):
+	"""Coalesce concurrent identical requests to a DRF function view.
+
+	Goes below ``conditional`` so the key includes the version stamps. Each
+	caller gets its own ``Response`` built from the shared data, keeping a
+	``Cache-Control: no-store``; such results are not published to peers.
+	"""
+	@functools.wraps(view)
+	def wrapper(request, *args, **kwargs):
+		if request.method != "GET":
+			return view(request, *args, **kwargs)
+		key = request_key(request)
+		timeout = getattr(settings, "STATS_SINGLEFLIGHT_WAIT_SECONDS", 10)
+		data, status, no_store = group.do(key, lambda: _run(view, request, args, kwargs, key), timeout=timeout)
+		response = Response(data, status=status)
+		if no_store:
+			response["Cache-Control"] = "no-store"
+		return response
+
+	return wrapper
@@ -0,0 +1,245 @@
+"""Mergeable quantile sketches for listen durations.
+
+``TDigest`` is a merging t-digest (Dunning & Ertl) with the ``k1`` scale
+function: at most about ``compression`` centroids whatever the number of
+values, accurate at the tails and mergeable, so a digest per (song, day)
+can be combined into any date range on read. ``ListenDurationSketch`` rows
+store one serialized digest each; ``record_listen`` folds a play into the
+row of its day.
+
+Digests only grow: deleting a ``Playback`` does not remove its duration.
+``manage.py rebuild_rollups`` recomputes the sketches of the days still kept
+raw (see ``stats.retention``).
+"""
+import math
+import struct
+from array import array
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from . import retention, sharding
+from .models import ListenDurationSketch
+from .rollups import _day, _id_range, id_ranges, run_partitions, write_lock
+from .utils import get_playback_model
+
+DEFAULT_COMPRESSION = 100
+_HEADER = struct.Struct("<Hddd")  # compression, count, min, max
+
+
+class TDigest:
+	def __init__(self, compression: int = DEFAULT_COMPRESSION):
+		self.compression = compression
+		self.means = []
+		self.weights = []
+		self.count = 0.0
+		self.min = math.inf
+		self.max = -math.inf
+		self._buffer = []
+
+	def add(self, value: float, weight: float = 1.0):
+		value = float(value)
+		self._buffer.append((value, weight))
+		self.count += weight
+		self.min = min(self.min, value)
+		self.max = max(self.max, value)
+		if len(self._buffer) >= 5 * self.compression:
+			self._compress()
+
+	def merge(self, other: "TDigest"):
+		other._compress()
+		self._buffer.extend(zip(other.means, other.weights))
+		self.count += other.count
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		self._compress()
+		return self
+
+	def _k(self, q: float) -> float:
+		return self.compression / (2 * math.pi) * math.asin(2 * min(max(q, 0.0), 1.0) - 1)
+
+	def _compress(self):
+		if not self._buffer:
+			return
+		items = sorted(list(zip(self.means, self.weights)) + self._buffer)
+		self._buffer = []
+		total = sum(w for _, w in items)
+		means, weights = [], []
+		cur_mean, cur_weight = items[0]
+		before = 0.0
+		for mean, weight in items[1:]:
+			# Un centroide puede crecer mientras abarque como mucho 1 unidad de k
+			if self._k((before + cur_weight + weight) / total) - self._k(before / total) <= 1:
+				cur_weight += weight
+				cur_mean += (mean - cur_mean) * weight / cur_weight
+			else:
+				means.append(cur_mean)
+				weights.append(cur_weight)
+				before += cur_weight
+				cur_mean, cur_weight = mean, weight
+		means.append(cur_mean)
+		weights.append(cur_weight)
+		self.means, self.weights = means, weights
+
+	def __len__(self):
+		self._compress()
+		return len(self.means)
+
+	def quantile(self, q: float):
+		"""Estimated value at quantile ``q`` (0..1), ``None`` when empty."""
+		self._compress()
+		if not self.means:
+			return None
+		if len(self.means) == 1:
+			return self.means[0]
+		target = min(max(q, 0.0), 1.0) * self.count
+		prev_mean, prev_center = self.min, 0.0
+		cumulative = 0.0
+		for mean, weight in zip(self.means, self.weights):
+			center = cumulative + weight / 2
+			if target < center:
+				span = center - prev_center
+				value = prev_mean + (mean - prev_mean) * ((target - prev_center) / span if span else 0)
+				return min(max(value, self.min), self.max)
+			prev_mean, prev_center = mean, center
+			cumulative += weight
+		span = self.count - prev_center
+		value = prev_mean + (self.max - prev_mean) * ((target - prev_center) / span if span else 1)
+		return min(max(value, self.min), self.max)
+
+	def mean(self):
+		self._compress()
+		if not self.count:
+			return None
+		return sum(m * w for m, w in zip(self.means, self.weights)) / self.count
+
+	def to_bytes(self) -> bytes:
+		self._compress()
+		pairs = array("d")
+		for mean, weight in zip(self.means, self.weights):
+			pairs.append(mean)
+			pairs.append(weight)
+		return _HEADER.pack(self.compression, self.count, self.min, self.max) + pairs.tobytes()
+
+	@classmethod
+	def from_bytes(cls, data: bytes) -> "TDigest":
+		compression, count, lo, hi = _HEADER.unpack_from(data)
+		digest = cls(compression)
+		pairs = array("d")
+		pairs.frombytes(bytes(data[_HEADER.size:]))
+		digest.means = list(pairs[0::2])
+		digest.weights = list(pairs[1::2])
+		digest.count, digest.min, digest.max = count, lo, hi
+		return digest
+
+
+def record_listen(song_id: str, day, seconds: float, using: str = "default", retries: int = 3):
+	"""Add one listen of ``seconds`` to the digest of ``song_id`` on ``day``.
+
+	Optimistic concurrency: the row is rewritten only if its ``version`` did
+	not change since it was read, otherwise the read is retried. After
+	``retries`` lost races (a hot song) the row is locked and merged, so the
+	listen is never dropped.
+	"""
+	manager = ListenDurationSketch.objects.using(using)
+	for _ in range(retries):
+		row = manager.filter(song_id=song_id, day=day).values("version", "digest").first()
+		if row is None:
+			digest = TDigest()
+			digest.add(seconds)
+			try:
+				with transaction.atomic(using=using):
+					manager.create(song_id=song_id, day=day, count=1, digest=digest.to_bytes())
+				return
+			except IntegrityError:
+				continue
+		digest = TDigest.from_bytes(row["digest"])
+		digest.add(seconds)
+		updated = manager.filter(song_id=song_id, day=day, version=row["version"]).update(
+			digest=digest.to_bytes(), count=F("count") + 1, version=F("version") + 1,
+		)
+		if updated:
+			return
+	_record_listen_locked(manager, song_id, day, seconds, using)
+
+
+def _record_listen_locked(manager, song_id, day, seconds, using):
+	with transaction.atomic(using=using):
+		# Escribir primero toma el lock de la fila (o de la base en SQLite):
+		# nadie más la cambia hasta el commit
+		manager.filter(song_id=song_id, day=day).update(version=F("version") + 1)
+		row = manager.filter(song_id=song_id, day=day).values("digest").first()
+		digest = TDigest.from_bytes(row["digest"]) if row else TDigest()
+		digest.add(seconds)
+		if row is None:
+			manager.create(song_id=song_id, day=day, count=1, digest=digest.to_bytes())
+		else:
+			manager.filter(song_id=song_id, day=day).update(digest=digest.to_bytes(), count=F("count") + 1)
+
+
+def merged_digest(song_ids, start=None, end=None, using: str | None = None) -> TDigest:
+	"""One digest with every listen of ``song_ids`` between ``start`` and ``end`` (days, inclusive).
+
+	Without ``using`` each song is read from its playback shard.
+	"""
+	groups = {using: list(song_ids)} if using else sharding.group_by_shard(song_ids)
+	out = TDigest()
+	for db, ids in groups.items():
+		qs = ListenDurationSketch.objects.using(db or "default").filter(song_id__in=ids)
+		if start:
+			qs = qs.filter(day__gte=start)
+		if end:
+			qs = qs.filter(day__lte=end)
+		for blob in qs.values_list("digest", flat=True).iterator():
+			out.merge(TDigest.from_bytes(blob))
+	return out
+
+
+def sketch_partition(db: str, lo=None, hi=None, wm=None):
+	"""``({(song_id, day): serialized digest}, read)`` of the plays of ``db`` with ``lo <= id < hi``."""
+	raw = _id_range(get_playback_model().objects.using(db), lo, hi).filter(seconds__gt=0)
+	if wm is not None:
+		raw = raw.filter(played_at__gte=wm)
+	digests, read = {}, 0
+	for song_id, played_at, seconds in raw.values_list("song_id", "played_at", "seconds").iterator(chunk_size=5000):
+		digests.setdefault((song_id, _day(played_at)), TDigest()).add(seconds)
+		read += 1
+	return {key: d.to_bytes() for key, d in digests.items()}, read
+
+
+def rebuild_listen_sketches(using: str = "default", partitions: int = 1, executor=None, progress=None) -> int:
+	"""Recompute every sketch from ``Playback.seconds``; returns the number of rows.
+
+	Plays wait until it finishes (see ``stats.rollups.write_lock``).
+	"""
+	Playback = get_playback_model()
+	with write_lock({using: [Playback, ListenDurationSketch]}):
+		return _rebuild_listen_sketches(Playback, using, partitions, executor, progress)
+
+
+def _rebuild_listen_sketches(Playback, using, partitions, executor, progress) -> int:
+	existing = ListenDurationSketch.objects.using(using).all()
+	wm = retention.watermark(using=using)
+	if wm is not None:
+		# Los días compactados ya no tienen filas crudas: sus sketches se conservan
+		existing = existing.filter(day__gte=_day(wm))
+	jobs = [(using, lo, hi, wm) for lo, hi in id_ranges(Playback.objects.using(using), partitions)]
+	digests = {}
+	for part, _ in run_partitions(sketch_partition, jobs, executor, progress):
+		for key, data in part.items():
+			# Los t-digests se combinan sin perder precisión en las colas
+			digest = TDigest.from_bytes(data)
+			if key in digests:
+				digests[key].merge(digest)
+			else:
+				digests[key] = digest
+	with transaction.atomic(using=using):
+		existing.delete()
+		ListenDurationSketch.objects.using(using).bulk_create(
+			[
+				ListenDurationSketch(song_id=song_id, day=day, count=int(d.count), digest=d.to_bytes())
+				for (song_id, day), d in digests.items()
+			],
+			batch_size=1000,
+		)
+	return len(digests)
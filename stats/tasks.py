@@ -0,0 +1,343 @@
+"""Database-backed background tasks.
+
+Request handlers ``enqueue`` a task type by name with a JSON payload and
+return. ``manage.py stats_worker`` claims due tasks and runs them in a
+process pool. Rules:
+
+- deduplication: at most one *queued* task per ``(kind, key)``; enqueueing
+  again while one waits is a no-op. A task that is already running does
+  not block a new one, so work that arrives during a run is not lost;
+- concurrency: a type runs at most ``concurrency`` tasks at once, counting
+  every worker's unexpired leases (checked when claiming, so two workers
+  may race past the limit by one);
+- retries: a failed run goes back to the queue after
+  ``STATS_TASK_RETRY_BASE_SECONDS * 2 ** (attempts - 1)`` seconds (capped,
+  with jitter) until ``max_attempts``; then it stays ``failed``;
+- leases: a claimed task is owned for ``timeout`` seconds. If its worker
+  dies the task is queued again when the lease expires.
+
+Hot paths (play ingestion) use ``enqueue_once``: a process that queued a
+``(kind, key)`` recently, or finds one already queued, does not try the
+INSERT again.
+
+With ``STATS_TASKS_ENABLED`` off (the default) the views keep doing this
+work inline or in the resolver thread, so no worker is required.
+"""
+import logging
+import random
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+
+from . import sharding
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TaskType:
+	name: str
+	fn: object
+	concurrency: int = 1
+	max_attempts: int = 5
+	timeout: int = 300
+
+
+REGISTRY = {}
+
+
+def register(name: str, concurrency: int = 1, max_attempts: int = 5, timeout: int = 300):
+	"""Register the decorated function as task type ``name``.
+
+	``STATS_TASK_CONCURRENCY`` (``{name: n}``) overrides ``concurrency``.
+	"""
+	def decorator(fn):
+		REGISTRY[name] = TaskType(name, fn, concurrency, max_attempts, timeout)
+		return fn
+
+	return decorator
+
+
+def enabled() -> bool:
+	return bool(getattr(settings, "STATS_TASKS_ENABLED", False))
+
+
+def concurrency_of(task_type: TaskType) -> int:
+	return int(getattr(settings, "STATS_TASK_CONCURRENCY", {}).get(task_type.name, task_type.concurrency))
+
+
+def enqueue(kind: str, key: str = "", delay: float = 0, **payload):
+	"""Queue a ``kind`` task; returns it, or ``None`` if one with ``key`` is already queued."""
+	if kind not in REGISTRY:
+		raise KeyError(f"Unknown task type: {kind}")
+	try:
+		with transaction.atomic():
+			return Task.objects.create(
+				kind=kind, key=key, payload=payload, run_after=timezone.now() + timedelta(seconds=delay),
+			)
+	except IntegrityError:
+		return None
+
+
+_recent = {}
+_recent_lock = threading.Lock()
+
+
+def enqueue_once(kind: str, key: str, **payload):
+	"""``enqueue`` for request hot paths; skips the write when this process
+	queued ``(kind, key)`` in the last ``STATS_TASK_ENQUEUE_DEDUP_SECONDS`` or
+	one is already queued."""
+	now = time.monotonic()
+	with _recent_lock:
+		if _recent.get((kind, key), 0) > now:
+			return None
+		if len(_recent) >= 10_000:
+			for k in [k for k, until in _recent.items() if until <= now]:
+				del _recent[k]
+		_recent[(kind, key)] = now + getattr(settings, "STATS_TASK_ENQUEUE_DEDUP_SECONDS", 60)
+	if Task.objects.filter(kind=kind, key=key, status=Task.QUEUED).exists():
+		return None
+	return enqueue(kind, key=key, **payload)
+
+
+def forget_enqueued():
+	with _recent_lock:
+		_recent.clear()
+
+
+def retry_delay(attempts: int) -> float:
+	base = getattr(settings, "STATS_TASK_RETRY_BASE_SECONDS", 5)
+	cap = getattr(settings, "STATS_TASK_RETRY_MAX_SECONDS", 600)
+	return min(base * 2 ** max(attempts - 1, 0), cap) * (0.5 + random.random())
+
+
+def requeue_expired() -> int:
+	"""Give back the tasks whose worker lease ran out."""
+	return Task.objects.filter(status=Task.RUNNING, locked_until__lt=timezone.now()).update(
+		status=Task.QUEUED, locked_by="", locked_until=None,
+	)
+
+
+def claim(worker_id: str, running=None, limit: int = 10, kinds=None) -> list:
+	"""Claim up to ``limit`` due tasks for ``worker_id``.
+
+	``running`` maps each type to the tasks this worker already runs, so the
+	per-type limit also holds between two polls.
+	"""
+	now = timezone.now()
+	running = dict(running or {})
+	active = dict(
+		Task.objects.filter(status=Task.RUNNING, locked_until__gte=now)
+		.values_list("kind").annotate(n=Count("id")).order_by()
+	)
+	due = Task.objects.filter(status=Task.QUEUED, run_after__lte=now, kind__in=list(kinds or REGISTRY))
+	claimed = []
+	for task in due.order_by("run_after", "id")[:limit * 5]:
+		task_type = REGISTRY.get(task.kind)
+		if task_type is None:
+			continue
+		if max(active.get(task.kind, 0), running.get(task.kind, 0)) >= concurrency_of(task_type):
+			continue
+		lease = now + timedelta(seconds=task_type.timeout)
+		# UPDATE condicional: si otro worker la tomó antes, no se actualiza ninguna fila
+		taken = Task.objects.filter(pk=task.pk, status=Task.QUEUED).update(
+			status=Task.RUNNING, locked_by=worker_id, locked_until=lease, attempts=F("attempts") + 1,
+		)
+		if not taken:
+			continue
+		active[task.kind] = active.get(task.kind, 0) + 1
+		running[task.kind] = running.get(task.kind, 0) + 1
+		claimed.append(task)
+		if len(claimed) >= limit:
+			break
+	return claimed
+
+
+def run_task(task_id: int) -> str:
+	"""Run a claimed task and record the outcome; returns the new status."""
+	task = Task.objects.get(pk=task_id)
+	task_type = REGISTRY[task.kind]
+	try:
+		task_type.fn(**task.payload)
+	except Exception:  # noqa: BLE001 - se registra y se reintenta
+		error = traceback.format_exc(limit=5)
+		logger.warning("Task %s #%s failed (attempt %s)", task.kind, task.pk, task.attempts)
+		if task.attempts >= task_type.max_attempts:
+			status, run_after = Task.FAILED, task.run_after
+		else:
+			status, run_after = Task.QUEUED, timezone.now() + timedelta(seconds=retry_delay(task.attempts))
+		_finish(task, status, last_error=error, run_after=run_after)
+		return status
+	_finish(task, Task.DONE, finished_at=timezone.now())
+	return Task.DONE
+
+
+def _finish(task, status, **fields):
+	fields.update(status=status, locked_by="", locked_until=None)
+	if status == Task.QUEUED:
+		try:
+			with transaction.atomic():
+				Task.objects.filter(pk=task.pk).update(**fields)
+			return
+		except IntegrityError:
+			# Ya hay otra igual en cola: la reintentará ella
+			status = Task.DONE
+			fields.update(status=status, finished_at=timezone.now())
+	Task.objects.filter(pk=task.pk).update(**fields)
+
+
+def purge_done(older_than: float) -> int:
+	cutoff = timezone.now() - timedelta(seconds=older_than)
+	return Task.objects.filter(status=Task.DONE, finished_at__lt=cutoff).delete()[0]
+
+
+def snapshot() -> dict:
+	out = {}
+	for kind, status, n in Task.objects.values_list("kind", "status").annotate(n=Count("id")).order_by():
+		out.setdefault(kind, {})[status] = n
+	return out
+
+
+# --- Tareas de `stats` ---
+
+ARTIST_META_PREFIX = "stats:artist-meta:"
+ARTIST_META_TTL = 24 * 3600
+# Temas que contenidos no supo resolver: (fallos, no antes de)
+ARTIST_MISS_PREFIX = "stats:rating-artist-miss:"
+ARTIST_MISS_BACKOFF = 600
+ARTIST_MISS_MAX_BACKOFF = 24 * 3600
+ARTIST_MISS_TTL = 7 * 24 * 3600
+
+
+def artist_meta_cache():
+	return caches[getattr(settings, "STATS_STAMP_CACHE", "default")]
+
+
+@register("resolve_song_ids", concurrency=1, max_attempts=10)
+def resolve_song_ids():
+	"""Resolve the pending rating song ids; ids left pending by a content
+	service outage fail the run and the queue retries it with backoff."""
+	from .resolution import resolve_all_pending
+
+	resolve_all_pending()
+
+
+@register("playback_label", concurrency=4, max_attempts=10)
+def playback_label(song_id: str):
+	"""Look up the label of ``song_id`` and set it on its plays without one.
+
+	While the content service is unavailable ``content.Unavailable`` fails
+	the run and the queue retries it with backoff.
+	"""
+	from .utils import get_playback_model
+	from .views import _fetch_label
+
+	label = _fetch_label(song_id)
+	if not label:
+		return
+	Playback = get_playback_model()
+	# save() y no update(): las señales mueven los rollups por discográfica
+	with sharding.for_song(song_id):
+		unlabeled = Playback.objects.filter(song_id=song_id).filter(Q(label_id__isnull=True) | Q(label_id=""))
+		for play in unlabeled.iterator():
+			play.label_id = label
+			play.save(update_fields=["label_id"])
+
+
+@register("rating_artists", concurrency=1, max_attempts=10)
+def rating_artists(batch_size: int = 200, after: str = "", retry_at: float = 0):
+	"""Resolve song -> artist for ratings without ``artist_id`` and store it.
+
+	Each run takes the next ``batch_size`` distinct song ids after ``after``
+	and queues the run for the following batch, so songs that fail never
+	block the rest of the table. A song the content service cannot resolve
+	is skipped for ``ARTIST_MISS_BACKOFF`` seconds, doubled on each miss;
+	when the walk ends, a new one is queued for the first song whose wait
+	is over (``retry_at``).
+	"""
+	from . import analytics, content
+	from .utils import get_rating_model
+	from .versioning import bump
+	from .views import resolve_song_artists
+
+	Rating = get_rating_model()
+	song_ids = [
+		str(s) for s in Rating.objects.filter(artist_id__isnull=True, song_id__gt=after).order_by("song_id")
+		.values_list("song_id", flat=True).distinct()[:batch_size]
+	]
+	misses = artist_meta_cache().get_many([ARTIST_MISS_PREFIX + s for s in song_ids])
+	misses = {k[len(ARTIST_MISS_PREFIX):]: v for k, v in misses.items()}
+	now = time.time()
+	due = [s for s in song_ids if misses.get(s, (0, 0))[1] <= now]
+	if due:
+		# Con el circuito abierto todo serían fallos: que la cola lo reintente
+		if not content.available():
+			raise content.Unavailable("content circuit is open")
+		resolved = resolve_song_artists(due)
+		failed = {}
+		for song_id in due:
+			artist_id = resolved.get(song_id)
+			if not artist_id:
+				failures = misses.get(song_id, (0, 0))[0] + 1
+				misses[song_id] = failed[ARTIST_MISS_PREFIX + song_id] = (failures, now + _miss_delay(failures))
+				continue
+			misses.pop(song_id, None)
+			n = Rating.objects.filter(song_id=song_id, artist_id__isnull=True).update(artist_id=artist_id)
+			if n:
+				# .update() no emite señales
+				bump("rating", f"rating:song_id:{song_id}", f"rating:artist_id:{artist_id}")
+				analytics.ratings.invalidate()
+		artist_meta_cache().set_many(failed, ARTIST_MISS_TTL)
+		artist_meta_cache().delete_many([ARTIST_MISS_PREFIX + s for s in due if s not in misses])
+	retry_at = min([t for t in (retry_at, *(r for _, r in misses.values())) if t], default=0)
+	if len(song_ids) == batch_size:
+		enqueue("rating_artists", key="pending", batch_size=batch_size, after=song_ids[-1], retry_at=retry_at)
+	elif retry_at:
+		enqueue("rating_artists", key="retry", delay=max(retry_at - now, 0), batch_size=batch_size)
+
+
+def _miss_delay(failures: int) -> float:
+	return min(ARTIST_MISS_BACKOFF * 2 ** (failures - 1), ARTIST_MISS_MAX_BACKOFF)
+
+
+@register("artist_meta", concurrency=2)
+def artist_meta(ids: list):
+	"""Fetch artist metadata into the shared cache read by ``?enrich=1``."""
+	from .versioning import bump
+	from .views import _fetch_artists_meta_by_ids
+
+	meta = _fetch_artists_meta_by_ids(",".join(ids))
+	if not meta:
+		raise RuntimeError("content service returned no artist metadata")
+	artist_meta_cache().set_many({ARTIST_META_PREFIX + k: v for k, v in meta.items()}, ARTIST_META_TTL)
+	# Las respuestas enriquecidas dependen de este sello
+	bump("artistmeta")
+
+
+@register("rebuild_rollups", concurrency=1, max_attempts=1, timeout=3600)
+def rebuild_rollups():
+	from django.core.management import call_command
+
+	call_command("rebuild_rollups")
+
+
+def cached_artist_meta(ids) -> dict:
+	found = artist_meta_cache().get_many([ARTIST_META_PREFIX + str(i) for i in ids])
+	return {k[len(ARTIST_META_PREFIX):]: v for k, v in found.items()}
+
+
+def cached_label(song_id: str):
+	"""``(known, label)`` from the label cache, without calling the content service."""
+	from .views import LABEL_CACHE_PREFIX
+
+	label = cache.get(LABEL_CACHE_PREFIX + str(song_id))
+	return label is not None, label or None
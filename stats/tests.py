@@ -1,4 +1,4 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
@@ -21,3 +21,1607 @@ class ArtistsRatingsTest(TestCase):
 		# find our artist
 		found = [i for i in items if i.get("artist_id") == "artist-test"]
 		self.assertTrue(found)
+
+	def test_reads_stored_artist_ids_when_tasks_resolve_them(self):
+		from unittest import mock
+		from django.test import override_settings
+		from .models import Rating
+
+		user = get_user_model().objects.create(username="tasks_label_user", is_superuser=True)
+		Rating.objects.create(user=user, song_id="s1", artist_id="a1", stars=4)
+		Rating.objects.create(user=user, song_id="s2", stars=2)
+		self.client.force_login(user)
+		with override_settings(STATS_TASKS_ENABLED=True), mock.patch("stats.content.get_json") as get_json:
+			data = self.client.get("/api/v1/stats/artists/ratings").json()
+		get_json.assert_not_called()
+		self.assertEqual([(i["artist_id"], i["ratings_count"]) for i in data["items"]], [("a1", 1)])
+
+
+class SqlitePragmasTest(TestCase):
+	def test_pragmas_applied_on_connect(self):
+		from django.db import connection
+
+		if connection.vendor != "sqlite":
+			self.skipTest("SQLite only")
+		with connection.cursor() as cursor:
+			cursor.execute("PRAGMA synchronous")
+			# 1 == NORMAL
+			self.assertEqual(cursor.fetchone()[0], 1)
+			cursor.execute("PRAGMA busy_timeout")
+			self.assertEqual(cursor.fetchone()[0], 5000)
+
+
+class ReadReplicaRouterTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache, caches
+
+		cache.clear()
+		caches["stats"].clear()
+
+	def test_reads_stay_on_primary_without_replica(self):
+		from .models import Rating
+		from .routers import ReadReplicaRouter, _use_replica
+
+		token = _use_replica.set(True)
+		try:
+			self.assertIsNone(ReadReplicaRouter().db_for_read(Rating))
+		finally:
+			_use_replica.reset(token)
+
+	def test_aggregate_reads_use_replica_until_client_writes(self):
+		from django.test import override_settings
+		from django.test.client import RequestFactory
+		from .models import Rating
+		from .routers import ReadReplicaRouter, replica_reads
+
+		router = ReadReplicaRouter()
+		seen = []
+
+		@replica_reads
+		def view(request):
+			seen.append(router.db_for_read(Rating))
+
+		request = RequestFactory().get("/api/v1/stats/global")
+		# `default` hace de réplica: solo interesa la decisión del router
+		with override_settings(STATS_READ_REPLICA_ALIAS="default"):
+			view(request)
+			self.assertIsNone(router.db_for_read(Rating))
+			resp = self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1"})
+			self.assertEqual(resp.status_code, 201)
+			# Otro cliente detrás de la misma IP sigue leyendo de la réplica
+			view(request)
+			request.COOKIES["stats_pin"] = resp.cookies["stats_pin"].value
+			view(request)
+		self.assertEqual(seen, ["default", "default", None])
+
+	def test_pin_is_keyed_by_user(self):
+		from django.http import HttpResponse
+		from django.test import override_settings
+		from django.test.client import RequestFactory
+		from .routers import is_pinned, pin_primary
+
+		alice = get_user_model().objects.create(username="pin-alice")
+		bob = get_user_model().objects.create(username="pin-bob")
+		factory = RequestFactory()
+		with override_settings(STATS_READ_REPLICA_ALIAS="default"):
+			write = factory.post("/x", HTTP_X_FORWARDED_FOR="10.0.0.1")
+			write.user = alice
+			response = HttpResponse()
+			pin_primary(write, response)
+			self.assertNotIn("stats_pin", response.cookies)
+			read = factory.get("/x", HTTP_X_FORWARDED_FOR="10.0.0.1")
+			read.user = bob
+			self.assertFalse(is_pinned(read))
+			read.user = alice
+			self.assertTrue(is_pinned(read))
+
+	def test_sync_replica_copies_sqlite_file(self):
+		import os
+		import sqlite3
+		import tempfile
+		from .management.commands.sync_replica import copy_sqlite_database
+
+		with tempfile.TemporaryDirectory() as tmp:
+			src, dst = os.path.join(tmp, "a.sqlite3"), os.path.join(tmp, "b.sqlite3")
+			with sqlite3.connect(src) as conn:
+				conn.execute("CREATE TABLE t (x INTEGER)")
+				conn.execute("INSERT INTO t VALUES (7)")
+			copy_sqlite_database(src, dst)
+			conn = sqlite3.connect(dst)
+			self.assertEqual(conn.execute("SELECT x FROM t").fetchall(), [(7,)])
+			conn.close()
+
+	def test_sync_replica_retries_a_locked_copy_on_the_next_tick(self):
+		import io
+		import sqlite3
+		from unittest import mock
+		from django.core.management import call_command
+
+		class Stop(Exception):
+			pass
+
+		copies = mock.Mock(side_effect=[sqlite3.OperationalError("database is locked"), None])
+		err = io.StringIO()
+		with mock.patch("stats.management.commands.sync_replica.copy_sqlite_database", copies), \
+				mock.patch("stats.management.commands.sync_replica.time.sleep", side_effect=[None, Stop]):
+			with self.assertRaises(Stop):
+				call_command("sync_replica", target="playback_0", interval=2, stdout=io.StringIO(), stderr=err)
+		self.assertEqual(copies.call_count, 2)
+		self.assertIn("database is locked", err.getvalue())
+
+
+class QueryPlanTest(TestCase):
+	"""Fails when an aggregate endpoint's plan falls back to a full table scan."""
+
+	ENDPOINTS = [
+		"/api/v1/stats/songs/s1/aggregate",
+		"/api/v1/stats/songs/s1/rating",
+		"/api/v1/stats/songs/s1/ratings",
+		"/api/v1/stats/songs/s1/plays?valid=1&from=2020-01-01T00:00:00Z",
+		"/api/v1/stats/artists/a1/aggregate",
+		"/api/v1/stats/albums/al1/sales",
+		"/api/v1/stats/artists/ratings",
+		"/api/v1/stats/artists/ratings?from=2020-01-01T00:00:00Z&to=2100-01-01T00:00:00Z",
+		"/api/v1/stats/artists/aggregate",
+		"/api/v1/stats/artists/aggregate?from=2020-01-01T00:00:00Z",
+		"/api/v1/stats/global",
+	]
+
+	def setUp(self):
+		from .models import AlbumSale, Playback, Rating
+
+		self.user = get_user_model().objects.create(username="plan_user", is_superuser=True)
+		Rating.objects.create(user=self.user, song_id="s1", artist_id="a1", stars=4)
+		Rating.objects.create(user=self.user, song_id="s2", artist_id=None, stars=2)
+		Playback.objects.create(song_id="s1", seconds=30)
+		AlbumSale.objects.create(album_id="al1", units=2, amount=10)
+
+	def test_aggregate_endpoints_avoid_full_scans(self):
+		import re
+		from unittest import mock
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from .breaker import reset_breakers
+
+		self.addCleanup(reset_breakers)
+
+		if connection.vendor != "sqlite":
+			self.skipTest("EXPLAIN QUERY PLAN is SQLite specific")
+		# Un SCAN solo se admite si es sobre un índice cubriente (COUNT/AVG globales)
+		full_scan = re.compile(r"^SCAN (stats_\w+)\b(?! USING COVERING INDEX)")
+		self.client.force_login(self.user)
+		with mock.patch("stats.content.requests.get", side_effect=Exception("offline")):
+			for url in self.ENDPOINTS:
+				with CaptureQueriesContext(connection) as ctx:
+					self.assertEqual(self.client.get(url).status_code, 200, url)
+				for query in ctx.captured_queries:
+					sql = query["sql"]
+					if not sql.startswith("SELECT") or '"stats_' not in sql:
+						continue
+					with connection.cursor() as cursor:
+						cursor.execute("EXPLAIN QUERY PLAN " + sql)
+						plan = [row[-1] for row in cursor.fetchall()]
+					for line in plan:
+						self.assertIsNone(full_scan.match(line), f"{url}: {sql}\n{plan}")
+
+
+class ConditionalGetTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+
+		cache.clear()
+		self.user = get_user_model().objects.create(username="etag_user")
+
+	def test_global_stats_not_modified_until_a_write(self):
+		from .models import Rating
+
+		first = self.client.get("/api/v1/stats/global")
+		etag = first.headers["ETag"]
+		self.assertTrue(first.has_header("Last-Modified"))
+		# El 304 se resuelve solo con los sellos: ninguna consulta a la BD
+		with self.assertNumQueries(0):
+			again = self.client.get("/api/v1/stats/global", HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(again.status_code, 304)
+
+		with self.captureOnCommitCallbacks(execute=True):
+			Rating.objects.create(user=self.user, song_id="s1", artist_id="a1", stars=5)
+			# Sin confirmar la escritura el sello no cambia
+			self.assertEqual(self.client.get("/api/v1/stats/global", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+		after = self.client.get("/api/v1/stats/global", HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(after.status_code, 200)
+		self.assertNotEqual(after.headers["ETag"], etag)
+		self.assertEqual(after.json()["ratings_count"], 1)
+
+	def test_song_etag_only_changes_with_its_own_ratings(self):
+		from .models import Rating
+
+		etag = self.client.get("/api/v1/stats/songs/s1/aggregate").headers["ETag"]
+		with self.captureOnCommitCallbacks(execute=True):
+			Rating.objects.create(user=self.user, song_id="other", stars=1)
+		resp = self.client.get("/api/v1/stats/songs/s1/aggregate", HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 304)
+		with self.captureOnCommitCallbacks(execute=True):
+			Rating.objects.create(user=self.user, song_id="s1", stars=3)
+		resp = self.client.get("/api/v1/stats/songs/s1/aggregate", HTTP_IF_NONE_MATCH=etag)
+		self.assertEqual(resp.status_code, 200)
+
+	def test_query_string_is_part_of_the_etag(self):
+		a = self.client.get("/api/v1/stats/albums/al1/sales").headers["ETag"]
+		b = self.client.get("/api/v1/stats/albums/al1/sales?x=1").headers["ETag"]
+		self.assertNotEqual(a, b)
+
+
+class RatingResolutionTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		from .breaker import reset_breakers
+
+		cache.clear()
+		reset_breakers()
+
+	def test_rating_post_does_not_call_content_service(self):
+		from unittest import mock
+		from .models import Rating
+		from .resolution import resolve_pending_ratings
+
+		with mock.patch("stats.content.requests.get") as http_get:
+			resp = self.client.post("/api/v1/stats/songs/My%20Song/ratings", {"stars": 4}, content_type="application/json")
+		self.assertEqual(resp.status_code, 201)
+		self.assertTrue(resp.json()["resolution_pending"])
+		http_get.assert_not_called()
+
+		with mock.patch("stats.views.normalize_song_id", return_value="track-42") as normalize:
+			self.assertEqual(resolve_pending_ratings(), 1)
+		normalize.assert_called_once_with("My Song", required=True)
+		rating = Rating.objects.get()
+		self.assertEqual(rating.song_id, "track-42")
+		self.assertFalse(rating.resolution_pending)
+
+	def test_outage_leaves_ratings_pending(self):
+		import requests
+		from unittest import mock
+		from . import content
+		from .models import Rating
+		from .resolution import known_canonical, resolve_all_pending, resolve_pending_ratings
+
+		user = get_user_model().objects.create(username="outage_user")
+		Rating.objects.create(user=user, song_id="My Song", stars=4, resolution_pending=True)
+		with mock.patch("stats.content.requests.get", side_effect=requests.ConnectionError):
+			self.assertEqual(resolve_pending_ratings(), 0)
+			with self.assertRaises(content.Unavailable):
+				resolve_all_pending()
+		self.assertTrue(Rating.objects.get().resolution_pending)
+		self.assertIsNone(known_canonical("My Song"))
+
+	def test_known_canonical_id_skips_pending_state(self):
+		from .models import Rating
+
+		user = get_user_model().objects.create(username="resolved_user")
+		Rating.objects.create(user=user, song_id="track-1", stars=3)
+		resp = self.client.post("/api/v1/stats/songs/track-1/ratings", {"stars": 5}, content_type="application/json")
+		self.assertEqual(resp.status_code, 201)
+		self.assertFalse(resp.json()["resolution_pending"])
+		self.assertEqual(Rating.objects.filter(resolution_pending=True).count(), 0)
+
+
+class FlakyContentStub:
+	"""Local HTTP stub of the content service that can be switched to failing."""
+
+	def __init__(self):
+		import json
+		import threading
+		from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+		stub = self
+		self.failing = False
+		self.hits = 0
+
+		class Handler(BaseHTTPRequestHandler):
+			def do_GET(self):
+				stub.hits += 1
+				if stub.failing:
+					self.send_response(503)
+					self.end_headers()
+					return
+				body = json.dumps({"id": "a1", "name": "Artista Uno"}).encode()
+				self.send_response(200)
+				self.send_header("Content-Type", "application/json")
+				self.send_header("Content-Length", str(len(body)))
+				self.end_headers()
+				self.wfile.write(body)
+
+			def log_message(self, *args):
+				pass
+
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+		self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def close(self):
+		self.server.shutdown()
+		self.server.server_close()
+
+
+class ContentCircuitBreakerTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		from .breaker import reset_breakers
+
+		cache.clear()
+		reset_breakers()
+		self.stub = FlakyContentStub()
+		self.addCleanup(self.stub.close)
+		self.addCleanup(reset_breakers)
+
+	def test_opens_serves_stale_and_recovers_through_probe(self):
+		import time
+		from django.test import override_settings
+		from .content import get_json
+
+		breakers = {"content": {"min_calls": 2, "window": 4, "failure_rate": 0.5, "open_seconds": 0.3}}
+		with override_settings(CONTENT_API_BASE=self.stub.base, STATS_BREAKERS=breakers):
+			self.assertEqual(get_json("/artists/a1")["name"], "Artista Uno")
+
+			self.stub.failing = True
+			for _ in range(2):
+				# Caído: se devuelve el último dato conocido
+				self.assertEqual(get_json("/artists/a1")["name"], "Artista Uno")
+			self.assertEqual(self.client.get("/api/v1/stats/metrics").json()["breakers"]["content"]["state"], "open")
+
+			hits = self.stub.hits
+			self.assertEqual(get_json("/artists/a1")["name"], "Artista Uno")
+			self.assertIsNone(get_json("/artists/never-seen"))
+			self.assertEqual(self.stub.hits, hits, "open circuit must not reach the service")
+
+			self.stub.failing = False
+			time.sleep(0.35)
+			self.assertEqual(get_json("/artists/a1")["name"], "Artista Uno")
+			self.assertEqual(self.stub.hits, hits + 1)
+			self.assertEqual(self.client.get("/api/v1/stats/metrics").json()["breakers"]["content"]["state"], "closed")
+
+	def test_failed_probe_reopens(self):
+		from .breaker import CircuitBreaker, HALF_OPEN, OPEN
+
+		now = [0.0]
+		breaker = CircuitBreaker("t", min_calls=1, window=2, open_seconds=10, clock=lambda: now[0])
+		breaker.record_failure()
+		self.assertEqual(breaker.state, OPEN)
+		self.assertFalse(breaker.allow())
+		now[0] = 11
+		self.assertEqual(breaker.state, HALF_OPEN)
+		self.assertTrue(breaker.allow())
+		self.assertFalse(breaker.allow(), "only one probe in flight")
+		breaker.record_failure()
+		self.assertEqual(breaker.state, OPEN)
+
+
+class LabelRollupTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+
+		cache.clear()
+		self.user = get_user_model().objects.create(username="label_admin", is_superuser=True)
+
+	def _summary(self, query=""):
+		self.client.force_login(self.user)
+		resp = self.client.get(f"/api/v1/stats/labels/lab-1/summary{query}")
+		self.assertEqual(resp.status_code, 200)
+		return resp.json()
+
+	def test_rollups_follow_writes_and_match_rebuild(self):
+		from decimal import Decimal
+		from .models import AlbumSale, LabelDailyRollup, Rating
+		from .rollups import rebuild_label_rollups
+
+		for _ in range(3):
+			self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "lab-1"})
+		self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "lab-2"})
+		self.client.delete("/api/v1/stats/songs/s1/plays")  # borra la de lab-2
+		AlbumSale.objects.create(album_id="al1", units=2, amount=Decimal("19.98"), label_id="lab-1")
+		rating = Rating.objects.create(user=self.user, song_id="s1", stars=2, label_id="lab-1")
+		Rating.objects.create(user=self.user, song_id="s2", stars=5, label_id="lab-1")
+		rating.stars = 4
+		rating.save()
+
+		summary = self._summary()
+		self.assertEqual(summary["plays"], 3)
+		self.assertEqual(summary["sales_count"], 1)
+		self.assertEqual(summary["units_sold"], 2)
+		self.assertEqual(summary["revenue"], 19.98)
+		self.assertEqual(summary["ratings_count"], 2)
+		self.assertEqual(summary["ratings_average"], 4.5)
+
+		# Las filas que quedan a cero tras un borrado no cambian el resultado
+		rows = LabelDailyRollup.objects.exclude(plays=0, sales_count=0, ratings_count=0)
+		before = sorted(rows.values_list("label_id", "plays", "units_sold", "ratings_sum"))
+		rebuild_label_rollups()
+		after = sorted(rows.values_list("label_id", "plays", "units_sold", "ratings_sum"))
+		self.assertEqual(before, after)
+
+	def test_partitioned_rebuild_merges_ranges(self):
+		from decimal import Decimal
+		from .models import AlbumSale, LabelDailyRevenue, LabelDailyRollup, SongDailyRollup
+		from .rollups import rebuild_label_rollups, rebuild_song_rollups
+
+		for i in range(7):
+			self.client.post(f"/api/v1/stats/songs/s{i % 2}/plays", {"label_id": "lab-1", "seconds": 10})
+		for amount in ("1.50", "2.50"):
+			AlbumSale.objects.create(album_id="al1", units=1, amount=Decimal(amount), currency="eur", label_id="lab-1")
+		expected = (
+			sorted(LabelDailyRollup.objects.values_list("label_id", "plays", "units_sold")),
+			sorted(SongDailyRollup.objects.values_list("song_id", "plays", "seconds")),
+			sorted(LabelDailyRevenue.objects.values_list("currency", "amount")),
+		)
+		calls = []
+		# Sin executor: la base de test en memoria no se ve desde otros procesos
+		rebuild_label_rollups(partitions=3, progress=lambda *args: calls.append(args))
+		rebuild_song_rollups(partitions=3)
+		self.assertEqual(expected, (
+			sorted(LabelDailyRollup.objects.values_list("label_id", "plays", "units_sold")),
+			sorted(SongDailyRollup.objects.values_list("song_id", "plays", "seconds")),
+			sorted(LabelDailyRevenue.objects.values_list("currency", "amount")),
+		))
+		# 3 rangos de reproducciones y 2 de ventas (dos ids); sin valoraciones
+		self.assertEqual(len(calls), 5)
+		self.assertEqual(sum(rows for _, _, rows in calls), 9)
+
+	def test_summary_range_and_permission(self):
+		self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "lab-1"})
+		self.assertEqual(self._summary("?from=2000-01-01&to=2000-12-31")["plays"], 0)
+		self.client.logout()
+		self.assertEqual(self.client.get("/api/v1/stats/labels/lab-1/summary").status_code, 403)
+
+
+class RollupRebuildLockTest(TransactionTestCase):
+	def test_writes_wait_for_the_rebuild(self):
+		import threading
+		from django.db import OperationalError, connection, connections
+		from .models import Playback
+		from .rollups import rebuild_label_rollups
+
+		if connection.vendor != "sqlite":
+			self.skipTest("SQLite only: another writer would wait instead of failing")
+		for _ in range(3):
+			Playback.objects.create(song_id="s1", label_id="lab-1")
+		outcomes = []
+
+		def write():
+			try:
+				Playback.objects.create(song_id="s1", label_id="lab-1")
+				outcomes.append("written")
+			except OperationalError:
+				outcomes.append("locked")
+			finally:
+				connections.close_all()
+
+		def concurrent_write(*args):
+			# Entre la lectura de las particiones y la escritura de los rollups
+			thread = threading.Thread(target=write)
+			thread.start()
+			thread.join()
+
+		rebuild_label_rollups(partitions=2, progress=concurrent_write)
+		self.assertEqual(set(outcomes), {"locked"})
+		self.assertEqual(Playback.objects.count(), 3)
+
+	def test_raw_row_and_its_deltas_commit_together(self):
+		from django.db import connection
+		from django.db.models.signals import post_save
+		from .models import LabelDailyRollup, Playback
+
+		seen = []
+
+		def receiver(sender, instance, **kwargs):
+			seen.append(connection.in_atomic_block)
+
+		post_save.connect(receiver, sender=Playback)
+		self.addCleanup(post_save.disconnect, receiver, sender=Playback)
+		# En autocommit: sin la transacción el INSERT ya estaría confirmado aquí
+		Playback.objects.create(song_id="s1", label_id="lab-1")
+		self.assertEqual(seen, [True])
+		self.assertEqual(LabelDailyRollup.objects.get().plays, 1)
+
+
+class CurrencyRevenueTest(TestCase):
+	def setUp(self):
+		import os
+		import tempfile
+		from datetime import datetime, timezone as dt_timezone
+		from decimal import Decimal
+		from django.core.cache import cache
+		from django.core.management import call_command
+		from .models import AlbumSale
+
+		cache.clear()
+		with tempfile.NamedTemporaryFile("w", suffix=".csv", delete=False) as fh:
+			fh.write("date,currency,rate\n2025-03-01,USD,1.10\n2025-03-02,USD,1.00\n")
+		self.addCleanup(os.unlink, fh.name)
+		call_command("load_fx_rates", fh.name, stdout=open(os.devnull, "w"))
+
+		d1 = datetime(2025, 3, 1, 12, tzinfo=dt_timezone.utc)
+		d2 = datetime(2025, 3, 2, 12, tzinfo=dt_timezone.utc)
+		for amount, currency, day in ((10, "EUR", d1), (11, "USD", d1), (22, "USD", d2)):
+			sale = AlbumSale.objects.create(album_id="al1", amount=Decimal(amount), currency=currency)
+			AlbumSale.objects.filter(pk=sale.pk).update(purchased_at=day)
+
+	def test_mixed_currencies_are_not_summed_blindly(self):
+		data = self.client.get("/api/v1/stats/albums/al1/sales").json()
+		self.assertIsNone(data["revenue"])
+		self.assertEqual(data["revenue_by_currency"], {"EUR": 10.0, "USD": 33.0})
+
+	def test_normalize_uses_the_rate_of_each_day(self):
+		data = self.client.get("/api/v1/stats/albums/al1/sales?normalize_to=EUR").json()
+		self.assertEqual((data["revenue"], data["currency"]), (42.0, "EUR"))
+		data = self.client.get("/api/v1/stats/albums/al1/sales?normalize_to=usd").json()
+		self.assertEqual((data["revenue"], data["currency"]), (44.0, "USD"))
+		glob = self.client.get("/api/v1/stats/global?normalize_to=EUR").json()
+		self.assertEqual(glob["revenue"], 42.0)
+
+	def test_missing_rate_is_reported(self):
+		data = self.client.get("/api/v1/stats/albums/al1/sales?normalize_to=GBP").json()
+		self.assertIsNone(data["revenue"])
+		self.assertIn("EUR@2025-03-01", data["fx_missing"])
+
+
+class SeriesEndpointsTest(TestCase):
+	def setUp(self):
+		from datetime import datetime, timezone as dt_timezone
+		from django.core.cache import cache
+		from .models import AlbumSale, Playback
+
+		cache.clear()
+
+		def at(*args):
+			return datetime(*args, tzinfo=dt_timezone.utc)
+
+		for ts in (at(2025, 3, 3, 10), at(2025, 3, 3, 18), at(2025, 3, 5, 9), at(2025, 3, 12, 9)):
+			play = Playback.objects.create(song_id="s1")
+			Playback.objects.filter(pk=play.pk).update(played_at=ts)
+		for ts, amount, currency in ((at(2025, 3, 3, 10), 10, "EUR"), (at(2025, 3, 5, 10), 7, "USD")):
+			sale = AlbumSale.objects.create(album_id="al1", units=1, amount=amount, currency=currency)
+			AlbumSale.objects.filter(pk=sale.pk).update(purchased_at=ts)
+
+	def test_daily_series_is_gap_filled(self):
+		data = self.client.get(
+			"/api/v1/stats/songs/s1/plays/series?interval=day&from=2025-03-02T00:00:00Z&to=2025-03-06T00:00:00Z"
+		).json()
+		self.assertEqual(data["buckets"][0], "2025-03-02T00:00:00Z")
+		self.assertEqual(data["plays"], [0, 2, 0, 1, 0])
+
+	def test_weekly_cumulative_and_no_fill(self):
+		data = self.client.get("/api/v1/stats/songs/s1/plays/series?interval=week&cumulative=1").json()
+		# 2025-03-03 y 2025-03-10 son lunes
+		self.assertEqual(data["buckets"], ["2025-03-03T00:00:00Z", "2025-03-10T00:00:00Z"])
+		self.assertEqual(data["plays"], [3, 4])
+		data = self.client.get("/api/v1/stats/songs/s1/plays/series?interval=day&fill=0").json()
+		self.assertEqual(data["plays"], [2, 1, 1])
+
+	def test_sales_series_keeps_currencies_apart(self):
+		data = self.client.get("/api/v1/stats/albums/al1/sales/series?interval=day").json()
+		self.assertEqual(data["sales_count"], [1, 0, 1])
+		self.assertEqual(data["revenue_by_currency"], {"EUR": [10, 0, 0], "USD": [0, 0, 7]})
+
+	def test_invalid_interval(self):
+		resp = self.client.get("/api/v1/stats/songs/s1/plays/series?interval=minute")
+		self.assertEqual(resp.status_code, 400)
+
+
+class PlayDedupTest(TestCase):
+	def setUp(self):
+		from .dedup import reset_play_dedup
+
+		reset_play_dedup()
+		self.addCleanup(reset_play_dedup)
+
+	def test_retry_with_same_event_id_is_not_counted(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from .models import Playback
+
+		first = self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1", "event_id": "ev-1"})
+		self.assertEqual(first.status_code, 201)
+		with CaptureQueriesContext(connection) as ctx:
+			retry = self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1"}, HTTP_IDEMPOTENCY_KEY="ev-1")
+		self.assertEqual(retry.status_code, 200)
+		self.assertTrue(retry.json()["duplicate"])
+		self.assertEqual(retry.json()["plays"], 1)
+		self.assertFalse(any("INSERT" in q["sql"] for q in ctx.captured_queries))
+		self.assertEqual(Playback.objects.filter(song_id="s1").count(), 1)
+
+	def test_new_event_id_skips_lookup(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+
+		with CaptureQueriesContext(connection) as ctx:
+			resp = self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1", "event_id": "ev-2"})
+		self.assertEqual(resp.status_code, 201)
+		self.assertFalse(any("event_id\" = " in q["sql"] and q["sql"].startswith("SELECT") for q in ctx.captured_queries))
+
+	def test_unique_constraint_catches_filter_misses(self):
+		from .dedup import reset_play_dedup
+
+		self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1", "event_id": "ev-3"})
+		reset_play_dedup()  # otro worker: su filtro no ha visto el evento
+		resp = self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1", "event_id": "ev-3"})
+		self.assertEqual(resp.status_code, 200)
+		self.assertTrue(resp.json()["duplicate"])
+
+	def test_filter_rotates_out_old_ids(self):
+		from .dedup import RotatingDedupFilter
+
+		now = [0.0]
+		f = RotatingDedupFilter(window_seconds=10, capacity=100, error_rate=0.01, clock=lambda: now[0])
+		f.add("a")
+		now[0] = 11
+		self.assertTrue(f.seen("a"))  # sigue en la generación anterior
+		now[0] = 22
+		self.assertFalse(f.seen("a"))
+
+
+class LiveCountersTest(TestCase):
+	def test_deltas_are_coalesced_per_key(self):
+		from .live import LiveBroker
+
+		broker = LiveBroker()
+		sub = broker.subscribe({("song", "s1")})
+		for _ in range(5):
+			broker.publish([(("song", "s1"), {"plays": 1})])
+		broker.publish([(("song", "s2"), {"plays": 1})])
+		self.assertEqual(broker.drain(sub), {("song", "s1"): {"plays": 5}})
+		self.assertEqual(broker.drain(sub), {})
+		broker.unsubscribe(sub)
+		self.assertEqual(broker.snapshot(), {"keys": 0, "streams": 0})
+
+	def test_committed_writes_reach_subscribers(self):
+		from .live import broker
+		from .models import Playback, Rating
+
+		user = get_user_model().objects.create(username="live-user")
+		sub = broker.subscribe({("song", "s1")})
+		self.addCleanup(broker.unsubscribe, sub)
+		with self.captureOnCommitCallbacks(execute=True):
+			Playback.objects.create(song_id="s1")
+			rating = Rating.objects.create(user=user, song_id="s1", artist_id="a1", stars=4)
+		with self.captureOnCommitCallbacks(execute=True):
+			rating.stars = 2
+			rating.save()
+		self.assertEqual(broker.drain(sub), {("song", "s1"): {"plays": 1, "ratings_count": 1, "ratings_sum": 2}})
+
+	async def test_stream_sends_snapshot_then_counters(self):
+		from asgiref.sync import sync_to_async
+		from .live import broker
+		from .models import Playback
+
+		await sync_to_async(Playback.objects.create)(song_id="s1")
+		resp = await self.async_client.get("/api/v1/stats/live?songs=s1&interval=0.25")
+		self.assertEqual(resp["Content-Type"], "text/event-stream")
+		stream = resp.streaming_content
+		first = (await stream.__anext__()).decode()
+		self.assertIn("event: snapshot", first)
+		self.assertIn('"plays":1', first)
+		broker.publish([(("song", "s1"), {"plays": 1})])
+		broker.publish([(("song", "s1"), {"plays": 1})])
+		second = (await stream.__anext__()).decode()
+		self.assertIn("event: counters", second)
+		self.assertIn('"plays":3', second)
+		await stream.aclose()
+
+	async def test_stream_is_not_compressed(self):
+		resp = await self.async_client.get("/api/v1/stats/live?songs=s1", headers={"Accept-Encoding": "gzip"})
+		self.assertEqual(resp["Content-Type"], "text/event-stream")
+		self.assertFalse(resp.has_header("Content-Encoding"))
+		first = (await resp.streaming_content.__anext__()).decode()
+		self.assertIn("event: snapshot", first)
+		await resp.streaming_content.aclose()
+
+	def test_stream_requires_keys(self):
+		self.assertEqual(self.client.get("/api/v1/stats/live").status_code, 400)
+
+
+class ProfilingTest(TestCase):
+	def setUp(self):
+		import tempfile
+		from django.core.cache import cache
+		from .breaker import reset_breakers
+
+		cache.clear()
+		reset_breakers()
+		self.addCleanup(reset_breakers)
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		self.dir = tmp.name
+
+	def _profiled_get(self, mode):
+		import json
+		import time
+		from pathlib import Path
+		from unittest import mock
+		from django.test import override_settings
+		from .profiling import make_token
+
+		def slow_get(*args, **kwargs):
+			time.sleep(0.03)
+			return mock.Mock(status_code=200, ok=True, json=lambda: [])
+
+		with override_settings(STATS_PROFILE_DIR=self.dir, STATS_PROFILE_INTERVAL_MS=1):
+			with mock.patch("stats.content.requests.get", side_effect=slow_get):
+				resp = self.client.get("/api/v1/stats/artists/a1/aggregate", HTTP_X_STATS_PROFILE=make_token(mode))
+		profile_id = resp["X-Stats-Profile-Id"]
+		meta = json.loads((Path(self.dir) / f"{profile_id}.json").read_text())
+		return meta, Path(self.dir) / meta["profile"]
+
+	def test_signed_header_writes_collapsed_stacks_and_sidecar(self):
+		meta, profile = self._profiled_get("sample")
+		self.assertEqual(meta["endpoint"], "GET stats.views.artist_aggregate")
+		self.assertGreaterEqual(meta["queries"], 1)
+		self.assertEqual(meta["http_calls"], 1)
+		self.assertGreaterEqual(meta["http_ms"], 30)
+		self.assertIn("stats.views:artist_aggregate", profile.read_text())
+
+	def test_cprofile_mode_writes_pstats(self):
+		import pstats
+
+		meta, profile = self._profiled_get("cprofile")
+		self.assertTrue(profile.name.endswith(".pstats"))
+		self.assertTrue(pstats.Stats(str(profile)).total_calls)
+
+	def test_profiles_get_unique_names_and_the_oldest_are_pruned(self):
+		from pathlib import Path
+		from django.test import override_settings
+		from .profiling import make_token
+
+		ids = []
+		with override_settings(STATS_PROFILE_DIR=self.dir, STATS_PROFILE_MAX_FILES=3):
+			for _ in range(5):
+				resp = self.client.get("/api/v1/stats/songs/s1/aggregate", HTTP_X_STATS_PROFILE=make_token("cprofile"))
+				ids.append(resp["X-Stats-Profile-Id"])
+		self.assertEqual(len(set(ids)), 5)
+		kept = sorted(p.name for p in Path(self.dir).iterdir())
+		self.assertEqual(len(kept), 6)
+		self.assertEqual(sorted({Path(name).stem for name in kept}), sorted(ids[-3:]))
+
+	def test_bad_token_is_ignored(self):
+		resp = self.client.get("/api/v1/stats/songs/s1/aggregate", HTTP_X_STATS_PROFILE="forged")
+		self.assertEqual(resp.status_code, 200)
+		self.assertNotIn("X-Stats-Profile-Id", resp)
+
+
+class RatingsListQueriesTest(TestCase):
+	def _seed(self, n):
+		from .models import Rating
+
+		users = [get_user_model().objects.get_or_create(username=f"rater-{i}")[0] for i in range(3)]
+		Rating.objects.bulk_create(
+			Rating(user=users[i % 3], song_id="viral", artist_id="a1", stars=i % 6, comment=f"c{i}")
+			for i in range(n)
+		)
+
+	def test_query_count_is_flat(self):
+		for n in (1, 100, 10_000):
+			with self.subTest(n=n):
+				from .models import Rating
+
+				Rating.objects.all().delete()
+				self._seed(n)
+				with self.assertNumQueries(1):
+					resp = self.client.get("/api/v1/stats/songs/viral/ratings")
+				self.assertEqual(len(resp.json()), n)
+
+	def test_matches_model_serializer_output(self):
+		from .models import Rating
+		from .serializers import RatingSerializer
+
+		self._seed(5)
+		expected = RatingSerializer(Rating.objects.filter(song_id="viral").order_by("-rated_at"), many=True).data
+		self.assertEqual(self.client.get("/api/v1/stats/songs/viral/ratings").json(), [dict(r) for r in expected])
+
+	def test_detail_uses_one_query(self):
+		self._seed(1)
+		from .models import Rating
+
+		pk = Rating.objects.get().pk
+		with self.assertNumQueries(1):
+			resp = self.client.get(f"/api/v1/stats/ratings/{pk}")
+		self.assertEqual(resp.json()["username"], "rater-0")
+
+
+class ListenDurationTest(TestCase):
+	def test_tdigest_quantiles_and_merge(self):
+		import random
+		from .sketches import TDigest
+
+		rng = random.Random(7)
+		values = [rng.lognormvariate(4.5, 0.6) for _ in range(20_000)]
+		parts = [TDigest(), TDigest(), TDigest()]
+		for i, v in enumerate(values):
+			parts[i % 3].add(v)
+		merged = TDigest().merge(parts[0]).merge(parts[1]).merge(parts[2])
+		restored = TDigest.from_bytes(merged.to_bytes())
+		ordered = sorted(values)
+		for q in (0.5, 0.9, 0.99):
+			rank = sum(1 for v in ordered if v <= restored.quantile(q)) / len(ordered)
+			self.assertAlmostEqual(rank, q, delta=0.01)
+		# Memoria acotada por clave
+		self.assertLessEqual(len(restored), 100)
+
+	def test_endpoint_merges_days(self):
+		from datetime import date
+		from .models import ListenDurationSketch
+
+		for seconds in (10, 20, 30, 40):
+			self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1", "seconds": seconds})
+		self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1"})  # sin duración
+		row = ListenDurationSketch.objects.get(song_id="s1")
+		ListenDurationSketch.objects.create(song_id="s1", day=date(2020, 1, 1), count=0, digest=row.digest)
+
+		data = self.client.get("/api/v1/stats/songs/s1/listen-duration?q=0.5,0.9").json()
+		self.assertEqual(data["listens"], 8)
+		self.assertEqual(data["mean_seconds"], 25)
+		self.assertEqual(set(data["quantiles"]), {"p50", "p90"})
+		self.assertTrue(20 <= data["quantiles"]["p50"] <= 30)
+
+		data = self.client.get(f"/api/v1/stats/songs/s1/listen-duration?from={row.day.isoformat()}").json()
+		self.assertEqual(data["listens"], 4)
+
+	def test_listen_is_merged_under_lock_when_every_race_is_lost(self):
+		from datetime import date
+		from unittest import mock
+		from django.db.models import F
+		from .models import ListenDurationSketch
+		from .sketches import TDigest, record_listen
+
+		day = date(2024, 5, 1)
+		record_listen("hot", day, 10)
+		from_bytes = TDigest.from_bytes
+
+		def racing_from_bytes(data):
+			# Otro escritor cambia la fila entre la lectura y la escritura
+			ListenDurationSketch.objects.filter(song_id="hot").update(version=F("version") + 1)
+			return from_bytes(data)
+
+		with mock.patch.object(TDigest, "from_bytes", side_effect=racing_from_bytes):
+			record_listen("hot", day, 30)
+		row = ListenDurationSketch.objects.get(song_id="hot")
+		self.assertEqual(row.count, 2)
+		self.assertEqual(TDigest.from_bytes(row.digest).count, 2)
+
+	def test_rebuild_matches_incremental(self):
+		from io import StringIO
+		from django.core.management import call_command
+		from .models import ListenDurationSketch
+		from .sketches import TDigest
+
+		for seconds in (5, 50, 500):
+			self.client.post("/api/v1/stats/songs/s2/plays", {"label_id": "l1", "seconds": seconds})
+		before = TDigest.from_bytes(ListenDurationSketch.objects.get(song_id="s2").digest)
+		call_command("rebuild_rollups", stdout=StringIO())
+		after = TDigest.from_bytes(ListenDurationSketch.objects.get(song_id="s2").digest)
+		self.assertEqual(before.quantile(0.5), after.quantile(0.5))
+
+
+class PlaybackRetentionTest(TestCase):
+	def setUp(self):
+		from datetime import datetime, timedelta, timezone as dt_timezone
+		from django.test import override_settings
+		from django.utils import timezone
+		from . import retention
+		from .models import Playback
+
+		retention.clear_cache()
+		self.addCleanup(retention.clear_cache)
+		settings_override = override_settings(STATS_RETENTION_CACHE_SECONDS=0)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+		self.old = datetime(2020, 5, 4, 12, tzinfo=dt_timezone.utc)
+		stamps = [self.old, self.old, self.old + timedelta(days=1), timezone.now()]
+		for i, ts in enumerate(stamps):
+			play = Playback.objects.create(song_id="s1", valid=i != 1, seconds=30)
+			# played_at es auto_now_add: se retrasa sin señales, así que los rollups quedan desfasados
+			Playback.objects.filter(pk=play.pk).update(played_at=ts)
+
+	def _compact(self, *args):
+		from io import StringIO
+		from django.core.management import call_command
+
+		out = StringIO()
+		call_command("compact_playbacks", "--days", "30", "--pause", "0", "--chunk-size", "1", *args, stdout=out)
+		return out.getvalue()
+
+	def test_refuses_without_exact_rollups(self):
+		from django.core.management.base import CommandError
+		from .models import Playback
+
+		with self.assertRaises(CommandError):
+			self._compact()
+		self.assertEqual(Playback.objects.count(), 4)
+
+	def test_old_ranges_are_answered_from_rollups(self):
+		from .models import Playback, RetentionWatermark
+
+		self._compact("--repair")
+		self.assertEqual(Playback.objects.count(), 1)
+		self.assertTrue(RetentionWatermark.objects.filter(name="playback").exists())
+
+		self.assertEqual(self.client.get("/api/v1/stats/songs/s1/plays").json()["plays"], 4)
+		self.assertEqual(self.client.get("/api/v1/stats/songs/s1/plays?valid=0").json()["plays"], 1)
+		data = self.client.get("/api/v1/stats/songs/s1/plays?from=2020-05-05T00:00:00Z&to=2020-06-01T00:00:00Z").json()
+		self.assertEqual(data["plays"], 1)
+		series = self.client.get(
+			"/api/v1/stats/songs/s1/plays/series?interval=day&from=2020-05-04T00:00:00Z&to=2020-05-06T00:00:00Z"
+		).json()
+		self.assertEqual(series["plays"], [2, 1, 0])
+		self.assertEqual(self.client.get("/api/v1/stats/global").json()["plays_count"], 4)
+
+	def test_rebuild_keeps_compacted_days(self):
+		from io import StringIO
+		from django.core.management import call_command
+		from .models import SongDailyRollup
+
+		self._compact("--repair")
+		call_command("rebuild_rollups", stdout=StringIO())
+		self.assertEqual(sum(SongDailyRollup.objects.values_list("plays", flat=True)), 4)
+
+
+class PlaybackArchiveTest(TestCase):
+	def setUp(self):
+		import tempfile
+		from datetime import datetime, timezone as dt_timezone
+		from django.test import override_settings
+		from django.utils import timezone
+		from . import retention
+		from .models import Playback
+
+		tmp = tempfile.TemporaryDirectory()
+		self.addCleanup(tmp.cleanup)
+		retention.clear_cache()
+		self.addCleanup(retention.clear_cache)
+		settings_override = override_settings(STATS_RETENTION_CACHE_SECONDS=0, STATS_ARCHIVE_DIR=tmp.name)
+		settings_override.enable()
+		self.addCleanup(settings_override.disable)
+
+		def at(*args):
+			return datetime(*args, tzinfo=dt_timezone.utc)
+
+		plays = [
+			("s1", at(2020, 5, 4, 10), True), ("s1", at(2020, 5, 4, 10, 30), False), ("s1", at(2020, 5, 4, 15), True),
+			("s2", at(2020, 5, 20, 8), True), ("s1", at(2020, 6, 1, 0), True), ("s2", timezone.now(), True),
+		]
+		for song_id, ts, valid in plays:
+			play = Playback.objects.create(song_id=song_id, valid=valid, seconds=60)
+			Playback.objects.filter(pk=play.pk).update(played_at=ts)
+
+	def _run(self, *args):
+		from io import StringIO
+		from django.core.management import call_command
+
+		out = StringIO()
+		call_command(*args, stdout=out)
+		return out.getvalue()
+
+	def test_month_files_are_columnar_and_sorted(self):
+		from datetime import date
+		from . import archive
+
+		self._run("archive_playbacks")
+		months = {m.month: m for m in archive.months()}
+		self.assertEqual(sorted(months), [date(2020, 5, 1), date(2020, 6, 1)])
+		may = months[date(2020, 5, 1)]
+		self.assertEqual(may.songs.tolist(), ["s1", "s2"])
+		self.assertEqual(may.song_code.tolist(), [0, 0, 0, 1])
+		self.assertEqual(may.count("s1", valid=True), 2)
+		self.assertEqual(may.counts_by_song(), {"s1": 3, "s2": 1})
+
+	def test_endpoints_merge_archive_and_raw(self):
+		from .models import Playback, SongDailyRollup
+
+		self._run("archive_playbacks")
+		self._run("compact_playbacks", "--days", "30", "--pause", "0", "--repair")
+		self.assertEqual(Playback.objects.count(), 1)
+		# Los meses archivados no dependen de los rollups
+		SongDailyRollup.objects.filter(day__lt="2020-07-01").delete()
+
+		self.assertEqual(self.client.get("/api/v1/stats/songs/s1/plays").json()["plays"], 4)
+		self.assertEqual(self.client.get("/api/v1/stats/songs/s1/plays?valid=0").json()["plays"], 1)
+		data = self.client.get(
+			"/api/v1/stats/songs/s1/plays/series?interval=hour&from=2020-05-04T09:00:00Z&to=2020-05-04T15:00:00Z"
+		).json()
+		self.assertEqual(data["plays"], [0, 2, 0, 0, 0, 0, 1])
+		top = self.client.get("/api/v1/stats/songs/top?limit=2").json()["items"]
+		self.assertEqual(top, [{"song_id": "s1", "plays": 4}, {"song_id": "s2", "plays": 2}])
+		top = self.client.get("/api/v1/stats/songs/top?from=2020-05-10T00:00:00Z&to=2020-05-31T00:00:00Z").json()["items"]
+		self.assertEqual(top, [{"song_id": "s2", "plays": 1}])
+
+
+class AnalyticsEngineTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		from django.test import override_settings
+		from . import analytics
+		from .models import Playback, Rating
+
+		cache.clear()
+		analytics.reset()
+		self.addCleanup(analytics.reset)
+		user = get_user_model().objects.create(username="engine-user")
+		for i in range(30):
+			Playback.objects.create(song_id=f"s{i % 3}", valid=i % 4 != 0, label_id="l1" if i % 2 else None)
+		for i in range(10):
+			Rating.objects.create(user=user, song_id=f"s{i % 2}", artist_id=f"a{i % 2}", stars=i % 6)
+		self.urls = [
+			"/api/v1/stats/songs/s1/plays?valid=1",
+			"/api/v1/stats/songs/s0/plays?from=2000-01-01T00:00:00Z",
+			"/api/v1/stats/songs/top?limit=2",
+			"/api/v1/stats/songs/s0/aggregate",
+			"/api/v1/stats/global",
+		]
+		self.engine = override_settings(STATS_ANALYTICS_ENGINE=True)
+
+	def _answers(self):
+		from django.core.cache import cache
+
+		out = []
+		for url in self.urls:
+			cache.clear()  # sin 304
+			out.append(self.client.get(url).json())
+		return out
+
+	def test_matches_sql(self):
+		expected = self._answers()
+		with self.engine:
+			self.assertEqual(self._answers(), expected)
+
+	def test_sees_inserts_and_deletes(self):
+		from .models import Playback
+
+		with self.engine:
+			self._answers()
+			Playback.objects.create(song_id="s1")
+			Playback.objects.filter(song_id="s0").first().delete()
+			with_engine = self._answers()
+		self.assertEqual(with_engine, self._answers())
+
+	def test_group_by_and_top_k(self):
+		from . import analytics
+
+		with self.engine:
+			self.assertEqual(analytics.playbacks.count_by("label"), {"l1": 15})
+			self.assertEqual(analytics.playbacks.top("song", 1, valid=True), [("s2", 8)])
+			self.assertEqual(analytics.ratings.stats_by("artist"), {"a0": (5, 8), "a1": (5, 13)})
+
+	def test_empty_artist_ids_are_left_out_like_in_sql(self):
+		from django.test import override_settings
+		from .models import Rating
+
+		user = get_user_model().objects.get()
+		user.is_superuser = True
+		user.save()
+		self.client.force_login(user)
+		Rating.objects.create(user=user, song_id="s9", artist_id="", stars=5)
+		# Con tareas no se consulta el servicio de contenidos por los sin artista
+		with override_settings(STATS_TASKS_ENABLED=True):
+			expected = self.client.get("/api/v1/stats/artists/ratings").json()
+			self.assertEqual(sorted(i["artist_id"] for i in expected["items"]), ["a0", "a1"])
+			with self.engine:
+				self.assertEqual(self.client.get("/api/v1/stats/artists/ratings").json(), expected)
+
+
+class SingleFlightTest(TestCase):
+	def test_concurrent_calls_share_one_execution(self):
+		import threading
+		import time
+		from .singleflight import Group
+
+		group = Group()
+		release = threading.Event()
+		calls = []
+
+		def compute():
+			calls.append(1)
+			release.wait(5)
+			return {"n": 42}
+
+		results = []
+		threads = [threading.Thread(target=lambda: results.append(group.do("k", compute, timeout=5))) for _ in range(8)]
+		threads[0].start()
+		while not group.snapshot()["in_flight"]:
+			time.sleep(0.001)
+		for t in threads[1:]:
+			t.start()
+		while group._calls["k"].waiters < 7:
+			time.sleep(0.001)
+		release.set()
+		for t in threads:
+			t.join()
+		self.assertEqual(len(calls), 1)
+		self.assertEqual(results, [{"n": 42}] * 8)
+		self.assertEqual(group.snapshot(), {"executions": 1, "shared": 7, "remote": 0, "timeouts": 0, "in_flight": 0})
+
+	def test_errors_are_shared_and_not_cached(self):
+		from .singleflight import Group
+
+		group = Group()
+		with self.assertRaises(ValueError):
+			group.do("k", lambda: (_ for _ in ()).throw(ValueError("boom")))
+		self.assertEqual(group.do("k", lambda: 1), 1)
+
+	def test_waits_for_result_of_other_worker(self):
+		import threading
+		from unittest import mock
+		from django.core.cache import cache
+		from django.test import override_settings
+		from . import singleflight
+
+		cache.clear()
+		with override_settings(STATS_SINGLEFLIGHT_CACHE="default"), \
+				mock.patch.object(singleflight, "request_key", return_value="k"):
+			# Otro worker tiene el lock y publica su resultado poco después
+			cache.add(singleflight.LOCK_PREFIX + "k", 1)
+			timer = threading.Timer(0.1, lambda: cache.set(singleflight.RESULT_PREFIX + "k", ({"plays_count": 999}, 200)))
+			timer.start()
+			body = self.client.get("/api/v1/stats/global").json()
+			timer.join()
+		self.assertEqual(body, {"plays_count": 999})
+		cache.clear()
+		self.assertEqual(self.client.get("/api/v1/stats/global").json()["plays_count"], 0)
+
+
+class ResultCacheTest(TestCase):
+	def setUp(self):
+		from django.core.cache import caches
+		from . import caching
+
+		caches["stats"].clear()
+		caching.reset()
+		self.addCleanup(caches["stats"].clear)
+
+	def test_hits_until_a_write_bumps_the_stamps(self):
+		from django.test import override_settings
+		from . import caching
+		from .models import Rating
+
+		user = get_user_model().objects.create(username="cache-user")
+		with override_settings(STATS_RESULT_CACHE="stats"):
+			self.assertEqual(self.client.get("/api/v1/stats/global").json()["ratings_count"], 0)
+			self.assertEqual(self.client.get("/api/v1/stats/global").json()["ratings_count"], 0)
+			with self.captureOnCommitCallbacks(execute=True):
+				Rating.objects.create(user=user, song_id="s1", stars=4)
+			self.assertEqual(self.client.get("/api/v1/stats/global").json()["ratings_count"], 1)
+			metrics = self.client.get("/api/v1/stats/metrics").json()["result_cache"]
+		self.assertEqual(
+			{k: metrics[k] for k in ("hits", "misses", "stores")}, {"hits": 1, "misses": 2, "stores": 2},
+		)
+		self.assertEqual(caching.snapshot()["hit_ratio"], round(1 / 3, 4))
+
+	def test_replica_reads_are_keyed_on_the_last_sync(self):
+		from django.test import Client, override_settings
+		from . import caching, versioning
+
+		# `default` hace de réplica: solo interesan las claves y los validadores
+		with override_settings(STATS_RESULT_CACHE="stats", STATS_READ_REPLICA_ALIAS="default"):
+			# Sin copias registradas el retraso es desconocido: ni caché ni validadores
+			self.assertNotIn("ETag", self.client.get("/api/v1/stats/global"))
+			versioning.bump_replica()
+			etag = self.client.get("/api/v1/stats/global")["ETag"]
+			self.assertEqual(self.client.get("/api/v1/stats/global")["ETag"], etag)
+			versioning.bump_replica()
+			self.assertNotEqual(self.client.get("/api/v1/stats/global")["ETag"], etag)
+			# Quien escribe lee del primario y no recibe el resultado de la réplica
+			writer = Client()
+			with self.captureOnCommitCallbacks(execute=True):
+				self.assertEqual(writer.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1"}).status_code, 201)
+			replica_etag = self.client.get("/api/v1/stats/global")["ETag"]
+			self.assertNotEqual(writer.get("/api/v1/stats/global")["ETag"], replica_etag)
+		self.assertEqual({k: caching.counters[k] for k in ("hits", "stores")}, {"hits": 1, "stores": 4})
+
+	def test_file_cache_counts_evictions(self):
+		import tempfile
+		from . import caching
+
+		with tempfile.TemporaryDirectory() as tmp:
+			cache = caching.SharedFileCache(tmp, {"OPTIONS": {"MAX_ENTRIES": 4, "CULL_FREQUENCY": 2, "CULL_EVERY": 1}})
+			for i in range(6):
+				cache.set(f"k{i}", i)
+			# Al escribir la quinta hay 4 entradas: se purga la mitad
+			self.assertEqual(caching.counters["evictions"], 2)
+			self.assertEqual(sum(cache.get(f"k{i}") is not None for i in range(6)), 4)
+
+	def test_hits_are_served_pre_encoded(self):
+		from django.test import override_settings
+		from . import caching
+
+		with override_settings(STATS_RESULT_CACHE="stats"):
+			first = self.client.get("/api/v1/stats/albums/al1/sales")
+			with self.assertNumQueries(0):
+				again = self.client.get("/api/v1/stats/albums/al1/sales")
+		self.assertEqual(caching.counters["hits"], 1)
+		self.assertEqual(first.content, again.content)
+
+	def test_degraded_responses_are_not_cached_or_validated(self):
+		import requests
+		from unittest import mock
+		from django.core.cache import cache
+		from django.test import override_settings
+		from . import caching
+		from .breaker import reset_breakers
+		from .models import Rating
+
+		cache.clear()
+		reset_breakers()
+		self.addCleanup(reset_breakers)
+		user = get_user_model().objects.create(username="degraded-user")
+		Rating.objects.create(user=user, song_id="s1", artist_id="a1", stars=4)
+		url = "/api/v1/stats/artists/aggregate?enrich=1"
+		with override_settings(STATS_RESULT_CACHE="stats", STATS_TASKS_ENABLED=True):
+			# Sin metadatos en caché: respuesta parcial mientras el worker los trae
+			partial = self.client.get(url)
+			self.assertEqual(partial["Cache-Control"], "no-store")
+			self.assertFalse(partial.has_header("ETag"))
+			self.assertNotIn("artist", partial.json()["items"][0])
+			self.assertEqual(caching.counters["stores"], 0)
+
+		with override_settings(STATS_RESULT_CACHE="stats"):
+			with mock.patch("stats.content.requests.get", side_effect=requests.ConnectionError):
+				down = self.client.get("/api/v1/stats/artists/zz/aggregate")
+			self.assertEqual(down["Cache-Control"], "no-store")
+			self.assertFalse(down.has_header("ETag"))
+			with mock.patch("stats.content.get_json", return_value={"items": [{"id": "a1", "name": "Uno"}]}):
+				full = self.client.get("/api/v1/stats/artists/aggregate?enrich=1")
+		self.assertFalse(full.has_header("Cache-Control"))
+		self.assertTrue(full.has_header("ETag"))
+		self.assertEqual(full.json()["items"][0]["artist"]["name"], "Uno")
+		self.assertEqual(caching.counters["stores"], 1)
+
+
+class FieldSelectionTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+
+		cache.clear()
+
+	def test_sales_computes_only_requested_fields(self):
+		from django.db import connection
+		from django.test.utils import CaptureQueriesContext
+		from .models import AlbumSale
+
+		AlbumSale.objects.create(album_id="al1", units=3, amount=10, currency="EUR")
+		with CaptureQueriesContext(connection) as ctx:
+			data = self.client.get("/api/v1/stats/albums/al1/sales?fields=sales_count,units_sold").json()
+		self.assertEqual(data, {"album_id": "al1", "sales_count": 1, "units_sold": 3})
+		self.assertEqual(len([q for q in ctx.captured_queries if "stats_albumsale" in q["sql"]]), 1)
+
+		resp = self.client.get("/api/v1/stats/albums/al1/sales?fields=sales_count,nope")
+		self.assertEqual(resp.status_code, 400)
+		self.assertIn("nope", resp.json()["detail"])
+
+	def test_global_fields(self):
+		self.client.post("/api/v1/stats/songs/s1/plays", {"label_id": "l1"})
+		self.assertEqual(self.client.get("/api/v1/stats/global?fields=plays_count").json(), {"plays_count": 1})
+		data = self.client.get("/api/v1/stats/global?fields=revenue").json()
+		self.assertEqual(set(data), {"revenue", "currency", "revenue_by_currency"})
+
+	def test_artists_without_resolved_skip_content_service(self):
+		from unittest import mock
+		from .models import Rating
+
+		user = get_user_model().objects.create(username="fields-user")
+		Rating.objects.create(user=user, song_id="s1", artist_id="a1", stars=4)
+		Rating.objects.create(user=user, song_id="s2", stars=2)
+		with mock.patch("stats.content.requests.get") as http_get:
+			data = self.client.get("/api/v1/stats/artists/aggregate?fields=ratings_count&enrich=1").json()
+		http_get.assert_not_called()
+		self.assertEqual(data["items"], [{"artist_id": "a1", "ratings_count": 1}])
+
+
+class RenderingTest(TestCase):
+	def test_fast_renderer_matches_drf(self):
+		from datetime import date, datetime, timezone as dt_timezone
+		from decimal import Decimal
+		import numpy as np
+		from rest_framework.renderers import JSONRenderer
+		from .renderers import FastJSONRenderer
+
+		data = {
+			"items": [{"id": i, "name": "canción", "avg": 4.25, "amount": Decimal("9.99")} for i in range(3)],
+			"stars": {1: 2, 5: 7},
+			"at": datetime(2024, 5, 1, 12, 30, 1, 123456, tzinfo=dt_timezone.utc),
+			"day": date(2024, 5, 1),
+			"n": np.int64(3),
+			"none": None,
+		}
+		self.assertEqual(FastJSONRenderer().render(data), JSONRenderer().render(data))
+
+	def test_gzip_only_above_threshold(self):
+		from .models import Rating
+
+		user = get_user_model().objects.create(username="gzip-user")
+		Rating.objects.bulk_create([Rating(user=user, song_id="s1", stars=3, comment="x" * 40) for _ in range(40)])
+		big = self.client.get("/api/v1/stats/songs/s1/ratings", HTTP_ACCEPT_ENCODING="gzip")
+		self.assertEqual(big.headers.get("Content-Encoding"), "gzip")
+		small = self.client.get("/api/v1/stats/songs/s2/ratings", HTTP_ACCEPT_ENCODING="gzip")
+		self.assertFalse(small.has_header("Content-Encoding"))
+
+
+class TaskQueueTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache, caches
+		from .breaker import reset_breakers
+		from . import tasks
+
+		cache.clear()
+		caches["stats"].clear()
+		reset_breakers()
+		tasks.forget_enqueued()
+		self.addCleanup(tasks.forget_enqueued)
+		self.calls = []
+		self.fail = [True]
+
+		def flaky(n):
+			self.calls.append(n)
+			if self.fail[0]:
+				raise RuntimeError("boom")
+
+		tasks.register("test_flaky", concurrency=1, max_attempts=2)(flaky)
+		self.addCleanup(tasks.REGISTRY.pop, "test_flaky")
+
+	def test_artist_meta_tasks_are_keyed_by_the_whole_id_set(self):
+		from django.test import override_settings
+		from .models import Task
+		from .views import _enrich_with_artists
+
+		prefix = [f"artist-{i:04d}" for i in range(30)]
+		with override_settings(STATS_TASKS_ENABLED=True):
+			_enrich_with_artists([{"artist_id": a} for a in prefix + ["zz-first"]])
+			_enrich_with_artists([{"artist_id": a} for a in prefix + ["zz-second"]])
+			_enrich_with_artists([{"artist_id": a} for a in prefix + ["zz-first"]])
+		queued = [t.payload["ids"][-1] for t in Task.objects.filter(kind="artist_meta").order_by("pk")]
+		self.assertEqual(queued, ["zz-first", "zz-second"])
+
+	def test_dedup_and_concurrency_limit(self):
+		from . import tasks
+
+		first = tasks.enqueue("test_flaky", key="a", n=1)
+		self.assertIsNotNone(first)
+		self.assertIsNone(tasks.enqueue("test_flaky", key="a", n=1), "same key already queued")
+		tasks.enqueue("test_flaky", key="b", n=2)
+
+		# Concurrencia 1: solo se reclama una aunque haya dos en cola
+		self.assertEqual([t.pk for t in tasks.claim("w1", limit=5)], [first.pk])
+		self.assertEqual(tasks.claim("w2", limit=5), [])
+		# Mientras corre, la misma clave se puede volver a encolar
+		self.assertIsNotNone(tasks.enqueue("test_flaky", key="a", n=1))
+
+	def test_retries_with_backoff_then_fails(self):
+		from datetime import timedelta
+		from django.utils import timezone
+		from . import tasks
+		from .models import Task
+
+		task = tasks.enqueue("test_flaky", n=1)
+		tasks.claim("w1")
+		with self.assertLogs("stats.tasks", "WARNING"):
+			self.assertEqual(tasks.run_task(task.pk), Task.QUEUED)
+		task.refresh_from_db()
+		self.assertEqual(task.attempts, 1)
+		self.assertGreater(task.run_after, timezone.now())
+		self.assertIn("boom", task.last_error)
+		self.assertEqual(tasks.claim("w1"), [], "not due yet")
+
+		Task.objects.filter(pk=task.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+		tasks.claim("w1")
+		with self.assertLogs("stats.tasks", "WARNING"):
+			self.assertEqual(tasks.run_task(task.pk), Task.FAILED)
+		self.assertEqual(self.calls, [1, 1])
+
+	def test_expired_lease_is_requeued(self):
+		from datetime import timedelta
+		from django.utils import timezone
+		from . import tasks
+		from .models import Task
+
+		self.fail[0] = False
+		task = tasks.enqueue("test_flaky", n=3)
+		tasks.claim("dead-worker")
+		Task.objects.filter(pk=task.pk).update(locked_until=timezone.now() - timedelta(seconds=1))
+		self.assertEqual(tasks.requeue_expired(), 1)
+		[again] = tasks.claim("w1")
+		self.assertEqual(tasks.run_task(again.pk), Task.DONE)
+		self.assertEqual(self.calls, [3])
+
+	def test_play_label_is_filled_in_by_the_worker(self):
+		import io
+		from unittest import mock
+		from django.core.management import call_command
+		from django.test import override_settings
+		from .models import LabelDailyRollup, Playback, Task
+
+		with override_settings(STATS_TASKS_ENABLED=True):
+			with mock.patch("stats.content.requests.get") as http_get, self.captureOnCommitCallbacks(execute=True):
+				for _ in range(2):
+					self.assertEqual(self.client.post("/api/v1/stats/songs/s1/plays").status_code, 201)
+			http_get.assert_not_called()
+			self.assertEqual(Task.objects.filter(kind="playback_label", status=Task.QUEUED).count(), 1)
+			self.assertFalse(Playback.objects.exclude(label_id=None).exists())
+
+			with mock.patch("stats.content.get_json", return_value={"artist": {"label_id": "lab-9"}}):
+				call_command("stats_worker", "--once", "--processes", "0", stdout=io.StringIO())
+		self.assertEqual(set(Playback.objects.values_list("label_id", flat=True)), {"lab-9"})
+		self.assertEqual(LabelDailyRollup.objects.get(label_id="lab-9").plays, 2)
+		self.assertEqual(Task.objects.get(kind="playback_label").status, Task.DONE)
+
+	def test_play_label_is_retried_while_content_is_down(self):
+		import requests
+		from datetime import timedelta
+		from unittest import mock
+		from django.core.cache import cache
+		from django.utils import timezone
+		from . import tasks
+		from .models import Playback, Task
+		from .views import LABEL_CACHE_PREFIX
+
+		Playback.objects.create(song_id="s1")
+		task = tasks.enqueue("playback_label", key="s1", song_id="s1")
+		tasks.claim("w1")
+		with mock.patch("stats.content.requests.get", side_effect=requests.ConnectionError), \
+				self.assertLogs("stats.tasks", "WARNING"):
+			self.assertEqual(tasks.run_task(task.pk), Task.QUEUED)
+		self.assertIsNone(cache.get(LABEL_CACHE_PREFIX + "s1"), "an outage is not a 'no label' answer")
+
+		Task.objects.filter(pk=task.pk).update(run_after=timezone.now() - timedelta(seconds=1))
+		tasks.claim("w1")
+		with mock.patch("stats.content.get_json", return_value={"artist": {"label_id": "lab-3"}}):
+			self.assertEqual(tasks.run_task(task.pk), Task.DONE)
+		self.assertEqual(Playback.objects.get().label_id, "lab-3")
+
+	def test_rating_artists_walks_past_unresolvable_songs(self):
+		import io
+		from unittest import mock
+		from django.core.management import call_command
+		from django.test import override_settings
+		from django.utils import timezone
+		from . import tasks
+		from .models import Rating, Task
+
+		user = get_user_model().objects.create(username="artists-user")
+		for song in ("s1", "s2", "s3"):
+			Rating.objects.create(user=user, song_id=song, stars=4)
+		with override_settings(STATS_TASKS_ENABLED=True):
+			with self.captureOnCommitCallbacks(execute=True):
+				self.assertEqual(self.client.get("/api/v1/stats/artists/aggregate").status_code, 200)
+			self.assertFalse(Task.objects.exists(), "reads do not queue work")
+
+			tasks.enqueue("rating_artists", key="pending", batch_size=1)
+			resolve = mock.patch("stats.views.resolve_song_artists", side_effect=lambda ids: {s: "a3" for s in ids if s == "s3"})
+			with resolve as resolved:
+				call_command("stats_worker", "--once", "--processes", "0", "--kind", "rating_artists", stdout=io.StringIO())
+				self.assertEqual([c.args[0] for c in resolved.call_args_list], [["s1"], ["s2"], ["s3"]])
+				# Otra pasada no vuelve a preguntar por los temas en espera
+				tasks.rating_artists()
+				self.assertEqual(resolved.call_count, 3)
+		self.assertEqual(dict(Rating.objects.values_list("song_id", "artist_id")), {"s1": None, "s2": None, "s3": "a3"})
+		retry = Task.objects.get(kind="rating_artists", status=Task.QUEUED)
+		self.assertEqual(retry.key, "retry")
+		self.assertGreater(retry.run_after, timezone.now())
+
+	def test_play_ingestion_enqueues_once_per_song(self):
+		from unittest import mock
+		from django.test import override_settings
+		from . import tasks
+
+		with override_settings(STATS_TASKS_ENABLED=True), mock.patch.object(tasks, "enqueue") as enqueue:
+			for _ in range(3):
+				with self.captureOnCommitCallbacks(execute=True):
+					self.client.post("/api/v1/stats/songs/s1/plays")
+			with self.captureOnCommitCallbacks(execute=True):
+				self.client.post("/api/v1/stats/songs/s2/plays")
+		self.assertEqual([c.kwargs["song_id"] for c in enqueue.call_args_list], ["s1", "s2"])
+
+
+class PlaybackShardingTest(TransactionTestCase):
+	databases = {"default", "playback_0", "playback_1"}
+
+	def setUp(self):
+		from django.core.cache import cache, caches
+		from django.test import override_settings
+		from . import retention
+
+		cache.clear()
+		caches["stats"].clear()
+		retention.clear_cache()
+		self.sharded = override_settings(STATS_PLAYBACK_SHARDS=["playback_0", "playback_1"])
+		self.sharded.enable()
+		self.addCleanup(self.sharded.disable)
+		self.addCleanup(retention.clear_cache)
+		self.songs = [f"song-{i}" for i in range(8)]
+		for i, song in enumerate(self.songs):
+			for _ in range(i + 1):
+				self.client.post(f"/api/v1/stats/songs/{song}/plays", {"label_id": "lab-1", "seconds": 30})
+
+	def test_plays_land_in_the_shard_of_their_song(self):
+		from .models import LabelDailyRollup, ListenDurationSketch, Playback, SongDailyRollup
+		from .sharding import shard_for
+
+		by_shard = {alias: set(Playback.objects.using(alias).values_list("song_id", flat=True)) for alias in self.databases}
+		self.assertEqual(by_shard["default"], set())
+		self.assertTrue(by_shard["playback_0"] and by_shard["playback_1"], "hash spreads the songs")
+		for alias in ("playback_0", "playback_1"):
+			self.assertEqual({shard_for(s) for s in by_shard[alias]}, {alias})
+			self.assertEqual(set(SongDailyRollup.objects.using(alias).values_list("song_id", flat=True)), by_shard[alias])
+			self.assertEqual(set(ListenDurationSketch.objects.using(alias).values_list("song_id", flat=True)), by_shard[alias])
+		# Los rollups por discográfica siguen en default
+		self.assertEqual(LabelDailyRollup.objects.using("default").get(label_id="lab-1").plays, 36)
+
+	def test_reads_route_and_scatter_gather(self):
+		from django.test import override_settings
+
+		for parallel in (True, False):
+			with override_settings(STATS_SHARD_PARALLEL=parallel):
+				self.assertEqual(self.client.get("/api/v1/stats/songs/song-3/plays").json()["plays"], 4)
+				self.assertEqual(self.client.get("/api/v1/stats/global").json()["plays_count"], 36)
+				top = self.client.get("/api/v1/stats/songs/top?limit=3").json()["items"]
+				self.assertEqual(top, [
+					{"song_id": "song-7", "plays": 8}, {"song_id": "song-6", "plays": 7}, {"song_id": "song-5", "plays": 6},
+				])
+		self.assertEqual(self.client.delete("/api/v1/stats/songs/song-0/plays").json()["plays"], 0)
+		series = self.client.get("/api/v1/stats/songs/song-2/plays/series?interval=day").json()
+		self.assertEqual(sum(series["plays"]), 3)
+
+	def test_analytics_engine_loads_every_shard(self):
+		from django.test import override_settings
+		from . import analytics
+
+		urls = ["/api/v1/stats/songs/song-3/plays", "/api/v1/stats/global", "/api/v1/stats/songs/top?limit=3"]
+		expected = [self.client.get(url).json() for url in urls]
+		analytics.reset()
+		self.addCleanup(analytics.reset)
+		with override_settings(STATS_ANALYTICS_ENGINE=True):
+			self.assertEqual([self.client.get(url).json() for url in urls], expected)
+			self.assertEqual(set(analytics.snapshot()["playback"]["last_ids"]), {"playback_0", "playback_1"})
+
+
+class RatingSearchTest(TestCase):
+	def setUp(self):
+		from django.core.cache import cache
+		from .models import Rating
+
+		cache.clear()
+		user = get_user_model().objects.create(username="search-user")
+		self.loud = Rating.objects.create(user=user, song_id="s1", artist_id="a1", stars=5, comment="Guitarra enorme, guitarra y más guitarra")
+		Rating.objects.create(user=user, song_id="s2", artist_id="a2", stars=3, comment="La guitarra se pierde entre tanto sintetizador y batería")
+		Rating.objects.bulk_create([Rating(user=user, song_id="s3", stars=1, comment="Canción aburrida")])
+
+	def _search(self, query):
+		resp = self.client.get(f"/api/v1/stats/ratings/search?{query}")
+		self.assertEqual(resp.status_code, 200)
+		return resp.json()
+
+	def test_ranked_filtered_and_in_sync(self):
+		from .models import Rating
+
+		data = self._search("q=guitarra")
+		self.assertEqual(data["total"], 2)
+		self.assertEqual(data["items"][0]["id"], self.loud.pk)
+		self.assertEqual(self._search("q=guitarra&song_id=s2")["items"][0]["song_id"], "s2")
+		self.assertEqual(self._search("q=cancion")["total"], 1)  # sin tildes
+		self.assertEqual(self._search("q=sinte*")["total"], 1)
+		self.assertEqual(self._search('q="guitarra" (-')["total"], 2)  # la sintaxis de FTS5 no pasa
+
+		# update() y delete() no emiten señales: el índice se mantiene igual
+		Rating.objects.filter(song_id="s3").update(comment="Ahora con guitarra")
+		self.loud.delete()
+		self.assertEqual(sorted(i["song_id"] for i in self._search("q=guitarra")["items"]), ["s2", "s3"])
+		self.assertEqual(self.client.get("/api/v1/stats/ratings/search?q=").status_code, 400)
+
+	def test_install_restores_dropped_triggers(self):
+		from django.db import connection
+		from . import search
+		from .models import Rating
+
+		if connection.vendor != "sqlite":
+			self.skipTest("SQLite only")
+		with connection.cursor() as cursor:
+			for suffix in ("ai", "ad", "au"):
+				cursor.execute(f"DROP TRIGGER {search.FTS_TABLE}_{suffix}")
+		Rating.objects.filter(song_id="s3").update(comment="Batería perdida")
+		self.assertTrue(search.install(connection))
+		self.assertEqual(search.search("perdida")[0], 1)
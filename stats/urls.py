@@ -10,9 +10,17 @@ from . import views as stats_views
 app_name = "stats"
 
 urlpatterns = [
+	path("api/v1/stats/songs/top", stats_views.top_songs),
+	path("api/v1/stats/songs/top/", stats_views.top_songs),
+	path("api/v1/stats/songs/<str:song_id>/plays/series", stats_views.plays_series),
+	path("api/v1/stats/songs/<str:song_id>/plays/series/", stats_views.plays_series),
+	path("api/v1/stats/songs/<str:song_id>/listen-duration", stats_views.song_listen_duration),
+	path("api/v1/stats/songs/<str:song_id>/listen-duration/", stats_views.song_listen_duration),
 	path("api/v1/stats/songs/<str:song_id>/plays", stats_views.plays_by_song),
 	path("api/v1/stats/songs/<str:song_id>/plays/", stats_views.plays_by_song),
 
+	path("api/v1/stats/albums/<str:album_id>/sales/series", stats_views.sales_series),
+	path("api/v1/stats/albums/<str:album_id>/sales/series/", stats_views.sales_series),
 	path("api/v1/stats/albums/<str:album_id>/sales", stats_views.sales_by_album),
 	path("api/v1/stats/albums/<str:album_id>/sales/", stats_views.sales_by_album),
 
@@ -22,6 +30,8 @@ urlpatterns = [
 	path("api/v1/stats/artists/ratings/", stats_views.artists_ratings),
 	path("api/v1/stats/artists/aggregate", stats_views.artists_aggregate),
 	path("api/v1/stats/artists/aggregate/", stats_views.artists_aggregate),
+	path("api/v1/stats/artists/<str:artist_id>/listen-duration", stats_views.artist_listen_duration),
+	path("api/v1/stats/artists/<str:artist_id>/listen-duration/", stats_views.artist_listen_duration),
 	path("api/v1/stats/artists/<str:artist_id>/aggregate", stats_views.artist_aggregate),
 	path("api/v1/stats/artists/<str:artist_id>/aggregate/", stats_views.artist_aggregate),
 	# Alias using camelCase for frontend convenience/backwards compatibility
@@ -31,6 +41,15 @@ urlpatterns = [
 	path("api/v1/stats/global", stats_views.global_stats),
 	path("api/v1/stats/global/", stats_views.global_stats),
 
+	path("api/v1/stats/labels/<str:label_id>/summary", stats_views.label_summary),
+	path("api/v1/stats/labels/<str:label_id>/summary/", stats_views.label_summary),
+
+	path("api/v1/stats/live", stats_views.live_stream),
+	path("api/v1/stats/live/", stats_views.live_stream),
+
+	path("api/v1/stats/metrics", stats_views.metrics),
+	path("api/v1/stats/metrics/", stats_views.metrics),
+
 	# Individual ratings list/create and detail
 	path("api/v1/stats/songs/<str:song_id>/ratings/", stats_views.SongRatingsListCreateView.as_view()),
 	path("api/v1/stats/songs/<str:song_id>/ratings", stats_views.SongRatingsListCreateView.as_view()),
@@ -45,6 +64,8 @@ urlpatterns = [
 	# Back-compat: allow fetching a specific rating under the song path
 	path("api/v1/stats/songs/<str:song_id>/rating/<int:pk>", stats_views.RatingDetailView.as_view()),
 	path("api/v1/stats/songs/<str:song_id>/rating/<int:pk>/", stats_views.RatingDetailView.as_view()),
+	path("api/v1/stats/ratings/search", stats_views.ratings_search),
+	path("api/v1/stats/ratings/search/", stats_views.ratings_search),
 	path("api/v1/stats/ratings/<int:pk>/", stats_views.RatingDetailView.as_view()),
 	path("api/v1/stats/ratings/<int:pk>", stats_views.RatingDetailView.as_view()),
 ]
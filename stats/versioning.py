@@ -0,0 +1,150 @@
+"""Per-entity version stamps and conditional GET support.
+
+Every write to ``Playback``, ``AlbumSale`` or ``Rating`` bumps, when it
+commits, a stamp for the whole model (``"rating"``) and for the keys it
+belongs to (``"rating:song_id:<id>"``). Read endpoints derive their ETag and
+Last-Modified from the stamps they depend on, so an unchanged resource is
+answered with 304 before any aggregate query runs.
+
+Reads served from the read replica also depend on the ``replica`` stamp,
+which ``manage.py sync_replica`` bumps after each copy, and reads from the
+primary get their own token, so a result computed on a lagging replica is
+never served (or validated) as the primary's. A replica with no recorded
+copy (a PostgreSQL streaming replica) has an unknown lag: its responses get
+no validators and skip the result cache.
+
+Stamps live in the ``STATS_STAMP_CACHE`` cache alias (by default the
+``stats`` file cache, see ``stats.caching``). With several worker processes
+that alias must point to a shared backend, otherwise a worker may not see
+another worker's bumps.
+"""
+import functools
+import hashlib
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.views.decorators.http import condition
+
+from . import routers
+
+STAMP_PREFIX = "stats:stamp:"
+REPLICA_SCOPE = "replica"
+
+# Campos que definen los ámbitos de cada modelo además del global
+MODEL_SCOPES = {
+	"playback": ("song_id", "label_id"),
+	"albumsale": ("album_id", "label_id"),
+	"rating": ("song_id", "artist_id", "label_id"),
+}
+
+
+def _cache():
+	return caches[getattr(settings, "STATS_STAMP_CACHE", "default")]
+
+
+def _new_stamp():
+	return (f"{time.time_ns():x}-{uuid.uuid4().hex[:8]}", time.time())
+
+
+def scopes_for(instance) -> list[str]:
+	name = instance._meta.model_name
+	scopes = [name]
+	for field in MODEL_SCOPES.get(name, ()):
+		value = getattr(instance, field, None)
+		if value not in (None, ""):
+			scopes.append(f"{name}:{field}:{value}")
+	return scopes
+
+
+def bump(*scopes):
+	stamp = _new_stamp()
+	_cache().set_many({STAMP_PREFIX + s: stamp for s in scopes}, timeout=None)
+
+
+def bump_replica():
+	"""Record a replica copy (``sync_replica``): replica reads get new keys."""
+	bump(REPLICA_SCOPE)
+
+
+def replica_stamp():
+	"""Stamp of the last replica copy, or ``None`` if none is recorded."""
+	return _cache().get(STAMP_PREFIX + REPLICA_SCOPE)
+
+
+def unversioned(request) -> bool:
+	"""``True`` when ``request`` reads a replica with no recorded copy."""
+	found = getattr(request, "_stats_unversioned", None)
+	if found is None:
+		found = routers.reading_replica() and replica_stamp() is None
+		request._stats_unversioned = found
+	return found
+
+
+def get_stamps(scopes) -> list[tuple[str, float]]:
+	"""Return ``(token, timestamp)`` per scope, creating missing stamps.
+
+	A missing stamp (cold cache, eviction, restart) gets a fresh token, so the
+	worst case is one full response rather than a stale 304.
+	"""
+	cache = _cache()
+	keys = [STAMP_PREFIX + s for s in scopes]
+	found = cache.get_many(keys)
+	for key in keys:
+		if key not in found:
+			cache.add(key, _new_stamp(), timeout=None)
+			found[key] = cache.get(key) or _new_stamp()
+	return [found[k] for k in keys]
+
+
+def _request_stamps(request, scopes, kwargs):
+	cached = getattr(request, "_stats_stamps", None)
+	if cached is None:
+		cached = get_stamps([s.format(**kwargs) for s in scopes])
+		# Réplica: los datos son los de la última copia, no los de los sellos
+		if routers.reading_replica():
+			cached.append(replica_stamp() or ("replica", 0.0))
+		elif routers.replica_alias():
+			cached.append(("primary", 0.0))
+		request._stats_stamps = cached
+	return cached
+
+
+def conditional(*scopes):
+	"""Decorate a view with ETag/Last-Modified built from ``scopes``.
+
+	Scopes may use the view kwargs as placeholders, e.g.
+	``"rating:song_id:{song_id}"``. The ETag also covers the path and the
+	(sorted) query string, so different filters never share an ETag.
+	A ``Cache-Control: no-store`` response (degraded, see
+	``stats.content.degradable``) is sent without validators, so clients do
+	not revalidate it into 304s, and so is an ``unversioned`` replica read.
+	"""
+	def etag_func(request, *args, **kwargs):
+		stamps = _request_stamps(request, scopes, kwargs)
+		params = sorted((k, v) for k, values in request.GET.lists() for v in values)
+		raw = "|".join([request.path, repr(params)] + [token for token, _ in stamps])
+		return hashlib.blake2b(raw.encode(), digest_size=12).hexdigest()
+
+	def last_modified_func(request, *args, **kwargs):
+		stamps = _request_stamps(request, scopes, kwargs)
+		return datetime.fromtimestamp(max(ts for _, ts in stamps), tz=dt_timezone.utc)
+
+	def decorator(view):
+		conditional_view = condition(etag_func=etag_func, last_modified_func=last_modified_func)(view)
+
+		@functools.wraps(view)
+		def wrapper(request, *args, **kwargs):
+			if unversioned(request):
+				return view(request, *args, **kwargs)
+			response = conditional_view(request, *args, **kwargs)
+			if "no-store" in response.get("Cache-Control", ""):
+				response.headers.pop("ETag", None)
+				response.headers.pop("Last-Modified", None)
+			return response
+
+		return wrapper
+
+	return decorator
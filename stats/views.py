@@ -6,11 +6,20 @@ This file is self-contained and mirrors the implementation previously
 living under `backend_estadisticas.stats.views`. Keeping a full copy here
 avoids import-time circularities and makes `stats` the canonical app.
 """
+import asyncio
+import hashlib
+import json
+import os
+
+from asgiref.sync import sync_to_async
 from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse, StreamingHttpResponse
+from django.core.cache import cache
 from django.contrib.auth import get_user_model
-from django.utils.dateparse import parse_datetime
+from django.utils.dateparse import parse_date, parse_datetime
 from django.utils import timezone
-from django.db.models import Sum, Count, Case, When, IntegerField, Avg
+from django.db.models import Sum, Count, Case, When, IntegerField, Avg, Q
+from django.db.models.functions import TruncDate
 from django.core.exceptions import FieldError
 
 from rest_framework import status
@@ -20,23 +29,27 @@ from rest_framework.response import Response
 from rest_framework import generics
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 
-from .serializers import RatingSerializer
+from .fx import revenue_payload
+from .serializers import RatingSerializer, rating_rows, serialize_rating_rows
 
-from .permissions import IsDiscografica
-import requests
-from django.conf import settings
+from . import analytics, caching, content, live, retention, rollups, search, series, sharding, singleflight, sketches, tasks
+from .breaker import all_breakers, get_breaker
+from .caching import cached_result
+from .dedup import play_dedup
 
-
-import requests
-from django.conf import settings
+from .permissions import IsDiscografica
+from .resolution import known_canonical, schedule_resolution
+from .routers import replica_reads
+from .singleflight import single_flight
+from .versioning import conditional
 
 
 ID_FIELDS = ("id", "track_id", "song_id", "uuid")
 SEARCH_PARAMS = ("title", "search", "q")
 
-ROUTE_LINK = "http://127.0.0.1:8001/api/v1"
+ROUTE_LINK = content.DEFAULT_BASE
 
 
 def _extract_track_id(item: dict | None) -> str | None:
@@ -57,60 +70,39 @@ def _items_from_json(data):
     return data.get("items") or data.get("results") or []
 
 
-def _try_fetch_track_by_id(base_url: str, song_id: str) -> str | None:
-    try:
-        response = requests.get(f"{base_url}/tracks/{song_id}", timeout=2)
-        if not response.ok:
-            return None
+def _try_fetch_track_by_id(song_id: str, required: bool = False) -> str | None:
+    data = content.get_json(f"/tracks/{song_id}", timeout=2, required=required)
+    return _extract_track_id(data) if isinstance(data, dict) else None
 
-        return _extract_track_id(response.json())
-    except Exception:  # noqa: BLE001 - queremos tragarnos cualquier error aquí
-        return None
 
-
-def _search_track_candidates(base_url: str, song_id: str) -> list[str]:
+def _search_track_candidates(song_id: str, required: bool = False) -> list[str]:
     candidates: set[str] = set()
 
     for param in SEARCH_PARAMS:
-        try:
-            response = requests.get(
-                f"{base_url}/tracks",
-                params={param: song_id},
-                timeout=3,
-            )
-            if not response.ok:
-                continue
-
-            items = _items_from_json(response.json())
-            if not items:
-                continue
-
-            for item in items:
-                track_id = _extract_track_id(item)
-                if track_id:
-                    candidates.add(track_id)
-
-        except Exception:  # noqa: BLE001
+        data = content.get_json("/tracks", params={param: song_id}, timeout=3, required=required)
+        if not data:
             continue
 
+        for item in _items_from_json(data):
+            track_id = _extract_track_id(item)
+            if track_id:
+                candidates.add(track_id)
+
     return list(candidates)
 
 
-def normalize_song_id(song_id: str) -> str:
+def normalize_song_id(song_id: str, required: bool = False) -> str:
+    """Canonical track id for ``song_id``, or ``song_id`` itself if the
+    content service does not know it (or is down). With ``required`` an
+    unavailable service raises ``content.Unavailable`` instead."""
     if not song_id:
         return song_id
 
-    content_api = getattr(
-        settings,
-        "CONTENT_API_BASE",
-        ROUTE_LINK,
-    )
-
-    direct_id = _try_fetch_track_by_id(content_api, song_id)
+    direct_id = _try_fetch_track_by_id(song_id, required=required)
     if direct_id:
         return direct_id
 
-    candidates = _search_track_candidates(content_api, song_id)
+    candidates = _search_track_candidates(song_id, required=required)
     if len(candidates) == 1:
         return candidates[0]
 
@@ -136,6 +128,11 @@ except Exception:
         return _Rating
 
 
+Rating = get_rating_model()
+
+# Valoraciones sin artista: NULL o "" (el motor analítico descarta ambos igual)
+NO_ARTIST = Q(artist_id__isnull=True) | Q(artist_id="")
+
 TRUTHY = {"1", "true", "yes", "y", "t"}
 FALSY = {"0", "false", "no", "n", "f"}
 
@@ -146,6 +143,7 @@ def has_field(model, name: str) -> bool:
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@conditional("rating:song_id:{song_id}")
 def rating_by_song(request, song_id: str):
     __rating = get_rating_model()
     if __rating is None:
@@ -159,15 +157,20 @@ def rating_by_song(request, song_id: str):
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@conditional("rating:song_id:{song_id}")
 def song_aggregate(request, song_id: str):
     __rating = get_rating_model()
     if __rating is None:
         return Response({"song_id": song_id, "ratings_count": 0, "ratings_average": None}, status=200)
 
     try:
-        qs = Rating.objects.filter(song_id=song_id)
-        count = qs.count()
-        avg = qs.aggregate(avg=Avg("stars"))["avg"]
+        if analytics.enabled():
+            count, total = analytics.ratings.stats(song=song_id)
+            avg = total / count if count else None
+        else:
+            qs = Rating.objects.filter(song_id=song_id)
+            count = qs.count()
+            avg = qs.aggregate(avg=Avg("stars"))["avg"]
         return Response({"song_id": song_id, "ratings_count": count, "ratings_average": (round(float(avg), 4) if avg is not None else None)}, status=200)
     except Exception as e:
         return Response({"song_id": song_id, "ratings_count": 0, "ratings_average": None, "error": str(e)}, status=500)
@@ -175,6 +178,9 @@ def song_aggregate(request, song_id: str):
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@conditional("rating")
+@single_flight
+@content.degradable
 def artist_aggregate(request, artist_id: str):
     __rating = get_rating_model()
     if __rating is None:
@@ -187,14 +193,8 @@ def artist_aggregate(request, artist_id: str):
         if count:
             return Response({"artist_id": str(artist_id), "ratings_count": count, "ratings_average": (round(float(avg), 4) if avg is not None else None)}, status=200)
 
-        content_api = getattr(settings, "CONTENT_API_BASE", ROUTE_LINK)
         try:
-            r = requests.get(f"{content_api}/artists/{artist_id}/tracks", timeout=5)
-            if not r.ok:
-                return Response({"artist_id": str(artist_id), "ratings_count": 0, "ratings_average": None}, status=200)
-            tb = r.json()
-            items = tb if isinstance(tb, list) else (tb.get("items") or tb.get("results") or [])
-            tids = [str(tr.get("id") or tr.get("track_id") or tr.get("uuid") or tr.get("song_id")) for tr in items if (tr.get("id") or tr.get("track_id") or tr.get("uuid") or tr.get("song_id"))]
+            tids = _artist_track_ids(artist_id)
             if not tids:
                 return Response({"artist_id": str(artist_id), "ratings_count": 0, "ratings_average": None}, status=200)
 
@@ -208,19 +208,21 @@ def artist_aggregate(request, artist_id: str):
         return Response({"artist_id": str(artist_id), "ratings_count": 0, "ratings_average": None, "error": str(e)}, status=500)
 
 
+def _artist_track_ids(artist_id: str) -> list:
+    tb = content.get_json(f"/artists/{artist_id}/tracks", timeout=5)
+    if not tb:
+        return []
+    items = tb if isinstance(tb, list) else (tb.get("items") or tb.get("results") or [])
+    return [str(tr.get("id") or tr.get("track_id") or tr.get("uuid") or tr.get("song_id")) for tr in items if (tr.get("id") or tr.get("track_id") or tr.get("uuid") or tr.get("song_id"))]
+
+
 def _fetch_artists_meta_by_ids(ids_csv: str):
     meta = {}
     if not ids_csv:
         return meta
-    content_api = getattr(settings, "CONTENT_API_BASE", ROUTE_LINK)
     try:
-        r = requests.get(f"{content_api}/artists?ids={ids_csv}", timeout=5)
-        if r.ok:
-            try:
-                resp = r.json()
-            except Exception:
-                resp = None
-
+        resp = content.get_json(f"/artists?ids={ids_csv}", timeout=5)
+        if resp:
             artists_list = []
             if isinstance(resp, list):
                 artists_list = resp
@@ -238,12 +240,10 @@ def _fetch_artists_meta_by_ids(ids_csv: str):
         missing = [mid for mid in requested if mid not in meta]
         for mid in missing:
             try:
-                r2 = requests.get(f"{content_api}/artists/{mid}", timeout=4)
-                if r2.ok:
-                    a = r2.json()
-                    if a:
-                        key = a.get("id") or a.get("artist_id") or a.get("uuid") or mid
-                        meta[str(key)] = {"id": str(key), "name": a.get("name") or a.get("artist_name") or a.get("title"), **a}
+                a = content.get_json(f"/artists/{mid}", timeout=4)
+                if a:
+                    key = a.get("id") or a.get("artist_id") or a.get("uuid") or mid
+                    meta[str(key)] = {"id": str(key), "name": a.get("name") or a.get("artist_name") or a.get("title"), **a}
             except Exception:
                 continue
     except Exception:
@@ -252,25 +252,111 @@ def _fetch_artists_meta_by_ids(ids_csv: str):
     return meta
 
 
+def _enrich_with_artists(page: list):
+    """Add ``artist`` metadata to the items of ``page`` that have an ``artist_id``.
+
+    With background tasks only the cached metadata is used: the rest is
+    queued for an ``artist_meta`` task and the response marked degraded.
+    """
+    ids = ",".join([str(i.get("artist_id")) for i in page if i.get("artist_id")])
+    if not ids:
+        return
+    try:
+        if tasks.enabled():
+            # Solo lo que ya está en caché; lo demás lo trae un worker
+            artists_meta = tasks.cached_artist_meta(ids.split(","))
+            missing = sorted({i for i in ids.split(",") if i not in artists_meta})
+            if missing:
+                # Respuesta incompleta hasta que el worker los traiga
+                content.degrade()
+                key = hashlib.sha1(",".join(missing).encode()).hexdigest()
+                tasks.enqueue("artist_meta", key=key, ids=missing)
+        else:
+            artists_meta = _fetch_artists_meta_by_ids(ids)
+        for it in page:
+            aid = it.get("artist_id")
+            if aid and str(aid) in artists_meta:
+                it["artist"] = artists_meta[str(aid)]
+    except Exception:
+        pass
+
+
+LABEL_CACHE_PREFIX = "stats:track-label:"
+LABEL_CACHE_TTL = 3600
+
+
+def _fetch_label(song_id: str):
+    """Label of ``song_id`` from the content service, cached per song.
+
+    Raises ``content.Unavailable`` when the service cannot answer; that is
+    not cached, so the next call asks again.
+    """
+    key = LABEL_CACHE_PREFIX + str(song_id)
+    label = cache.get(key)
+    if label is not None:
+        return label or None
+    data = content.get_json(f"/tracks/{song_id}", timeout=2, required=True)
+    label = None
+    if isinstance(data, dict):
+        artist = data.get("artist") or {}
+        if isinstance(artist, dict):
+            label = artist.get("label_id") or (artist.get("label") or {}).get("label_id")
+    # "" recuerda que el tema no tiene discográfica y evita repetir la llamada
+    cache.set(key, str(label) if label else "", LABEL_CACHE_TTL)
+    return str(label) if label else None
+
+
+def _label_for_song(song_id: str):
+    """``_fetch_label`` for the request path: ``None`` while the service is unavailable."""
+    try:
+        return _fetch_label(song_id)
+    except content.Unavailable:
+        return None
+
+
+def _known_label(Playback, song_id: str):
+    """Label of ``song_id`` from the cache or an earlier play; otherwise a
+    ``playback_label`` task looks it up and fills it in later."""
+    known, label = tasks.cached_label(song_id)
+    if known:
+        return label
+    label = (
+        Playback.objects.filter(song_id=song_id).exclude(label_id__isnull=True).exclude(label_id="")
+        .values_list("label_id", flat=True).first()
+    )
+    if label:
+        cache.set(LABEL_CACHE_PREFIX + str(song_id), label, LABEL_CACHE_TTL)
+        return label
+    transaction.on_commit(lambda: tasks.enqueue_once("playback_label", key=str(song_id), song_id=str(song_id)))
+    return None
+
+
 @api_view(["GET", "POST", "DELETE"])
 @permission_classes([AllowAny])
 def plays_by_song(request, song_id: str):
+    # Con shards, todas las consultas de reproducciones van al shard del tema
+    with sharding.for_song(song_id):
+        return _song_plays(request, song_id)
+
+
+def _song_plays(request, song_id: str):
     Playback = get_playback_model()
 
     if request.method == "POST":
+        event_id = _event_id(request)
+        if event_id and has_field(Playback, "event_id"):
+            # El filtro responde "no visto" sin consultar la BD; solo un
+            # "quizá visto" (duplicado real o falso positivo) se confirma.
+            if play_dedup().seen(event_id) and Playback.objects.filter(event_id=event_id).exists():
+                return _duplicate_play(Playback, song_id, event_id)
+
         label = request.data.get("label_id") or request.headers.get("X-Label-Id") or request.META.get("HTTP_X_LABEL_ID")
 
         if not label and has_field(Playback, "label_id"):
-            try:
-                content_api = getattr(settings, "CONTENT_API_BASE", ROUTE_LINK)
-                url = f"{content_api}/tracks/{song_id}"
-                r = requests.get(url, timeout=2)
-                if r.ok:
-                    data = r.json()
-                    artist = data.get("artist") or {}
-                    label = artist.get("label_id") or artist.get("label", {}).get("label_id")
-            except Exception:
-                label = None
+            if tasks.enabled():
+                label = _known_label(Playback, song_id)
+            else:
+                label = _label_for_song(song_id)
 
         obj_kwargs = {"song_id": song_id}
         if has_field(Playback, "valid"):
@@ -279,9 +365,26 @@ def plays_by_song(request, song_id: str):
             obj_kwargs["played_at"] = timezone.now()
         if has_field(Playback, "label_id") and label:
             obj_kwargs["label_id"] = label
-
-        obj = Playback.objects.create(**obj_kwargs)
-        total = Playback.objects.filter(song_id=song_id).count()
+        try:
+            seconds = int(request.data.get("seconds") or 0)
+        except (TypeError, ValueError):
+            return Response({"detail": "seconds must be an integer"}, status=400)
+        if seconds > 0 and has_field(Playback, "seconds"):
+            obj_kwargs["seconds"] = seconds
+
+        if event_id and has_field(Playback, "event_id"):
+            obj_kwargs["event_id"] = event_id
+            try:
+                with transaction.atomic(using=sharding.alias()):
+                    Playback.objects.create(**obj_kwargs)
+            except IntegrityError:
+                # Reintento visto por otro worker o fuera de la ventana del filtro
+                play_dedup().add(event_id)
+                return _duplicate_play(Playback, song_id, event_id)
+            play_dedup().add(event_id)
+        else:
+            Playback.objects.create(**obj_kwargs)
+        total = _play_total(Playback, song_id)
         return Response({"song_id": song_id, "plays": total, "changed": +1}, status=201)
 
     if request.method == "DELETE":
@@ -293,117 +396,286 @@ def plays_by_song(request, song_id: str):
         last = qs.first()
         if last:
             last.delete()
-            total = Playback.objects.filter(song_id=song_id).count()
+            total = _play_total(Playback, song_id)
             return Response({"song_id": song_id, "plays": total, "changed": -1}, status=200)
         else:
-            total = Playback.objects.filter(song_id=song_id).count()
+            total = _play_total(Playback, song_id)
             return Response({"song_id": song_id, "plays": total, "changed": 0}, status=200)
 
     qs = Playback.objects.filter(song_id=song_id)
+    valid = None
 
     v = (request.query_params.get("valid") or "").lower()
     if v in TRUTHY:
         if has_field(Playback, "valid"):
             qs = qs.filter(valid=True)
+            valid = True
     elif v in FALSY:
         if has_field(Playback, "valid"):
             qs = qs.filter(valid=False)
+            valid = False
 
     f = request.query_params.get("from")
     t = request.query_params.get("to")
+    start = end = None
     if f:
         dt = parse_datetime(f)
         if dt and has_field(Playback, "played_at"):
             qs = qs.filter(played_at__gte=dt)
+            start = dt
     if t:
         dt = parse_datetime(t)
         if dt and has_field(Playback, "played_at"):
             qs = qs.filter(played_at__lte=dt)
+            end = dt
 
-    return Response({"song_id": song_id, "plays": qs.count()})
+    # Lo anterior al watermark de retención sale de los rollups diarios
+    if analytics.enabled():
+        raw = analytics.playbacks.count(song=song_id, valid=valid, start=start, end=end)
+    else:
+        raw = retention.raw_only(qs).count()
+    plays = raw + retention.compacted_plays(song_id, start, end, valid)
+    return Response({"song_id": song_id, "plays": plays})
+
+
+def _play_total(Playback, song_id: str) -> int:
+    return retention.raw_only(Playback.objects.filter(song_id=song_id)).count() + retention.compacted_plays(song_id)
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
-def sales_by_album(request, album_id: str):
-    AlbumSale = get_album_sale_model()
-    if AlbumSale is None:
-        return Response({"album_id": album_id, "sales_count": 0, "units_sold": 0, "revenue": 0, "last_purchase": None}, status=200)
-
+@replica_reads
+@conditional("playback")
+def top_songs(request):
+    """Most played songs in ``from``..``to``.
+
+    Merges the raw plays with the compacted history (daily rollups and the
+    columnar archive). ``valid`` filters like ``plays_by_song``; ``limit``
+    defaults to 20 (max 500).
+    """
+    Playback = get_playback_model()
+    params = request.query_params
+    start = parse_datetime(params.get("from") or "") if params.get("from") else None
+    end = parse_datetime(params.get("to") or "") if params.get("to") else None
     try:
-        qs = AlbumSale.objects.filter(album_id=album_id)
-        count = qs.count()
-        units = qs.aggregate(total_units=Sum('units'))['total_units'] or 0
-        revenue = qs.aggregate(total_amount=Sum('amount'))['total_amount'] or 0
-        last = qs.order_by("-purchased_at").first()
-        last_purchase = last.purchased_at.isoformat() if last and getattr(last, "purchased_at", None) else None
-        return Response({
-            "album_id": album_id,
-            "sales_count": count,
-            "units_sold": int(units),
-            "revenue": float(revenue) if revenue is not None else 0,
-            "last_purchase": last_purchase,
-        }, status=200)
-    except Exception as e:
-        return Response({"album_id": album_id, "sales_count": 0, "units_sold": 0, "revenue": 0, "last_purchase": None, "error": str(e)}, status=500)
+        limit = min(max(int(params.get("limit") or 20), 1), 500)
+    except ValueError:
+        return Response({"detail": "limit must be an integer"}, status=400)
+    v = (params.get("valid") or "").lower()
+    valid = True if v in TRUTHY else False if v in FALSY else None
+
+    def shard_counts():
+        qs = _range_filter(Playback.objects.all(), "played_at", start, end)
+        if valid is not None:
+            qs = qs.filter(valid=valid)
+        counts = retention.compacted_by_song(None, start, end, valid)
+        if analytics.enabled():
+            return counts
+        raw = {r["song_id"]: r["n"] for r in retention.raw_only(qs).order_by().values("song_id").annotate(n=Count("id"))}
+        return sharding.merge_counts([counts, raw])
+
+    # Un tema vive en un solo shard: sumar los parciales no duplica nada
+    parts = sharding.scatter(shard_counts)
+    if analytics.enabled():
+        # El motor ya tiene las filas crudas de todos los shards
+        parts.append(analytics.playbacks.count_by("song", valid=valid, start=start, end=end))
+    counts = sharding.merge_counts(parts)
+    items = sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+    return Response({
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "items": [{"song_id": song_id, "plays": n} for song_id, n in items],
+    })
+
+
+def _event_id(request):
+    raw = (
+        request.data.get("event_id")
+        or request.headers.get("Idempotency-Key")
+        or request.headers.get("X-Event-Id")
+        or ""
+    )
+    raw = str(raw).strip()
+    return raw[:64] or None
 
 
-def _collect_artist_aggregates(limit: int = None, offset: int = 0, sort: str = "count"):
-    __rating = get_rating_model()
-    if __rating is None:
-        return 0, []
+def _duplicate_play(Playback, song_id: str, event_id: str):
+    total = _play_total(Playback, song_id)
+    return Response(
+        {"song_id": song_id, "plays": total, "changed": 0, "duplicate": True, "event_id": event_id},
+        status=200,
+    )
 
-    qs = Rating.objects.values("artist_id").annotate(ratings_count=Count("id"), ratings_average=Avg("stars"))
 
-    if sort in ("count", "-count"):
-        qs = qs.order_by("-ratings_count")
-    elif sort in ("average", "-average"):
-        qs = qs.order_by("-ratings_average")
-    else:
-        qs = qs.order_by("-ratings_count")
-
-    total = qs.count()
-    if offset:
-        qs = qs[offset:]
-    if limit:
-        qs = qs[:limit]
-
-    items = []
-    ids = []
-    for row in qs:
-        aid = row.get("artist_id") or ""
-        ids.append(str(aid))
-        items.append({
-            "artist_id": str(aid),
-            "ratings_count": int(row.get("ratings_count") or 0),
-            "ratings_average": (round(float(row.get("ratings_average")), 4) if row.get("ratings_average") is not None else None),
-        })
-
-    if ids:
-        meta = _fetch_artists_meta_by_ids(",".join(ids))
-        for it in items:
-            a = meta.get(str(it["artist_id"]))
-            if a and a.get("name"):
-                it["name"] = a.get("name")
-
-    return total, items
+def _series_params(request):
+    params = request.query_params
+    start = parse_datetime(params.get("from") or "") if params.get("from") else None
+    end = parse_datetime(params.get("to") or "") if params.get("to") else None
+    return {
+        "interval": (params.get("interval") or "day").lower(),
+        "start": start,
+        "end": end,
+        "fill": (params.get("fill") or "1").lower() not in FALSY,
+        "cumulative": (params.get("cumulative") or "").lower() in TRUTHY,
+    }
+
+
+def _range_filter(qs, field: str, start, end):
+    if start:
+        qs = qs.filter(**{f"{field}__gte": start})
+    if end:
+        qs = qs.filter(**{f"{field}__lte": end})
+    return qs
 
 
 @api_view(["GET"])
 @permission_classes([AllowAny])
-def artists_ratings(request):
+@replica_reads
+@conditional("playback:song_id:{song_id}")
+def plays_series(request, song_id: str):
+    """Plays of a song per ``interval`` (hour|day|week|month) as parallel arrays.
+
+    ``from``/``to`` bound the range, ``valid`` filters like ``plays_by_song``,
+    ``fill=0`` skips gap filling and ``cumulative=1`` returns running totals.
+    """
+    Playback = get_playback_model()
+    opts = _series_params(request)
+    with sharding.for_song(song_id):
+        qs = _range_filter(Playback.objects.filter(song_id=song_id), "played_at", opts["start"], opts["end"])
+        valid = None
+        v = (request.query_params.get("valid") or "").lower()
+        if v in TRUTHY:
+            qs = qs.filter(valid=True)
+            valid = True
+        elif v in FALSY:
+            qs = qs.filter(valid=False)
+            valid = False
+        try:
+            rows = series.grouped_rows(retention.raw_only(qs), "played_at", opts["interval"], plays=Count("id"))
+            # Compactado: los días de rollup caen en el bucket de su primera hora
+            compacted = retention.compacted_rows(song_id, opts["interval"], opts["start"], opts["end"], valid)
+            if compacted:
+                rows = series.merge_rows(compacted + rows, opts["interval"], ["plays"])
+            buckets, values = series.dense_series(
+                rows, opts["interval"], ["plays"], opts["start"], opts["end"],
+                cumulative=opts["cumulative"], fill=opts["fill"],
+            )
+        except series.SeriesError as e:
+            return Response({"detail": str(e)}, status=400)
+    return Response({
+        "song_id": song_id,
+        "interval": opts["interval"],
+        "cumulative": opts["cumulative"],
+        "buckets": buckets,
+        **values,
+    })
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@replica_reads
+@conditional("albumsale:album_id:{album_id}")
+def sales_series(request, album_id: str):
+    """Sales, units and per-currency revenue of an album per ``interval``."""
+    AlbumSale = get_album_sale_model()
+    opts = _series_params(request)
+    qs = _range_filter(AlbumSale.objects.filter(album_id=album_id), "purchased_at", opts["start"], opts["end"])
     try:
-        limit = int(request.query_params.get("limit") or 0) or None
-    except Exception:
-        limit = None
+        rows = series.grouped_rows(qs, "purchased_at", opts["interval"], sales_count=Count("id"), units_sold=Sum("units"))
+        keys = series.bucket_keys(rows, opts["interval"])
+        grid = series.make_grid(keys, opts["interval"], opts["start"], opts["end"], opts["fill"])
+        columns = {f: series.place(grid, keys, [r[f] or 0 for r in rows]) for f in ("sales_count", "units_sold")}
+        # Ingresos: un GROUP BY (bucket, moneda) y una serie por moneda sobre la misma rejilla
+        by_currency = {}
+        for r in series.grouped_rows(qs, "purchased_at", opts["interval"], group_by=("currency",), amount=Sum("amount")):
+            by_currency.setdefault((r["currency"] or "").upper(), []).append(r)
+        for currency, cur_rows in by_currency.items():
+            columns[f"revenue:{currency}"] = series.place(
+                grid, series.bucket_keys(cur_rows, opts["interval"]), [float(r["amount"] or 0) for r in cur_rows],
+            )
+        buckets, values = series.render(grid, columns, opts["cumulative"])
+    except series.SeriesError as e:
+        return Response({"detail": str(e)}, status=400)
+    revenue = {k.split(":", 1)[1]: values.pop(k) for k in list(values) if k.startswith("revenue:")}
+    return Response({
+        "album_id": album_id,
+        "interval": opts["interval"],
+        "cumulative": opts["cumulative"],
+        "buckets": buckets,
+        **values,
+        "revenue_by_currency": revenue,
+    })
+
+
+def _revenue_groups(qs, ts_field: str, by_day: bool):
+    """``(currency, day, amount)`` sums of ``qs`` grouped in SQL.
+
+    Days are only needed to pick FX rates, so without normalization the
+    grouping is by currency alone and ``day`` is ``None``.
+    """
+    qs = qs.order_by()
+    if by_day:
+        rows = qs.annotate(day=TruncDate(ts_field)).values("currency", "day").annotate(total=Sum("amount"))
+        return [(r["currency"], r["day"], r["total"]) for r in rows]
+    rows = qs.values("currency").annotate(total=Sum("amount"))
+    return [(r["currency"], None, r["total"]) for r in rows]
+
+
+def _requested_fields(request, available) -> set:
+    """Fields listed in ``?fields=a,b``, or all of ``available`` without it.
+
+    Raises ``ValueError`` for names not in ``available``.
+    """
+    raw = request.query_params.get("fields")
+    if not raw:
+        return set(available)
+    wanted = {f.strip() for f in raw.split(",") if f.strip()}
+    unknown = wanted - set(available)
+    if unknown:
+        raise ValueError(f"unknown fields: {', '.join(sorted(unknown))} (available: {', '.join(available)})")
+    return wanted
+
+
+SALES_FIELDS = ("sales_count", "units_sold", "revenue", "last_purchase")
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@replica_reads
+@conditional("albumsale:album_id:{album_id}", "fx")
+@cached_result
+def sales_by_album(request, album_id: str):
+    """Sales totals of an album; ``fields`` limits them to some of ``SALES_FIELDS``."""
     try:
-        offset = int(request.query_params.get("offset") or 0) or 0
-    except Exception:
-        offset = 0
-    sort = request.query_params.get("sort") or "count"
+        fields = _requested_fields(request, SALES_FIELDS)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+    AlbumSale = get_album_sale_model()
+    if AlbumSale is None:
+        empty = {"sales_count": 0, "units_sold": 0, "revenue": 0, "last_purchase": None}
+        return Response({"album_id": album_id, **{k: v for k, v in empty.items() if k in fields}}, status=200)
 
-    total, items = _collect_artist_aggregates(limit=limit, offset=offset, sort=sort)
-    return Response({"total": total, "items": items}, status=200)
+    try:
+        qs = AlbumSale.objects.filter(album_id=album_id)
+        data = {"album_id": album_id}
+        # Solo se calcula lo pedido: un widget de contador no paga ingresos ni última compra
+        aggs = {}
+        if "sales_count" in fields:
+            aggs["sales_count"] = Count("id")
+        if "units_sold" in fields:
+            aggs["units_sold"] = Sum("units")
+        if aggs:
+            totals = qs.aggregate(**aggs)
+            data.update({k: int(v or 0) for k, v in totals.items()})
+        if "revenue" in fields:
+            normalize_to = request.query_params.get("normalize_to")
+            data.update(revenue_payload(_revenue_groups(qs, "purchased_at", by_day=bool(normalize_to)), normalize_to))
+        if "last_purchase" in fields:
+            last = qs.order_by("-purchased_at").values_list("purchased_at", flat=True).first()
+            data["last_purchase"] = last.isoformat() if last else None
+        return Response(data, status=200)
+    except Exception as e:
+        return Response({"album_id": album_id, "sales_count": 0, "units_sold": 0, "revenue": 0, "last_purchase": None, "error": str(e)}, status=500)
 
 
 @api_view(["GET"])
@@ -412,6 +684,37 @@ def artists_stats(request):
     return artists_ratings(request)
 
 
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@replica_reads
+@conditional("rating")
+def ratings_search(request):
+    """Ratings whose comment matches ``q``, best match first (see ``stats.search``).
+
+    Every word of ``q`` must appear; ``word*`` matches a prefix. ``song_id``
+    and ``artist_id`` filter, ``limit`` (max 100) and ``offset`` paginate.
+    Items are the rows of ``songs/<id>/ratings`` plus ``score``.
+    """
+    params = request.query_params
+    q = params.get("q") or ""
+    if not search.terms(q):
+        return Response({"detail": "q is required"}, status=400)
+    try:
+        limit = min(max(int(params.get("limit") or 20), 1), 100)
+        offset = max(int(params.get("offset") or 0), 0)
+    except ValueError:
+        return Response({"detail": "limit and offset must be integers"}, status=400)
+
+    total, hits = search.search(
+        q, song_id=params.get("song_id") or None, artist_id=params.get("artist_id") or None,
+        limit=limit, offset=offset,
+    )
+    rows = rating_rows(Rating.objects.filter(pk__in=[pk for pk, _ in hits]))
+    by_id = {row["id"]: row for row in serialize_rating_rows(rows)}
+    items = [{**by_id[pk], "score": score} for pk, score in hits if pk in by_id]
+    return Response({"q": q, "total": total, "limit": limit, "offset": offset, "items": items})
+
+
 class SongRatingsListCreateView(generics.ListCreateAPIView):
     serializer_class = RatingSerializer
 
@@ -422,15 +725,30 @@ class SongRatingsListCreateView(generics.ListCreateAPIView):
         song_id = self.kwargs.get("song_id")
         if __rating is None:
             return Rating.objects.none() if __rating is not None else []
-        return Rating.objects.filter(song_id=song_id).order_by("-rated_at")
+        return Rating.objects.filter(song_id=song_id).select_related("user").order_by("-rated_at")
+
+    def list(self, request, *args, **kwargs):
+        # Lectura por values(): una consulta y sin ModelSerializer por fila
+        rows = rating_rows(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(serialize_rating_rows(page))
+        return Response(serialize_rating_rows(rows))
 
     def perform_create(self, serializer):
         __rating = get_rating_model()
         if __rating is None:
             raise IntegrityError("Rating model not available")
 
-        song_id = self.kwargs.get("song_id")
-        canonical = normalize_song_id(song_id)
+        # No se llama al servicio de contenidos en la petición: el song_id se
+        # guarda tal cual y `stats.resolution` lo canonicaliza en segundo plano.
+        song_id = str(self.kwargs.get("song_id"))
+        canonical = known_canonical(song_id)
+        label = (
+            serializer.validated_data.get("label_id")
+            or self.request.headers.get("X-Label-Id")
+            or None
+        )
         User = get_user_model()
         req_user = getattr(self.request, "user", None)
         if req_user and getattr(req_user, "is_authenticated", False):
@@ -438,7 +756,13 @@ class SongRatingsListCreateView(generics.ListCreateAPIView):
         else:
             user_obj, _ = User.objects.get_or_create(username="anonymous", defaults={"is_active": False})
 
-        serializer.save(user=user_obj, song_id=str(canonical))
+        if tasks.enabled() and not serializer.validated_data.get("artist_id"):
+            transaction.on_commit(lambda: tasks.enqueue_once("rating_artists", key="pending"))
+        if canonical:
+            serializer.save(user=user_obj, song_id=canonical, resolution_pending=False, label_id=label)
+            return
+        serializer.save(user=user_obj, song_id=song_id, resolution_pending=True, label_id=label)
+        transaction.on_commit(schedule_resolution)
 
 
 class RatingDetailView(generics.RetrieveUpdateDestroyAPIView):
@@ -450,7 +774,7 @@ class RatingDetailView(generics.RetrieveUpdateDestroyAPIView):
         __rating = get_rating_model()
         if __rating is None:
             return []
-        return Rating.objects.all()
+        return Rating.objects.select_related("user")
 
     def get_object(self):
         return super().get_object()
@@ -462,101 +786,86 @@ class RatingDetailView(generics.RetrieveUpdateDestroyAPIView):
         instance.delete()
 
 
+GLOBAL_FIELDS = ("ratings_count", "ratings_average", "plays_count", "album_sales_count", "revenue")
+
+
 @api_view(["GET"])
 @permission_classes([AllowAny])
+@replica_reads
+@conditional("rating", "playback", "albumsale", "fx")
+@cached_result
+@single_flight
 def global_stats(request):
+    """Platform-wide totals; ``fields`` limits them to some of ``GLOBAL_FIELDS``."""
+    try:
+        fields = _requested_fields(request, GLOBAL_FIELDS)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
     __rating = get_rating_model()
     Playback = get_playback_model()
     AlbumSale = get_album_sale_model()
+    data = {}
 
-    try:
-        ratings_count = Rating.objects.count() if __rating is not None else 0
-        ratings_avg = Rating.objects.aggregate(avg=Avg("stars"))["avg"] if __rating is not None else None
-    except Exception:
-        ratings_count = 0
-        ratings_avg = None
+    if fields & {"ratings_count", "ratings_average"}:
+        try:
+            if __rating is not None and analytics.enabled():
+                ratings_count, total = analytics.ratings.stats()
+                ratings_avg = total / ratings_count if ratings_count else None
+            elif __rating is not None:
+                # Un solo recorrido para las dos cifras
+                agg = Rating.objects.aggregate(n=Count("id"), avg=Avg("stars"))
+                ratings_count, ratings_avg = agg["n"], agg["avg"]
+            else:
+                ratings_count, ratings_avg = 0, None
+        except Exception:
+            ratings_count = 0
+            ratings_avg = None
+        data["ratings_count"] = ratings_count
+        data["ratings_average"] = round(float(ratings_avg), 4) if ratings_avg is not None else None
 
-    try:
-        plays_count = Playback.objects.count() if Playback is not None else 0
-    except Exception:
-        plays_count = 0
+    if "plays_count" in fields:
+        try:
+            if Playback is None:
+                plays_count = 0
+            else:
+                if analytics.enabled():
+                    plays_count = analytics.playbacks.count() + sum(sharding.scatter(retention.compacted_plays))
+                else:
+                    plays_count = sum(sharding.scatter(
+                        lambda: retention.raw_only(Playback.objects.all()).count() + retention.compacted_plays()
+                    ))
+        except Exception:
+            plays_count = 0
+        data["plays_count"] = plays_count
 
-    try:
-        album_sales_count = AlbumSale.objects.count() if AlbumSale is not None else 0
-    except Exception:
-        album_sales_count = 0
+    if "album_sales_count" in fields:
+        try:
+            data["album_sales_count"] = AlbumSale.objects.count() if AlbumSale is not None else 0
+        except Exception:
+            data["album_sales_count"] = 0
 
-    return Response({
-        "ratings_count": ratings_count,
-        "ratings_average": (round(float(ratings_avg), 4) if ratings_avg is not None else None),
-        "plays_count": plays_count,
-        "album_sales_count": album_sales_count,
-    }, status=200)
+    if "revenue" in fields:
+        normalize_to = request.query_params.get("normalize_to")
+        try:
+            groups = _revenue_groups(AlbumSale.objects.all(), "purchased_at", by_day=bool(normalize_to)) if AlbumSale is not None else []
+        except Exception:
+            groups = []
+        data.update(revenue_payload(groups, normalize_to))
 
+    return Response({k: v for k, v in data.items() if k in fields or k not in GLOBAL_FIELDS}, status=200)
 
 
-@api_view(["GET"])
-@permission_classes([AllowAny])
-def artists_aggregate(request):
-    """Return per-artist rating aggregates.
 
-    This endpoint attempts to compute ratings_count and ratings_average per
-    artist using DB-side aggregation when the `artist_id` field exists on the
-    __rating model. For ratings that lack `artist_id`, it will attempt to resolve
-    the track -> artist mapping by calling the contenidos service in bulk and
-    include those ratings in the aggregation. The response shape is compatible
-    with the frontend expectations: { total, items: [ { artist_id, ratings_count, ratings_average, artist? } ] }
-    """
-    __rating = get_rating_model()
-    if __rating is None:
-        return Response({"detail": "Rating model not available."}, status=400)
-
-    qs = Rating.objects.all()
-    f = request.query_params.get("from")
-    t = request.query_params.get("to")
-    if f:
-        dt = parse_datetime(f)
-        if dt and has_field(Rating, "rated_at"):
-            qs = qs.filter(rated_at__gte=dt)
-    if t:
-        dt = parse_datetime(t)
-        if dt and has_field(Rating, "rated_at"):
-            qs = qs.filter(rated_at__lte=dt)
-
-    # First aggregate ratings that already have artist_id set
-    items_map = {}
-    if has_field(Rating, "artist_id"):
-        agg_known = qs.exclude(artist_id__isnull=True).values("artist_id").annotate(count=Count("id"), average=Avg("stars"))
-        for row in agg_known:
-            aid = row.get("artist_id")
-            if aid is None:
-                continue
-            # Keep a stable string key for lookups, but return a numeric id when possible
-            key = str(aid)
-            artist_id_value = aid
-            try:
-                if isinstance(aid, str) and aid.isdigit():
-                    artist_id_value = int(aid)
-            except Exception:
-                artist_id_value = aid
-            items_map[key] = {"artist_id": artist_id_value, "ratings_count": int(row.get("count") or 0), "ratings_average": round(float(row.get("average")), 2) if row.get("average") is not None else None}
-
-    # Now handle ratings without artist_id by resolving their song -> artist mapping
-    unknown_qs = qs.filter(artist_id__isnull=True).values("song_id").annotate(count=Count("id"), sum_stars=Sum("stars"))
+def resolve_song_artists(song_ids: list) -> dict:
+    """``{song_id: artist_id}`` from the content service (bulk, per track, then search)."""
     song_map = {}
-    song_ids = [str(r.get("song_id")) for r in unknown_qs if r.get("song_id")]
     if song_ids:
-        content_api = getattr(settings, "CONTENT_API_BASE", ROUTE_LINK)
         try:
             # Bulk fetch tracks metadata; try `tracks?ids=...` then fall back to per-track
             ids_csv = ",".join(song_ids)
-            r = requests.get(f"{content_api}/tracks?ids={ids_csv}", timeout=5)
+            resp = content.get_json(f"/tracks?ids={ids_csv}", timeout=5)
             tracks = []
-            if r.ok:
-                try:
-                    resp = r.json()
-                except Exception:
-                    resp = None
+            if resp:
                 if isinstance(resp, list):
                     tracks = resp
                 elif isinstance(resp, dict):
@@ -565,13 +874,9 @@ def artists_aggregate(request):
             if not tracks:
                 tracks = []
                 for sid in song_ids:
-                    try:
-                        r2 = requests.get(f"{content_api}/tracks/{sid}", timeout=3)
-                        if r2.ok:
-                            data = r2.json()
-                            tracks.append(data)
-                    except Exception:
-                        continue
+                    data = content.get_json(f"/tracks/{sid}", timeout=3)
+                    if data:
+                        tracks.append(data)
 
             for t in tracks:
                 if not t:
@@ -589,28 +894,16 @@ def artists_aggregate(request):
 
     # If some song_ids were not resolved by id, attempt a best-effort title search
     # using the contenidos `/tracks/search?q=` endpoint. Only accept unique matches.
-    unresolved = [str(r.get("song_id")) for r in unknown_qs if r.get("song_id") and str(r.get("song_id")) not in song_map]
+    unresolved = [sid for sid in song_ids if sid not in song_map]
     if unresolved:
         try:
             for sid in unresolved:
                 # skip obviously numeric ids (already attempted) but keep titles and mixed strings
                 if str(sid).isdigit():
                     continue
-                try:
-                    r2 = requests.get(f"{content_api}/tracks/search?q={requests.utils.requote_uri(str(sid))}", timeout=3)
-                except Exception:
-                    # fall back to simple encode
-                    from urllib.parse import quote_plus
-                    try:
-                        r2 = requests.get(f"{content_api}/tracks/search?q={quote_plus(str(sid))}", timeout=3)
-                    except Exception:
-                        continue
-                if not r2.ok:
+                resp = content.get_json("/tracks/search", params={"q": str(sid)}, timeout=3)
+                if not resp:
                     continue
-                try:
-                    resp = r2.json()
-                except Exception:
-                    resp = None
                 items = []
                 if isinstance(resp, dict):
                     items = resp.get('items') or resp.get('results') or []
@@ -629,6 +922,82 @@ def artists_aggregate(request):
             # non-fatal: proceed with whatever mapping we have
             pass
 
+    return song_map
+
+
+ARTIST_FIELDS = ("ratings_count", "ratings_average", "artist", "resolved")
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@replica_reads
+@conditional("rating", "artistmeta")
+@cached_result
+@single_flight
+@content.degradable
+def artists_aggregate(request):
+    """Return per-artist rating aggregates.
+
+    This endpoint attempts to compute ratings_count and ratings_average per
+    artist using DB-side aggregation when the `artist_id` field exists on the
+    __rating model. For ratings that lack `artist_id`, it will attempt to resolve
+    the track -> artist mapping by calling the contenidos service in bulk and
+    include those ratings in the aggregation. The response shape is compatible
+    with the frontend expectations: { total, items: [ { artist_id, ratings_count, ratings_average, artist? } ] }
+
+    `fields` limits the item keys to some of ``ARTIST_FIELDS``. Leaving out
+    `resolved` counts only ratings that already have `artist_id` (no call to
+    the content service); leaving out `artist` skips `enrich`.
+    """
+    __rating = get_rating_model()
+    if __rating is None:
+        return Response({"detail": "Rating model not available."}, status=400)
+    try:
+        fields = _requested_fields(request, ARTIST_FIELDS)
+    except ValueError as e:
+        return Response({"detail": str(e)}, status=400)
+
+    qs = Rating.objects.all()
+    f = request.query_params.get("from")
+    t = request.query_params.get("to")
+    if f:
+        dt = parse_datetime(f)
+        if dt and has_field(Rating, "rated_at"):
+            qs = qs.filter(rated_at__gte=dt)
+    if t:
+        dt = parse_datetime(t)
+        if dt and has_field(Rating, "rated_at"):
+            qs = qs.filter(rated_at__lte=dt)
+
+    # First aggregate ratings that already have artist_id set
+    items_map = {}
+    if has_field(Rating, "artist_id"):
+        agg_known = qs.exclude(NO_ARTIST).values("artist_id").annotate(count=Count("id"), average=Avg("stars"))
+        for row in agg_known:
+            aid = row.get("artist_id")
+            if aid is None:
+                continue
+            # Keep a stable string key for lookups, but return a numeric id when possible
+            key = str(aid)
+            artist_id_value = aid
+            try:
+                if isinstance(aid, str) and aid.isdigit():
+                    artist_id_value = int(aid)
+            except Exception:
+                artist_id_value = aid
+            items_map[key] = {"artist_id": artist_id_value, "ratings_count": int(row.get("count") or 0), "ratings_average": round(float(row.get("average")), 2) if row.get("average") is not None else None}
+
+    # Now handle ratings without artist_id by resolving their song -> artist mapping
+    unknown_qs = []
+    if "resolved" in fields:
+        unknown_qs = qs.filter(NO_ARTIST).values("song_id").annotate(count=Count("id"), sum_stars=Sum("stars"))
+    song_map = {}
+    song_ids = [str(r.get("song_id")) for r in unknown_qs if r.get("song_id")]
+    # Con tareas, `rating_artists` (encolada al escribir) guarda el artist_id;
+    # hasta entonces esas valoraciones no se atribuyen
+    if song_ids and not tasks.enabled():
+        song_map = resolve_song_artists(song_ids)
+
     for row in unknown_qs:
         sid = row.get("song_id")
         if not sid:
@@ -671,22 +1040,20 @@ def artists_aggregate(request):
     page = items[offset: offset + limit]
 
     # Optional enrichment
-    if request.query_params.get("enrich") and page:
-        ids = ",".join([str(i.get("artist_id")) for i in page if i.get("artist_id")])
-        if ids:
-            try:
-                artists_meta = _fetch_artists_meta_by_ids(ids)
-                for it in page:
-                    aid = it.get("artist_id")
-                    if aid and str(aid) in artists_meta:
-                        it["artist"] = artists_meta[str(aid)]
-            except Exception:
-                pass
+    if request.query_params.get("enrich") and page and "artist" in fields:
+        _enrich_with_artists(page)
 
+    if fields != set(ARTIST_FIELDS):
+        page = [{k: v for k, v in it.items() if k == "artist_id" or k in fields} for it in page]
     return Response({"total": total, "limit": limit, "offset": offset, "items": page})
 
 @api_view(["GET"])
 @permission_classes([IsDiscografica])
+@replica_reads
+@conditional("rating")
+@cached_result
+@single_flight
+@content.degradable
 def artists_ratings(request):
     """Return aggregated ratings per artist.
 
@@ -702,6 +1069,7 @@ def artists_ratings(request):
         return Response({"detail": "Rating model not available."}, status=400)
 
     qs = Rating.objects.all()
+    start = end = None
 
     f = request.query_params.get("from")
     t = request.query_params.get("to")
@@ -709,10 +1077,12 @@ def artists_ratings(request):
         dt = parse_datetime(f)
         if dt and has_field(Rating, "rated_at"):
             qs = qs.filter(rated_at__gte=dt)
+            start = dt
     if t:
         dt = parse_datetime(t)
         if dt and has_field(Rating, "rated_at"):
             qs = qs.filter(rated_at__lte=dt)
+            end = dt
 
     # We'll compute artist aggregates including ratings that lack artist_id by
     # resolving song_id -> artist via the contenidos service (best-effort).
@@ -720,7 +1090,13 @@ def artists_ratings(request):
 
     # First aggregate ratings that already have artist_id set (DB-side)
     if has_field(Rating, "artist_id"):
-        agg_known = qs.exclude(artist_id__isnull=True).values("artist_id").annotate(count=Count("id"), average=Avg("stars"))
+        if analytics.enabled():
+            agg_known = [
+                {"artist_id": aid, "count": n, "average": total / n}
+                for aid, (n, total) in analytics.ratings.stats_by("artist", start, end).items()
+            ]
+        else:
+            agg_known = qs.exclude(NO_ARTIST).values("artist_id").annotate(count=Count("id"), average=Avg("stars"))
         for row in agg_known:
             aid = row.get("artist_id")
             if aid is None:
@@ -731,48 +1107,15 @@ def artists_ratings(request):
                 "ratings_average": round(float(row.get("average")), 2) if row.get("average") is not None else None,
             }
 
-    # Now handle ratings without artist_id by mapping song_id -> artist
-    unknown_qs = qs.filter(artist_id__isnull=True).values("song_id").annotate(count=Count("id"), sum_stars=Sum("stars"))
-    song_ids = [str(r.get("song_id")) for r in unknown_qs if r.get("song_id")]
+    # Now handle ratings without artist_id by mapping song_id -> artist. With
+    # tasks, `rating_artists` stores the artist_id and only the column is read.
+    unknown_qs = []
     song_map = {}
-    if song_ids:
-        content_api = getattr(settings, "CONTENT_API_BASE", ROUTE_LINK)
-        try:
-            ids_csv = ",".join(song_ids)
-            r = requests.get(f"{content_api}/tracks?ids={ids_csv}", timeout=5)
-            tracks = []
-            if r.ok:
-                try:
-                    resp = r.json()
-                except Exception:
-                    resp = None
-                if isinstance(resp, list):
-                    tracks = resp
-                elif isinstance(resp, dict):
-                    tracks = resp.get("items") or resp.get("results") or []
-            if not tracks:
-                tracks = []
-                for sid in song_ids:
-                    try:
-                        r2 = requests.get(f"{content_api}/tracks/{sid}", timeout=3)
-                        if r2.ok:
-                            data = r2.json()
-                            tracks.append(data)
-                    except Exception:
-                        continue
-
-            for t in tracks:
-                if not t:
-                    continue
-                sid = t.get("id") or t.get("song_id") or t.get("track_id") or t.get("uuid")
-                artist = None
-                if isinstance(t.get("artist"), dict):
-                    artist = t["artist"].get("id") or t["artist"].get("artist_id")
-                artist = artist or t.get("artist_id") or t.get("artistId")
-                if sid:
-                    song_map[str(sid)] = str(artist) if artist is not None else None
-        except Exception:
-            song_map = {}
+    if not tasks.enabled():
+        unknown_qs = qs.filter(NO_ARTIST).values("song_id").annotate(count=Count("id"), sum_stars=Sum("stars"))
+        song_ids = [str(r.get("song_id")) for r in unknown_qs if r.get("song_id")]
+        if song_ids:
+            song_map = resolve_song_artists(song_ids)
 
     # Merge unknown-song aggregates into artist buckets using sums
     for row in unknown_qs:
@@ -808,18 +1151,188 @@ def artists_ratings(request):
     page = items[offset: offset + limit]
 
     if request.query_params.get("enrich") and page:
-        ids = ",".join([str(i.get("artist_id")) for i in page if i.get("artist_id")])
-        if ids:
-            try:
-                artists_meta = _fetch_artists_meta_by_ids(ids)
-                for it in page:
-                    aid = it.get("artist_id")
-                    if aid and str(aid) in artists_meta:
-                        it["artist"] = artists_meta[str(aid)]
-            except Exception:
-                pass
+        _enrich_with_artists(page)
 
     return Response({"total": total, "limit": limit, "offset": offset, "items": page})
 
 
+def _parse_day(value):
+    if not value:
+        return None
+    day = parse_date(value)
+    if day:
+        return day
+    dt = parse_datetime(value)
+    return dt.date() if dt else None
+
+
+@api_view(["GET"])
+@permission_classes([IsDiscografica])
+@replica_reads
+@conditional("playback:label_id:{label_id}", "albumsale:label_id:{label_id}", "rating:label_id:{label_id}", "fx")
+def label_summary(request, label_id: str):
+    """Plays, sales, revenue and ratings of a label's catalog from the daily rollups.
+
+    Query params ``from`` / ``to`` (dates, inclusive) bound the range and
+    ``normalize_to`` (e.g. ``EUR``) converts revenue with the FX table.
+    """
+    start = _parse_day(request.query_params.get("from"))
+    end = _parse_day(request.query_params.get("to"))
+    totals = rollups.label_summary(label_id, start, end)
+    revenue = revenue_payload(totals["revenue_groups"], request.query_params.get("normalize_to"))
+    count = totals["ratings_count"]
+    return Response({
+        "label_id": label_id,
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "plays": totals["plays"],
+        "sales_count": totals["sales_count"],
+        "units_sold": totals["units_sold"],
+        **revenue,
+        "ratings_count": count,
+        "ratings_average": round(totals["ratings_sum"] / count, 4) if count else None,
+    })
+
+
+def _duration_payload(request, digest, start, end) -> dict:
+    raw = request.query_params.get("q") or "0.5,0.9"
+    quantiles = {}
+    for part in raw.split(","):
+        try:
+            q = float(part)
+        except ValueError:
+            continue
+        if 0 <= q <= 1:
+            value = digest.quantile(q)
+            quantiles[f"p{q * 100:g}"] = round(value, 2) if value is not None else None
+    mean = digest.mean()
+    return {
+        "from": start.isoformat() if start else None,
+        "to": end.isoformat() if end else None,
+        "listens": int(digest.count),
+        "mean_seconds": round(mean, 2) if mean is not None else None,
+        "quantiles": quantiles,
+    }
+
 
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@replica_reads
+@conditional("playback:song_id:{song_id}")
+def song_listen_duration(request, song_id: str):
+    """Listen duration quantiles of a song from its daily t-digest sketches.
+
+    ``from`` / ``to`` (dates, inclusive) bound the range; ``q`` lists the
+    quantiles (default ``0.5,0.9``). Plays without ``seconds`` are not counted.
+    """
+    start = _parse_day(request.query_params.get("from"))
+    end = _parse_day(request.query_params.get("to"))
+    digest = sketches.merged_digest([song_id], start, end)
+    return Response({"song_id": song_id, **_duration_payload(request, digest, start, end)})
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+@replica_reads
+@conditional("playback")
+def artist_listen_duration(request, artist_id: str):
+    """Listen duration quantiles over the tracks of an artist (content service)."""
+    start = _parse_day(request.query_params.get("from"))
+    end = _parse_day(request.query_params.get("to"))
+    tids = _artist_track_ids(artist_id)
+    digest = sketches.merged_digest(tids, start, end)
+    return Response({"artist_id": str(artist_id), "songs": len(tids), **_duration_payload(request, digest, start, end)})
+
+
+@api_view(["GET"])
+@permission_classes([AllowAny])
+def metrics(request):
+    """Operational metrics of the worker process that answers the request."""
+    get_breaker(content.BREAKER)
+    return Response({
+        "pid": os.getpid(),
+        "breakers": {name: b.snapshot() for name, b in all_breakers().items()},
+        "live": live.broker.snapshot(),
+        "analytics": analytics.snapshot() if analytics.enabled() else None,
+        "singleflight": singleflight.group.snapshot(),
+        "result_cache": caching.snapshot(),
+        "tasks": tasks.snapshot() if tasks.enabled() else None,
+    })
+
+
+def _sse(event: str, data, event_id: int) -> str:
+    return f"id: {event_id}\nevent: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+async def _live_events(keys, interval: float):
+    heartbeat = getattr(settings, "STATS_LIVE_HEARTBEAT_SECONDS", 15)
+    resync = getattr(settings, "STATS_LIVE_RESYNC_SECONDS", 60)
+    sub = live.broker.subscribe(keys)
+    try:
+        state = await sync_to_async(live.read_counters)(sub.keys)
+        # Lo publicado durante la lectura ya está en el snapshot
+        live.broker.drain(sub)
+        seq = 1
+        yield _sse("snapshot", [live.event_payload(k, v) for k, v in sorted(state.items())], seq)
+        idle = since_resync = 0.0
+        while True:
+            await asyncio.sleep(interval)
+            since_resync += interval
+            changed = []
+            if resync and since_resync >= resync:
+                fresh = await sync_to_async(live.read_counters)(sub.keys)
+                live.broker.drain(sub)
+                changed = [k for k in fresh if fresh[k] != state.get(k)]
+                state, since_resync = fresh, 0.0
+            else:
+                for key, deltas in live.broker.drain(sub).items():
+                    if not any(deltas.values()):
+                        continue
+                    counters = state[key]
+                    for field, value in deltas.items():
+                        counters[field] = counters.get(field, 0) + value
+                    changed.append(key)
+            if changed:
+                idle = 0.0
+                for key in sorted(changed):
+                    seq += 1
+                    yield _sse("counters", live.event_payload(key, state[key]), seq)
+            else:
+                idle += interval
+                if idle >= heartbeat:
+                    idle = 0.0
+                    yield ": ping\n\n"
+    finally:
+        live.broker.unsubscribe(sub)
+
+
+async def live_stream(request):
+    """Server-Sent Events with live play, rating and sales counters.
+
+    ``songs`` and ``albums`` are comma-separated ids. The first event is a
+    ``snapshot`` of every key; after that a ``counters`` event is sent for a
+    key at most once per ``interval`` seconds, and only when it changed.
+    Meant to be served by the ASGI application.
+    """
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    params = request.GET
+    keys = {(live.SONG, s) for s in (params.get("songs") or "").split(",") if s.strip()}
+    keys |= {(live.ALBUM, a) for a in (params.get("albums") or "").split(",") if a.strip()}
+    keys = {(kind, ident.strip()) for kind, ident in keys}
+    if not keys:
+        return JsonResponse({"detail": "songs or albums is required"}, status=400)
+    max_keys = getattr(settings, "STATS_LIVE_MAX_KEYS", 500)
+    if len(keys) > max_keys:
+        return JsonResponse({"detail": f"at most {max_keys} keys per stream"}, status=400)
+    try:
+        interval = float(params.get("interval") or getattr(settings, "STATS_LIVE_INTERVAL", 1.0))
+    except ValueError:
+        return JsonResponse({"detail": "interval must be a number of seconds"}, status=400)
+    interval = min(max(interval, 0.25), 60.0)
+
+    response = StreamingHttpResponse(_live_events(keys, interval), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    # Evita que nginx acumule el stream
+    response["X-Accel-Buffering"] = "no"
+    return response